@@ -1,30 +1,94 @@
 import streamlit as st
-import firebase_admin
-from firebase_admin import credentials, firestore
+from google.cloud import firestore
 from datetime import datetime
 import json
-import pandas as pd
+import hashlib
+import itertools
+import os
+import uuid
+from snapshot_cache import SnapshotCache
+from search_index import CatalogSearch
+import inventory_ops
+import catalog_import
+import catalog_sync
+import ledger
+import rollups
+import locations
+import pick_route
+import forecast
+import sites
+from pagination import QueryPager, PAGE_SIZE, PAGE_SIZES
+from audit_log import LogSink
+import export
+import storage
+from metering import MeteredClient, RerunProfile, BranchStats, JsonlWriter
+from write_queue import WriteQueue, QUEUE_PATH
 
 # --- הגדרות תצוגה ---
 st.set_page_config(page_title="ניהול מלאי שרוולים", layout="centered")
 
-# --- 1. התחברות ל-Firebase ---
-if not firebase_admin._apps:
-    try:
-        if "firebase" in st.secrets:
-            key_dict = dict(st.secrets["firebase"])
-            if "private_key" in key_dict:
-                key_dict["private_key"] = key_dict["private_key"].replace("\\n", "\n")
-            cred = credentials.Certificate(key_dict)
-            firebase_admin.initialize_app(cred)
-        else:
-            cred = credentials.Certificate("serviceAccountKey.json")
-            firebase_admin.initialize_app(cred)
-    except Exception as e:
-        st.error(f"❌ שגיאה בהתחברות ל-Firebase: {e}")
-        st.stop()
+# --- 1. התחברות למסד הנתונים ---
+# WAREHOUSE_BACKEND=memory|sqlite מריץ את האפליקציה מעל מנוע מקומי (storage.py) -
+# לפיתוח ובדיקות בלי Firebase; ברירת המחדל היא Firestore.
+# הלקוח עטוף ב-MeteredClient - ספירת קריאות/כתיבות לכל ריצה ולכל מסך.
+# firebase_admin (ואיתו google.auth) נטען רק כאן, פעם אחת לתהליך - cache_resource
+# שומר את הלקוח והרשאות הגישה בין ריצות ובין משתמשים
+BACKEND = os.environ.get("WAREHOUSE_BACKEND", "firestore")
+
+@st.cache_resource
+def get_db(backend):
+    if backend != "firestore":
+        return MeteredClient(storage.open_backend(backend, os.environ.get("WAREHOUSE_SQLITE", "warehouse.db")))
+    import firebase_admin
+    from firebase_admin import credentials, firestore as admin_firestore
+    if not firebase_admin._apps:
+        try:
+            if "firebase" in st.secrets:
+                key_dict = dict(st.secrets["firebase"])
+                if "private_key" in key_dict:
+                    key_dict["private_key"] = key_dict["private_key"].replace("\\n", "\n")
+                cred = credentials.Certificate(key_dict)
+                firebase_admin.initialize_app(cred)
+            else:
+                cred = credentials.Certificate("serviceAccountKey.json")
+                firebase_admin.initialize_app(cred)
+        except Exception as e:
+            st.error(f"❌ שגיאה בהתחברות ל-Firebase: {e}")
+            st.stop()
+    return MeteredClient(admin_firestore.client())
+
+try:
+    db = get_db(BACKEND)
+except ValueError as e:
+    st.error(f"❌ {e}")
+    st.stop()
+
+# מטמון ואינדקס חיפוש לכל אתר (sites.py) - מאזינים רק לשורות המלאי של האתר; None - כל האתרים.
+# נוצרים אחרי הכניסה, כשהאתר של המשתמש ידוע
+@st.cache_resource
+def get_cache(site):
+    return SnapshotCache(db, site=site)
+
+@st.cache_resource
+def get_search(site):
+    index = CatalogSearch()
+    get_cache(site).subscribe(index.on_change)
+    return index
+
+@st.cache_resource
+def get_log_sink():
+    return LogSink(db)
+
+log_sink = get_log_sink()
 
-db = firestore.client()
+# תור כתיבות מקומי: פעולות מלאי שנכשלו בגלל תקשורת נשמרות ונשלחות כשהחיבור חוזר.
+# הקריאות ממשיכות מהמטמון המקומי (SnapshotCache), כך שהעבודה לא נעצרת
+@st.cache_resource
+def get_outbox():
+    return WriteQueue(db, os.environ.get("WAREHOUSE_QUEUE", QUEUE_PATH))
+
+outbox = get_outbox()
+OFFLINE_MSG = "📴 אין חיבור - הפעולה נשמרה ותישלח אוטומטית כשהחיבור יחזור"
 
 # --- זיכרון משתמש ---
 if 'logged_in' not in st.session_state:
@@ -38,15 +102,285 @@ if 'edit_item_id' not in st.session_state:
 if 'active_action' not in st.session_state:
     st.session_state['active_action'] = None
 
+# --- מדידת ריצות ---
+# WAREHOUSE_METRICS_FILE - קובץ JSON-lines עם רשומה לכל ריצה (זמן, מסך, קריאות, כתיבות)
+@st.cache_resource
+def get_profiling():
+    path = os.environ.get("WAREHOUSE_METRICS_FILE")
+    return BranchStats(), JsonlWriter(path) if path else None
+
+branch_stats, metrics_file = get_profiling()
+
+def finish_profile(interrupted=False):
+    prof = st.session_state.pop('_profile', None)
+    if prof is None:
+        return
+    record = prof.finish(interrupted)
+    branch_stats.add(record)
+    st.session_state['last_profile'] = record
+    if metrics_file:
+        metrics_file.write(record)
+
+# ריצה קודמת שנקטעה ב-st.rerun / st.stop לא הגיעה לסוף הסקריפט - נסגרת כאן
+finish_profile(interrupted=True)
+st.session_state['_profile'] = RerunProfile(db.meter, role=st.session_state['user_role'] or None)
+
 # --- פונקציות עזר ---
-def log_action(action, details):
-    db.collection("Logs").add({
+def log_entry(action, details):
+    return {
         "timestamp": datetime.now(),
         "user": st.session_state.get('user_email', 'Guest'),
         "role": st.session_state.get('user_role', 'None'),
         "action": action,
-        "details": details
+        "details": details,
+        "site": write_site()
+    }
+
+def log_action(action, details):
+    # נכתב ברקע ב-batch - לא מוסיף סבב רשת לפעולת המשתמש
+    log_sink.write(log_entry(action, details))
+
+def submit(action, payload, key=None):
+    # (True, תוצאה) אם נכתב עכשיו, (False, None) אם נשמר בתור; המטמון מתעדכן בכל מקרה
+    sent, result = outbox.submit(action, payload, key)
+    if not sent:
+        st.toast(OFFLINE_MSG)
+    return sent, result
+
+# --- עגלת ליקוט: שורות נצברות בין חיפושים ונשלחות יחד בטרנזקציה אחת ---
+def cart():
+    return st.session_state.setdefault('cart', {})
+
+def add_to_cart(loc_id, data, qty):
+    line = cart().setdefault(loc_id, {
+        "item_name": data['item_name'], "item_id": data.get('item_id'), "warehouse": data['warehouse'],
+        "site": data.get('site') or warehouse_site(data['warehouse']), "quantity": 0
     })
+    line['quantity'] += int(qty)
+    st.session_state.pop(f"cart_qty_{loc_id}", None)
+    st.toast(f"🛒 {data['item_name']} נוסף לעגלה ({line['quantity']})")
+
+def clear_cart():
+    for loc_id in cart():
+        st.session_state.pop(f"cart_qty_{loc_id}", None)
+    st.session_state.pop('cart', None)
+    st.session_state.pop('cart_id', None)
+
+def cart_panel():
+    lines = cart()
+    if not lines:
+        return
+    with st.container(border=True):
+        st.markdown(f"**🛒 עגלת ליקוט - {len(lines)} פריטים**")
+        for loc_id, line in list(lines.items()):
+            c1, c2, c3 = st.columns([4, 2, 1])
+            c1.write(f"{line['item_name']} | {line['warehouse']}")
+            line['quantity'] = c2.number_input("כמות", min_value=1, step=1, value=line['quantity'], key=f"cart_qty_{loc_id}", label_visibility="collapsed")
+            if c3.button("🗑️", key=f"cart_rm_{loc_id}"):
+                st.session_state.pop(f"cart_qty_{loc_id}", None)
+                del lines[loc_id]
+                st.rerun()
+        reason = st.text_input("סיבה / שרוול (לכל העגלה)", key="cart_reason")
+        b1, b2 = st.columns(2)
+        if b1.button(f"📤 שלח עגלה ({len(lines)})", type="primary", key="cart_send"):
+            # מזהה העגלה נשמר עד שליחה מוצלחת - לחיצה כפולה או שליחה חוזרת לא יוצרות כפילויות
+            cart_id = st.session_state.setdefault('cart_id', uuid.uuid4().hex)
+            try:
+                sent, _ = submit("cart", {"lines": lines, "request": {"user_email": st.session_state['user_email'], "reason": reason}}, key=cart_id)
+                log_action("בקשת משיכה", f"עגלה של {len(lines)} פריטים")
+                get_counts.clear()
+                clear_cart()
+                if sent:
+                    st.success(f"נשלחו {len(lines)} בקשות!")
+                else:
+                    st.warning(OFFLINE_MSG)
+            except inventory_ops.CartInvalid as e:
+                for msg in e.problems.values():
+                    st.error(msg)
+        if b2.button("רוקן עגלה", key="cart_clear"):
+            clear_cart()
+            st.rerun()
+
+# --- אתרים: האתר הפעיל נבחר בסרגל הצד; None - תצוגה חוצת אתרים ---
+@st.cache_data(ttl=60, show_spinner=False)
+def sites_ready():
+    # עד שההסבה (sites.migrate) הושלמה למסמכים הישנים אין site - כל הנתונים מוצגים כאתר אחד
+    job = db.collection("Migrations").document(sites.MIGRATION_JOB).get()
+    return bool(job.exists and job.get('done'))
+
+def view_site():
+    site = st.session_state.get('site')
+    return None if site in (None, sites.ALL_SITES) or not sites_ready() else site
+
+def write_site():
+    # האתר שנרשם על רשומת יומן - הפעיל, ובתצוגה חוצת אתרים אתר הבית של המשתמש
+    return view_site() or sites.home(st.session_state.get('user_sites', []))
+
+def warehouse_site(name):
+    return sites.warehouse_sites(cache.get("Warehouses")).get(name, sites.DEFAULT_SITE)
+
+def site_warehouses():
+    site = view_site()
+    return {w_id: w for w_id, w in cache.get("Warehouses").items() if site is None or (w.get('site') or sites.DEFAULT_SITE) == site}
+
+def switch_site():
+    # נתוני האתר הקודם (דפים, עגלה, תוצאות) לא שייכים לאתר החדש
+    st.session_state['active_action'] = None
+    for k in [k for k in st.session_state.keys() if k.startswith(('pager_', 'pg_', 'cart', 'pick_', 'fc_'))]:
+        del st.session_state[k]
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_sites():
+    return sites.known_sites({d.id: d.to_dict() for d in db.collection("Warehouses").stream()})
+
+def all_inventory():
+    # כל שורות המלאי - במטמון של אתר יש רק את שלו (לבדיקות סיכומים חוצות אתרים)
+    if view_site() is None:
+        return cache.get("Inventory")
+    return {d.id: d.to_dict() for d in db.collection("Inventory").stream()}
+
+def item_inventory(item_id):
+    # שורות המלאי של פריט בכל האתרים - עדכון קטלוג חל על כולם
+    if view_site() is None:
+        return cache.get("Inventory")
+    return {d.id: d.to_dict() for d in db.collection("Inventory").where("item_id", "==", item_id).stream()}
+
+def warehouse_names():
+    return [w['name'] for w in site_warehouses().values()]
+
+def warehouse_layout(name):
+    for w in cache.get("Warehouses").values():
+        if w['name'] == name:
+            return locations.parse_layout(w)
+    return None
+
+def slot_inputs(wh):
+    # שדות המיקום בטופס; כשלמחסן מוגדר מבנה - הצעת תאים פנויים ממפת המיקומים (קריאה אחת)
+    # והתא הפנוי הראשון כברירת מחדל
+    layout = warehouse_layout(wh)
+    free = locations.free_slots(locations.slot_map(db, wh), layout) if layout else []
+    if free:
+        st.caption("📍 תאים פנויים: " + " | ".join(f"שורה {r} עמודה {c} קומה {f}" for r, c, f in free))
+    elif layout:
+        st.caption("⚠️ אין תאים פנויים במבנה המחסן")
+    r0, c0, f0 = free[0] if free else ("1", "", "1")
+    c1, c2, c3 = st.columns(3)
+    r = c1.number_input("שורה", min_value=1, step=1, value=int(r0))
+    c = c2.text_input("עמודה", value=c0)
+    f = c3.number_input("קומה", min_value=1, step=1, value=int(f0))
+    return str(r), c, str(f)
+
+# --- דפדוף ---
+def page_window(key, reset_on=None):
+    # מחזיר (עמוד נוכחי, גודל עמוד); חוזר לעמוד הראשון כשהחיפוש או גודל העמוד משתנים
+    size = st.session_state.get('page_size', PAGE_SIZE)
+    if st.session_state.get(f"pg_on_{key}") != (reset_on, size):
+        st.session_state[f"pg_on_{key}"] = (reset_on, size)
+        st.session_state[f"pg_{key}"] = 0
+    return st.session_state[f"pg_{key}"], size
+
+def page_nav(key, page, has_next):
+    if page == 0 and not has_next: return
+    c1, c2, c3 = st.columns([1, 2, 1])
+    if c1.button("→ הקודם", key=f"pg_prev_{key}", disabled=page == 0):
+        st.session_state[f"pg_{key}"] = page - 1
+        st.rerun()
+    c2.caption(f"עמוד {page + 1}")
+    if c3.button("הבא ←", key=f"pg_next_{key}", disabled=not has_next):
+        st.session_state[f"pg_{key}"] = page + 1
+        st.rerun()
+
+def query_pager(key, make_query, signature=None, live=False):
+    # signature - ערכי הסינון; שינוי בהם בונה שאילתה חדשה מהעמוד הראשון.
+    # live - גם מספר התוצאות (count(), קריאה זולה בכל ריצה) נכנס לחתימה: מסמך שנוסף לסינון
+    # או יצא ממנו (גם ממשתמש אחר) בונה את הדפדוף מחדש, כך שהעמוד המוצג לא נשאר מיושן
+    size = st.session_state.get('page_size', PAGE_SIZE)
+    query = make_query()
+    if live:
+        signature = (signature, count_query(query))
+    pager, sig = st.session_state.get(f"pager_{key}", (None, None))
+    if pager is None or pager.page_size != size or sig != signature:
+        pager = QueryPager(query, size)
+        st.session_state[f"pager_{key}"] = (pager, signature)
+    return pager
+
+def reset_pager(key):
+    st.session_state.pop(f"pager_{key}", None)
+
+def pending_requests_query(warehouse=None, item_ids=None, date_range=()):
+    # הסינון רץ בשרת - האינדקסים המורכבים מוגדרים ב-firestore.indexes.json.
+    # מחסן שייך לאתר אחד - סינון לפי מחסן מחליף את סינון האתר
+    q = db.collection("Requests").where("status", "==", "pending")
+    if warehouse:
+        q = q.where("warehouse", "==", warehouse)
+    else:
+        q = sites.scoped(q, view_site())
+    if item_ids:
+        q = q.where("item_id", "in", list(item_ids))
+    if len(date_range) > 0:
+        q = q.where("timestamp", ">=", datetime.combine(date_range[0], datetime.min.time()))
+    if len(date_range) > 1:
+        q = q.where("timestamp", "<=", datetime.combine(date_range[1], datetime.max.time()))
+    return q.order_by("timestamp")
+
+REQUEST_STATUSES = {"pending": "ממתינה", "approved": "אושרה", "rejected": "נדחתה"}
+# מסלול ליקוט מחושב לכל היותר לבקשות האלה (לפי זמן הבקשה)
+PICK_LIMIT = 2000
+
+def requests_query(status=None, warehouse=None, date_range=()):
+    # לייצוא: כל הסטטוסים; אינדקסים על site/status/warehouse + timestamp
+    q = db.collection("Requests")
+    if status:
+        q = q.where("status", "==", status)
+    if warehouse:
+        q = q.where("warehouse", "==", warehouse)
+    else:
+        q = sites.scoped(q, view_site())
+    if len(date_range) > 0:
+        q = q.where("timestamp", ">=", datetime.combine(date_range[0], datetime.min.time()))
+    if len(date_range) > 1:
+        q = q.where("timestamp", "<=", datetime.combine(date_range[1], datetime.max.time()))
+    return q.order_by("timestamp")
+
+LOG_ACTIONS = [
+    "התחברות", "שינוי סיסמה", "בקשת משיכה", "אישור משיכה", "דחיית משיכה", "קליטה", "קליטה מהירה",
+    "קליטה ראשונית", "העברת פריט", "הוספת מחסן", "מחיקת מחסן", "ייבוא פריטים", "מחיקת פריט", "מחיקת משתמש", "ייצוא יומן",
+    "השלמת מק\"טים", "פתיחת יומן תנועות",
+    "תיקון סיכומי מלאי", "ייצוא לביקורת", "מבנה מחסן", "תיקון מפת מיקומים", "חישוב תחזית מחדש",
+    "הסבה לאתרים", "העברת מחסן לאתר", "עדכון אתרי משתמש"
+]
+LOG_COLUMNS = ["timestamp", "user", "role", "action", "details"]
+
+def logs_query(user=None, action=None, date_range=()):
+    # סינון בשרת - אינדקסים מורכבים על site/user/action + timestamp ב-firestore.indexes.json
+    q = sites.scoped(db.collection("Logs"), view_site())
+    if user:
+        q = q.where("user", "==", user)
+    if action:
+        q = q.where("action", "==", action)
+    if len(date_range) > 0:
+        q = q.where("timestamp", ">=", datetime.combine(date_range[0], datetime.min.time()))
+    if len(date_range) > 1:
+        q = q.where("timestamp", "<=", datetime.combine(date_range[1], datetime.max.time()))
+    return q.order_by("timestamp", direction=firestore.Query.DESCENDING)
+
+# --- קבצי ייצוא: קובץ זמני אחד לכל מסך ומשתמש, נמחק כשמכינים חדש או בהתנתקות ---
+def replace_export(name, path):
+    old = st.session_state.pop(f"export_{name}", None)
+    if old and os.path.exists(old):
+        os.remove(old)
+    if path:
+        st.session_state[f"export_{name}"] = path
+
+def drop_exports():
+    for key in [k for k in st.session_state.keys() if k.startswith('export_')]:
+        replace_export(key[len('export_'):], None)
+
+def export_download(name):
+    path = st.session_state.get(f"export_{name}")
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            st.download_button("⬇️ הורד", f, file_name=f"{name}_{datetime.now():%Y%m%d}{os.path.splitext(path)[1]}")
 
 def logout():
     st.session_state['logged_in'] = False
@@ -54,25 +388,47 @@ def logout():
     st.session_state['user_role'] = ""
     st.session_state['edit_item_id'] = None
     st.session_state['active_action'] = None
-    keys_to_del = [k for k in st.session_state.keys() if k.startswith('del_')]
+    drop_exports()
+    keys_to_del = [k for k in st.session_state.keys() if k.startswith(('del_', 'pager_', 'pg_', 'cart', 'pick_', 'fc_', 'site', 'user_sites', 'queued_'))]
     for k in keys_to_del: del st.session_state[k]
     st.rerun()
 
-def get_counts():
+def count_query(query):
+    return query.count().get()[0][0].value
+
+# שאילתות count() - עלות קבועה בלי קשר לגודל האוספים, עם מטמון קצר לכל התהליך
+@st.cache_data(ttl=30, show_spinner=False)
+def get_counts(site):
     try:
-        reqs = len(list(db.collection("Requests").where("status", "==", "pending").stream()))
-        users_pending = 0
-        all_users = db.collection("Users").stream()
-        for u in all_users:
-            ud = u.to_dict()
-            if not ud.get('approved', False) or ud.get('reset_requested', False):
-                users_pending += 1
-        return reqs, users_pending
+        reqs = count_query(sites.scoped(db.collection("Requests").where("status", "==", "pending"), site))
+        users = db.collection("Users")
+        unapproved = count_query(users.where("approved", "==", False))
+        resets = count_query(users.where("reset_requested", "==", True))
+        both = count_query(users.where("approved", "==", False).where("reset_requested", "==", True))
+        return reqs, unapproved + resets - both
     except:
         return 0, 0
 
+# תחזית: צבירה מצטברת לכל היותר פעם ב-FORECAST_TTL לכל התהליך (או בלחיצה), והסדרות והמלאי
+# נשמרים לפי ה-watermark - ריצה רגילה של המסך לא קוראת ולא כותבת דבר
+FORECAST_TTL = 600
+
+@st.cache_data(ttl=FORECAST_TTL, show_spinner=False)
+def forecast_refresh():
+    return forecast.refresh(db)
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def demand_series(mark):
+    return forecast.load_series(db)
+
+@st.cache_data(ttl=FORECAST_TTL, max_entries=2, show_spinner=False)
+def stock_on_hand(mark):
+    # הצריכה וההזמנה הן של כל החברה - המלאי מ-ItemBalances (rollups) ולא רק מהאתר הפעיל
+    return {d.id: d.get('quantity') or 0 for d in db.collection(rollups.BALANCES).stream()}
+
 # --- מסך כניסה ---
 if not st.session_state['logged_in']:
+    st.session_state['_profile'].enter_branch("login")
     st.title("📦 מערכת מלאי גשרי עליה")
     tab1, tab2, tab3 = st.tabs(["כניסה", "הרשמה", "שכחתי סיסמה"])
     
@@ -87,6 +443,8 @@ if not st.session_state['logged_in']:
                     st.session_state['logged_in'] = True
                     st.session_state['user_email'] = email
                     st.session_state['user_role'] = u_data.get('role', 'יוזר מושך')
+                    st.session_state['user_sites'] = sites.user_sites(u_data)
+                    st.session_state['site'] = sites.home(st.session_state['user_sites'])
                     log_action("התחברות", "כניסה למערכת")
                     st.rerun()
                 elif not u_data.get('approved', False):
@@ -116,12 +474,43 @@ if not st.session_state['logged_in']:
 
 # --- אפליקציה ראשית ---
 else:
-    req_c, usr_c = get_counts()
+    # בחירת אתר לפני כל השאר - המטמון, החיפוש והשאילתות מסוננים לפיו
+    site_options = sites.viewable(st.session_state.get('user_sites') or [sites.DEFAULT_SITE], get_sites())
+    if st.session_state.get('site') not in site_options:
+        st.session_state['site'] = site_options[0]
+    if len(site_options) > 1 and sites_ready():
+        st.sidebar.selectbox("אתר", site_options, key='site', on_change=switch_site,
+                             format_func=lambda x: "🌐 כל האתרים" if x == sites.ALL_SITES else x)
+    cache = get_cache(view_site())
+    search = get_search(view_site())
+
+    req_c, usr_c = get_counts(view_site())
     req_alert = f"🔴 ({req_c})" if req_c > 0 else ""
     usr_alert = f"🔴 ({usr_c})" if usr_c > 0 else ""
     
     st.sidebar.write(f"מחובר: **{st.session_state['user_email']}**")
     st.sidebar.caption(f"תפקיד: {st.session_state['user_role']}")
+    if not sites_ready():
+        if st.session_state['user_role'] == "מנהל מלאי":
+            st.sidebar.warning("החלוקה לאתרים עוד לא הופעלה - ההסבה נמצאת בניהול מחסנים")
+    elif len(site_options) == 1:
+        st.sidebar.caption(f"אתר: {site_options[0]}")
+
+    if cart():
+        st.sidebar.caption(f"🛒 בעגלה: {len(cart())} פריטים")
+
+    # פעולות שממתינות לחיבור / נכשלו בשליחה חוזרת
+    q_pending, q_failed = outbox.pending(), outbox.failed()
+    if q_pending or q_failed:
+        with st.sidebar.expander(f"📴 ממתינות לשליחה: {q_pending}" + (f" | נכשלו: {len(q_failed)}" if q_failed else ""), expanded=bool(q_failed)):
+            if q_pending and st.button("🔄 שלח עכשיו"):
+                outbox.flush()
+                st.rerun()
+            for seq, q_action, payload, created, error in q_failed:
+                st.caption(f"{datetime.fromtimestamp(created):%d/%m %H:%M} | {q_action} | {error}")
+                if st.button("הסר", key=f"outbox_dismiss_{seq}"):
+                    outbox.dismiss(seq)
+                    st.rerun()
     
     with st.sidebar.expander("🔐 שינוי סיסמה"):
         new_pass_1 = st.text_input("סיסמה חדשה", type="password", key="np1")
@@ -135,15 +524,41 @@ else:
             else:
                 st.error("סיסמה קצרה מדי")
 
+    if st.session_state['user_role'] == "מנהל מלאי":
+        with st.sidebar.expander("📊 מטמון נתונים"):
+            cs = cache.stats
+            st.caption(f"קריאות מסמכים: {cs['reads']} | שינויים: {cs['deltas']}")
+            st.caption(f"פגיעות: {cs['hits']} | החטאות: {cs['misses']}")
+            ops = inventory_ops.stats
+            st.caption(f"עדכוני מלאי: {ops['commits']} | התנגשויות: {ops['conflicts']} | ניסיונות חוזרים: {ops['retries']} | כשלונות: {ops['failures']}")
+            lm = log_sink.metrics
+            st.caption(f"יומן: בתור {log_sink.queue_depth} | נכתבו {lm['written']} | נזרקו {lm['dropped']} | כתיבה אחרונה {lm['last_flush_ms']:.0f}ms (מקס' {lm['max_flush_ms']:.0f}ms)")
+
+        if st.sidebar.toggle("🐞 מדידת ביצועים", key="debug_overlay"):
+            with st.sidebar.expander("⏱️ ריצות ומסכים", expanded=True):
+                last = st.session_state.get('last_profile')
+                if last:
+                    cut = " (נקטעה)" if last['interrupted'] else ""
+                    st.caption(f"ריצה קודמת{cut}: {last['branch']} | {last['rerun_ms']:.0f}ms | קריאות {last['reads']} | כתיבות {last['writes']} | סבבים {last['round_trips']}")
+                    if 'branch_ms' in last:
+                        st.caption(f"מתוכה במסך: {last['branch_ms']:.0f}ms | קריאות {last['branch_reads']} | כתיבות {last['branch_writes']}")
+                totals = db.meter.snapshot()
+                st.caption(f"סה\"כ בתהליך (כולל מאזינים ויומן): קריאות {totals['reads']} | כתיבות {totals['writes']} | סבבים {totals['round_trips']}")
+                st.dataframe(branch_stats.table(), hide_index=True, use_container_width=True)
+
     if st.sidebar.button("התנתק"): logout()
 
     # תפריט
     if st.session_state['user_role'] == "מנהל מלאי":
         menu = {
             "search": "חיפוש ופעולות",
+            "dashboard": "תמונת מלאי",
+            "forecast": "תחזית והזמנות",
+            "export": "ייצוא לביקורת",
             "stock_in": "קליטת מלאי (קבלה)",
             "pull": "משיכת מלאי (יציאה)",
             "approve": f"אישור משיכות {req_alert}",
+            "pick": "מסלול ליקוט",
             "items": "ניהול פריטים (קטלוג)",
             "warehouses": "ניהול מחסנים",
             "users": f"ניהול משתמשים {usr_alert}",
@@ -153,58 +568,59 @@ else:
         menu = {"search": "חיפוש ופעולות", "pull": "משיכת מלאי"}
     
     choice_key = st.sidebar.radio("תפריט", list(menu.keys()), format_func=lambda x: menu[x])
+    st.sidebar.selectbox("תוצאות בעמוד", PAGE_SIZES, index=PAGE_SIZES.index(PAGE_SIZE), key='page_size')
     st.title(f"📦 {menu[choice_key]}")
+    st.session_state['_profile'].enter_branch(choice_key)
+    # כניסה למסך - הדפדוף השמור מהביקור הקודם נבנה מחדש (העמוד הנוכחי נשמר ב-pg_)
+    if st.session_state.get('screen') != choice_key:
+        st.session_state['screen'] = choice_key
+        for k in [k for k in st.session_state.keys() if k.startswith('pager_')]:
+            del st.session_state[k]
 
     # ==========================================
     # 1. חיפוש ופעולות 
     # ==========================================
     if choice_key == "search":
+        cart_panel()
         search_q = st.text_input("🔍 חפש פריט (שם או מק\"ט רשותי/יצרן)")
         
-        all_items_catalog = {doc.id: doc.to_dict() for doc in db.collection("Items").stream()}
-        inv_stream = list(db.collection("Inventory").stream())
+        inv_docs = cache.get("Inventory")
         
         found_inventory = []
         found_item_ids_in_inv = set()
         
         if search_q:
-            search_q_lower = search_q.lower()
-            # מעבר על המלאי הקיים
-            for doc in inv_stream:
-                d = doc.to_dict()
-                item_id = d.get('item_id')
-                catalog_data = all_items_catalog.get(item_id, {})
-                
-                desc = str(d.get('item_name', '')).lower()
-                sku = str(catalog_data.get('internal_sku', '')).lower()
-                man_sku = str(catalog_data.get('manufacturer_sku', '')).lower()
-                
-                # חיפוש חכם על 3 השדות
-                if (search_q_lower in desc) or (search_q_lower in sku) or (search_q_lower in man_sku):
-                    d['display_sku'] = catalog_data.get('internal_sku', '')
-                    d['man_sku'] = catalog_data.get('manufacturer_sku', '')
-                    found_inventory.append({"id": doc.id, "data": d})
-                    found_item_ids_in_inv.add(item_id)
-
-            # מעבר על הקטלוג (למציאת פריטים שאין להם מלאי)
-            found_catalog_only = []
-            for item_id, data in all_items_catalog.items():
-                if item_id not in found_item_ids_in_inv: 
-                    desc = str(data.get('description', '')).lower()
-                    sku = str(data.get('internal_sku', '')).lower()
-                    man_sku = str(data.get('manufacturer_sku', '')).lower()
-                    
-                    if (search_q_lower in desc) or (search_q_lower in sku) or (search_q_lower in man_sku):
-                        found_catalog_only.append((item_id, data))
+            # חיפוש חכם על 3 השדות דרך האינדקס (שם, מק"ט רשות, מק"ט יצרן) - רק עד סוף העמוד הנוכחי
+            inv_page, size = page_window("search_inv", search_q)
+            inv_ids = search.search_inventory(search_q, limit=(inv_page + 1) * size + 1)
+            inv_has_next = len(inv_ids) > (inv_page + 1) * size
+            for doc_id in inv_ids[inv_page * size:(inv_page + 1) * size]:
+                d = inv_docs.get(doc_id)
+                if d is None: continue
+                found_inventory.append({"id": doc_id, "data": d})
+                found_item_ids_in_inv.add(d.get('item_id'))
+
+            # פריטים מהקטלוג שאין להם מלאי
+            cat_page, size = page_window("search_cat", search_q)
+            cat_ids = search.search_catalog_only(search_q, limit=(cat_page + 1) * size + 1)
+            all_items_catalog = cache.get("Items")
+            cat_has_next = len(cat_ids) > (cat_page + 1) * size
+            found_catalog_only = [
+                (item_id, all_items_catalog[item_id]) for item_id in cat_ids[cat_page * size:(cat_page + 1) * size]
+                if item_id in all_items_catalog
+            ]
 
             # --- הצגת תוצאות: מלאי קיים ---
             if found_inventory:
-                st.success(f"נמצאו {len(found_inventory)} פריטים במלאי")
+                if inv_has_next:
+                    st.success(f"נמצאו יותר מ-{(inv_page + 1) * size} פריטים במלאי")
+                else:
+                    st.success(f"נמצאו {inv_page * size + len(found_inventory)} פריטים במלאי")
                 for item in found_inventory:
                     doc_id = item["id"]
                     d = item["data"]
-                    sku_display = d.get('display_sku', '')
-                    man_sku_display = d.get('man_sku', '')
+                    sku_display = d.get('internal_sku', '')
+                    man_sku_display = d.get('manufacturer_sku', '')
                     
                     with st.container(border=True):
                         c_info, c_actions = st.columns([3, 2])
@@ -222,7 +638,7 @@ else:
                         with c_actions:
                             is_manager = st.session_state['user_role'] == "מנהל מלאי"
                             if is_manager:
-                                b1, b2, b3 = st.columns(3)
+                                b1, b2, b3, b4 = st.columns(4)
                                 with b1:
                                     if st.button("📤", key=f"pull_{doc_id}", help="משיכה"):
                                         st.session_state['active_action'] = {'type': 'pull', 'id': doc_id, 'name': d['item_name']}
@@ -235,6 +651,10 @@ else:
                                     if st.button("📥", key=f"add_{doc_id}", help="הוספת כמות (קליטה)"):
                                         st.session_state['active_action'] = {'type': 'add_existing', 'id': doc_id, 'name': d['item_name']}
                                         st.rerun()
+                                with b4:
+                                    if st.button("📜", key=f"hist_{doc_id}", help="היסטוריית תנועות"):
+                                        st.session_state['active_action'] = {'type': 'history', 'id': doc_id, 'name': d['item_name']}
+                                        st.rerun()
                             else:
                                 if st.button("📤", key=f"pull_{doc_id}", help="משיכה", use_container_width=True):
                                     st.session_state['active_action'] = {'type': 'pull', 'id': doc_id, 'name': d['item_name']}
@@ -253,51 +673,86 @@ else:
                                 with st.form(f"form_pull_{doc_id}"):
                                     qty = st.number_input("כמות", min_value=1, step=1, max_value=d['quantity'], value=1)
                                     reason = st.text_input("סיבה / שרוול")
-                                    if st.form_submit_button("שלח בקשה"):
-                                        db.collection("Requests").add({
+                                    fc1, fc2 = st.columns(2)
+                                    send = fc1.form_submit_button("שלח בקשה")
+                                    if fc2.form_submit_button("🛒 הוסף לעגלה"):
+                                        add_to_cart(action['id'], d, qty)
+                                        st.session_state['active_action'] = None
+                                        st.rerun()
+                                    if send:
+                                        submit("request", {
                                             "user_email": st.session_state['user_email'],
                                             "item_name": action['name'], "location_id": action['id'],
-                                            "quantity": int(qty), "reason": reason, "status": "pending", "timestamp": datetime.now()
+                                            "item_id": d.get('item_id'), "warehouse": d['warehouse'],
+                                            "site": d.get('site') or warehouse_site(d['warehouse']),
+                                            "quantity": int(qty), "reason": reason, "status": "pending"
                                         })
                                         log_action("בקשת משיכה", f"{qty} יח' של {action['name']}")
+                                        get_counts.clear()
                                         st.success("הבקשה נשלחה!")
                                         st.session_state['active_action'] = None
                                         st.rerun()
 
                             elif action['type'] == 'move':
                                 st.markdown(f"**העברה:** {action['name']}")
+                                # המחסן מחוץ לטופס - בחירה בו מרעננת את הצעות התאים הפנויים
+                                new_wh = st.selectbox("מחסן יעד", warehouse_names(), key=f"mv_wh_{doc_id}")
                                 with st.form(f"form_move_{doc_id}"):
-                                    whs_list = [w.to_dict()['name'] for w in db.collection("Warehouses").stream()]
-                                    new_wh = st.selectbox("מחסן יעד", whs_list)
-                                    c1, c2, c3 = st.columns(3)
-                                    nr = c1.number_input("שורה", min_value=1, step=1, value=1)
-                                    nc = c2.text_input("עמודה")
-                                    nf = c3.number_input("קומה", min_value=1, step=1, value=1)
+                                    nr, nc, nf = slot_inputs(new_wh)
                                     if st.form_submit_button("בצע העברה"):
-                                        db.collection("Inventory").document(action['id']).update({
-                                            "warehouse": new_wh, "row": str(nr), "column": nc, "floor": str(nf)
-                                        })
-                                        log_action("העברת פריט", f"{action['name']} -> {new_wh}")
-                                        st.success("המיקום עודכן!")
-                                        st.session_state['active_action'] = None
-                                        st.rerun()
+                                        moved = {"warehouse": new_wh, "site": warehouse_site(new_wh), "row": nr, "column": nc, "floor": nf}
+                                        try:
+                                            sent, result = submit("move", {"loc_id": action['id'], "target": moved, "user": st.session_state['user_email']})
+                                            if sent:
+                                                new_id, new_row = result
+                                            else:
+                                                new_id = inventory_ops.location_id(moved, d.get('item_id'))
+                                                dst = inv_docs.get(new_id, {**d, **moved, "quantity": 0})
+                                                new_row = {**dst, "quantity": dst.get('quantity', 0) + d.get('quantity', 0)}
+                                            if new_id != action['id']:
+                                                cache.drop("Inventory", action['id'])
+                                            cache.put("Inventory", new_id, new_row)
+                                            log_action("העברת פריט", f"{action['name']} -> {new_wh}")
+                                            st.success("המיקום עודכן!")
+                                            st.session_state['active_action'] = None
+                                            st.rerun()
+                                        except inventory_ops.InventoryError as e:
+                                            st.error(str(e))
 
                             elif action['type'] == 'add_existing':
                                 st.markdown(f"**הוספת מלאי לאותו מיקום:** {action['name']}")
                                 with st.form(f"form_add_{doc_id}"):
                                     qty_add = st.number_input("כמות להוספה", min_value=1, step=1, value=1)
                                     if st.form_submit_button("עדכן מלאי"):
-                                        ref = db.collection("Inventory").document(action['id'])
-                                        curr_qty = ref.get().to_dict()['quantity']
-                                        ref.update({"quantity": curr_qty + qty_add})
+                                        submit("add_stock", {"loc_id": action['id'], "qty": int(qty_add), "row": d, "user": st.session_state['user_email']})
+                                        cache.merge("Inventory", action['id'], {"quantity": d['quantity'] + qty_add})
                                         log_action("קליטה מהירה", f"נוספו {qty_add} ל-{action['name']}")
                                         st.success("המלאי עודכן!")
                                         st.session_state['active_action'] = None
                                         st.rerun()
 
+                            elif action['type'] == 'history':
+                                st.markdown(f"**תנועות:** {action['name']}")
+                                at_date = st.date_input("יתרה לתאריך", value=datetime.now().date(), key=f"hist_at_{doc_id}")
+                                at = datetime.combine(at_date, datetime.max.time())
+                                hc1, hc2 = st.columns(2)
+                                hc1.metric("במיקום", ledger.balance_at(db, at, location_id=doc_id))
+                                hc2.metric("בכל המחסנים", ledger.balance_at(db, at, item_id=d.get('item_id')))
+                                moves = ledger.history(db, item_id=d.get('item_id'), end=at, limit=20)
+                                if moves:
+                                    st.dataframe([{k: m.get(k) for k in ("timestamp", "kind", "delta", "warehouse", "location_id", "user")} for m in moves],
+                                                 hide_index=True, use_container_width=True)
+                                else:
+                                    st.caption("אין תנועות רשומות")
+
+            page_nav("search_inv", inv_page, inv_has_next)
+
             # --- הצגת תוצאות: רק בקטלוג (פריטים חדשים) ---
             if found_catalog_only:
-                st.info(f"נמצאו {len(found_catalog_only)} פריטים בקטלוג (ללא מיקום מוגדר)")
+                if cat_has_next:
+                    st.info(f"נמצאו יותר מ-{(cat_page + 1) * size} פריטים בקטלוג (ללא מיקום מוגדר)")
+                else:
+                    st.info(f"נמצאו {cat_page * size + len(found_catalog_only)} פריטים בקטלוג (ללא מיקום מוגדר)")
                 for item_id, data in found_catalog_only:
                     with st.container(border=True):
                         c_info, c_actions = st.columns([3, 2])
@@ -325,35 +780,35 @@ else:
 
                             if action['type'] == 'add_new':
                                 st.markdown(f"**קליטה ראשונית:** {action['name']}")
-                                whs_list = [w.to_dict()['name'] for w in db.collection("Warehouses").stream()]
+                                whs_list = warehouse_names()
                                 
                                 if not whs_list:
                                     st.error("חובה להגדיר מחסנים קודם!")
                                 else:
+                                    wh = st.selectbox("בחר מחסן", whs_list, key=f"new_wh_{item_id}")
                                     with st.form(f"form_new_{item_id}"):
-                                        wh = st.selectbox("בחר מחסן", whs_list)
-                                        c1, c2, c3 = st.columns(3)
-                                        r = c1.number_input("שורה", min_value=1, step=1, value=1)
-                                        c = c2.text_input("עמודה")
-                                        f = c3.number_input("קומה", min_value=1, step=1, value=1)
+                                        str_r, c, str_f = slot_inputs(wh)
                                         qty = st.number_input("כמות התחלתית", min_value=1, step=1, value=1)
                                         
                                         if st.form_submit_button("צור מיקום וקלוט מלאי"):
-                                            str_r, str_f = str(r), str(f)
                                             loc_id = f"{wh}_{str_r}_{c}_{str_f}_{item_id}"
                                             
-                                            db.collection("Inventory").document(loc_id).set({
-                                                "item_name": action['name'], 
-                                                "warehouse": wh, 
+                                            new_row = {
+                                                **catalog_sync.inventory_fields(data),
+                                                "warehouse": wh, "site": warehouse_site(wh),
                                                 "row": str_r, "column": c, "floor": str_f, 
-                                                "quantity": int(qty), 
                                                 "item_id": item_id
-                                            })
+                                            }
+                                            submit("add_stock", {"loc_id": loc_id, "qty": int(qty), "new_row": new_row, "user": st.session_state['user_email']})
+                                            cached_qty = cache.get("Inventory").get(loc_id, {}).get('quantity', 0)
+                                            cache.put("Inventory", loc_id, {**new_row, "quantity": cached_qty + int(qty)})
                                             log_action("קליטה ראשונית", f"{qty} יח' של {action['name']} ל-{wh}")
                                             st.success("הפריט שויך ונקלט בהצלחה!")
                                             st.session_state['active_action'] = None
                                             st.rerun()
 
+            page_nav("search_cat", cat_page, cat_has_next)
+
             if not found_inventory and not found_catalog_only:
                  st.warning("לא נמצאו תוצאות.")
 
@@ -364,11 +819,58 @@ else:
     # 2. אישור משיכות
     # ==========================================
     elif choice_key == "approve":
-         reqs = db.collection("Requests").where("status", "==", "pending").stream()
+         with st.expander("🔎 סינון"):
+             fc1, fc2 = st.columns(2)
+             f_wh = fc1.selectbox("מחסן", ["הכל"] + warehouse_names(), key="ap_wh")
+             f_item = fc2.text_input("פריט (שם או מק\"ט)", key="ap_item")
+             f_dates = st.date_input("טווח תאריכים", value=(), key="ap_dates")
+         f_wh = None if f_wh == "הכל" else f_wh
+         # עד 30 פריטים תואמים - המגבלה של where in
+         f_items = tuple(search.search_items(f_item, limit=30)) if f_item else ()
+         signature = (f_wh, f_items, tuple(f_dates))
+         pager = query_pager("approve", lambda: pending_requests_query(f_wh, f_items, f_dates), signature, live=True)
+         page, _ = page_window("approve", signature)
          found = False
-         for req in reqs:
+         page_reqs = pager.page(page) if not (f_item and not f_items) else []
+
+         if st.session_state.get('bulk_result'):
+             res = st.session_state.pop('bulk_result')
+             st.success(f"✅ {res['label']}: {len(res['done'])} בקשות | {res['per_sec']:.1f} בקשות/שנייה")
+             for req_id, reason in res['skipped']:
+                 st.warning(f"דולגה בקשה ({req_id}): {reason}")
+
+         bulk = st.toggle("בחירה מרובה", key="bulk_mode") if page_reqs else False
+         if bulk:
+             bc1, bc2, bc3 = st.columns(3)
+             if bc1.button("☑️ בחר הכל בעמוד"):
+                 for req in page_reqs: st.session_state[f"sel_{req.id}"] = True
+                 st.rerun()
+             selected = [(req.id, req.to_dict()) for req in page_reqs if st.session_state.get(f"sel_{req.id}")]
+             bulk_approve = bc2.button(f"✅ אשר נבחרים ({len(selected)})", disabled=not selected)
+             bulk_reject = bc3.button(f"❌ דחה נבחרים ({len(selected)})", disabled=not selected)
+             if bulk_approve or bulk_reject:
+                 try:
+                     res = inventory_ops.decide_requests(db, selected, bulk_approve, log_entry)
+                     for loc, qty in res['quantities'].items():
+                         cache.merge("Inventory", loc, {"quantity": qty})
+                     for req_id, _ in selected: st.session_state.pop(f"sel_{req_id}", None)
+                     names = dict((req_id, r['item_name']) for req_id, r in selected)
+                     res['skipped'] = [(names.get(req_id, req_id), reason) for req_id, reason in res['skipped']]
+                     res['label'] = "אושרו" if bulk_approve else "נדחו"
+                     st.session_state['bulk_result'] = res
+                     get_counts.clear()
+                     reset_pager("approve")
+                     st.rerun()
+                 except inventory_ops.InventoryError as e:
+                     st.error(str(e))
+
+         for req in page_reqs:
              found = True
              r = req.to_dict()
+             if bulk:
+                 reason = f" | 📝 {r['reason']}" if r.get('reason') else ""
+                 st.checkbox(f"{r['user_email']} | {r['quantity']} יח' של {r['item_name']}{reason}", key=f"sel_{req.id}")
+                 continue
              with st.container(border=True):
                  st.write(f"**{r['user_email']}** מבקש **{r['quantity']}** יח' של **{r['item_name']}**")
                  if r.get('reason'):
@@ -376,81 +878,96 @@ else:
                  else:
                      st.caption("ללא סיבה")
                  
+                 # החלטה שנשמרה בתור (בלי רשת) - הבקשה עדיין ממתינה בשרת; מוצג מצב ההמתנה ולא כמות משוערת,
+                 # והמלאי מתעדכן מהמאזין כשהתור נשלח
+                 queued = st.session_state.setdefault('queued_decisions', {})
+                 if req.id in queued:
+                     st.caption(f"⏳ {'אישור' if queued[req.id] == 'approve' else 'דחייה'} ממתין לשליחה")
+                     continue
                  c1, c2 = st.columns(2)
                  if c1.button("✅ אשר", key=f"ok_{req.id}"):
-                     inv_ref = db.collection("Inventory").document(r['location_id'])
-                     s = inv_ref.get()
-                     if s.exists:
-                         inv_ref.update({"quantity": max(0, s.to_dict()['quantity'] - r['quantity'])})
-                         db.collection("Requests").document(req.id).update({"status": "approved"})
+                     try:
+                         sent, new_qty = submit("approve", {"request_id": req.id, "location_id": r['location_id'], "user": st.session_state['user_email']})
+                         if sent:
+                             cache.merge("Inventory", r['location_id'], {"quantity": new_qty})
+                         else:
+                             queued[req.id] = "approve"
                          log_action("אישור משיכה", f"אושר ל-{r['user_email']} למשוך {r['item_name']}")
+                         get_counts.clear()
+                         reset_pager("approve")
                          st.rerun()
-                     else:
-                         st.error("הפריט כבר לא קיים במלאי")
+                     except inventory_ops.InventoryError as e:
+                         st.error(str(e))
                  
                  if c2.button("❌ דחה", key=f"rj_{req.id}"):
-                     db.collection("Requests").document(req.id).update({"status": "rejected"})
-                     log_action("דחיית משיכה", f"נדחה ל-{r['user_email']} עבור {r['item_name']}")
-                     st.rerun()
+                     try:
+                         sent, _ = submit("reject", {"request_id": req.id})
+                         if not sent:
+                             queued[req.id] = "reject"
+                         log_action("דחיית משיכה", f"נדחה ל-{r['user_email']} עבור {r['item_name']}")
+                         get_counts.clear()
+                         reset_pager("approve")
+                         st.rerun()
+                     except inventory_ops.InventoryError as e:
+                         st.error(str(e))
          if not found: st.info("אין בקשות ממתינות.")
+         page_nav("approve", page, pager.has_next(page))
 
     # ==========================================
     # 3. קליטת מלאי (עם חיפוש לפי מק"טים)
     # ==========================================
     elif choice_key == "stock_in":
         # בניית רשימה עשירה הכוללת מק"טים לסינון קל
-        items_db = {i.id: i.to_dict() for i in db.collection("Items").stream()}
-        whs = [w.to_dict()['name'] for w in db.collection("Warehouses").stream()]
+        items_db = cache.get("Items")
+        whs = warehouse_names()
         
         if items_db and whs:
+            st.write("🔽 **שלב 1: חיפוש פריט (שם או מק\"ט)**")
+            search_item_text = st.text_input("הקלד כאן כדי לפתוח מקלדת ולסנן את הרשימה", key="si_search")
+            
+            item_ids = search.search_items(search_item_text) if search_item_text else list(items_db)
             opts = {}
-            for i_id, i_data in items_db.items():
+            for i_id in item_ids:
+                i_data = items_db.get(i_id)
+                if i_data is None: continue
                 desc = i_data.get('description', '')
                 sku = i_data.get('internal_sku', '')
                 man_sku = i_data.get('manufacturer_sku', '')
                 
                 label = f"{desc} | מק\"ט: {sku}"
                 if man_sku: label += f" | יצרן: {man_sku}"
-                opts[label] = {"id": i_id, "name": desc}
+                opts[label] = {"id": i_id, "item": i_data}
 
-            st.write("🔽 **שלב 1: חיפוש פריט (שם או מק\"ט)**")
-            search_item_text = st.text_input("הקלד כאן כדי לפתוח מקלדת ולסנן את הרשימה", key="si_search")
-            
             filtered_labels = list(opts.keys())
-            if search_item_text:
-                search_lower = search_item_text.lower()
-                filtered_labels = [k for k in filtered_labels if search_lower in k.lower()]
             
             if filtered_labels:
                 selected_label = st.selectbox("בחר פריט", filtered_labels, key="si_select")
                 selected_item = opts[selected_label]
                 
+                wh = st.selectbox("מחסן", whs, key="si_wh")
                 with st.form("sin"):
-                    wh = st.selectbox("מחסן", whs)
                     st.caption("מיקום:")
-                    c1, c2, c3 = st.columns(3)
-                    r = c1.number_input("שורה", min_value=1, step=1, value=1)
-                    c = c2.text_input("עמודה")
-                    f = c3.number_input("קומה", min_value=1, step=1, value=1)
+                    str_r, c, str_f = slot_inputs(wh)
                     q = st.number_input("כמות לקליטה", min_value=1, step=1, value=1)
                     
                     if st.form_submit_button("קלוט מלאי"):
                         item_id = selected_item["id"]
-                        item_name = selected_item["name"]
-                        str_r, str_f = str(r), str(f)
+                        item_name = selected_item["item"].get('description', '')
                         loc = f"{wh}_{str_r}_{c}_{str_f}_{item_id}"
                         
-                        ref = db.collection("Inventory").document(loc)
-                        if ref.get().exists: 
-                            ref.update({"quantity": ref.get().to_dict()['quantity'] + q})
-                        else: 
-                            ref.set({
-                                "item_name": item_name, "warehouse": wh, 
-                                "row": str_r, "column": c, "floor": str_f, 
-                                "quantity": int(q), "item_id": item_id
-                            })
+                        new_row = {
+                            **catalog_sync.inventory_fields(selected_item["item"]), "warehouse": wh, "site": warehouse_site(wh),
+                            "row": str_r, "column": c, "floor": str_f, 
+                            "item_id": item_id
+                        }
+                        sent, _ = submit("add_stock", {"loc_id": loc, "qty": int(q), "new_row": new_row, "user": st.session_state['user_email']})
+                        cached_qty = cache.get("Inventory").get(loc, {}).get('quantity', 0)
+                        cache.put("Inventory", loc, {**new_row, "quantity": cached_qty + int(q)})
                         log_action("קליטה", f"{q} {item_name}")
-                        st.success("נקלט בהצלחה!")
+                        if sent:
+                            st.success("נקלט בהצלחה!")
+                        else:
+                            st.warning(OFFLINE_MSG)
             else:
                 st.warning("לא נמצאו פריטים.")
 
@@ -458,31 +975,34 @@ else:
     # 4. משיכת מלאי (עם חיפוש לפי מק"טים)
     # ==========================================
     elif choice_key == "pull":
-        all_items_catalog = {doc.id: doc.to_dict() for doc in db.collection("Items").stream()}
-        inv = db.collection("Inventory").where("quantity", ">", 0).stream()
-        
-        opts = {}
-        for d in inv:
-            data = d.to_dict()
-            item_id = data.get('item_id')
-            c_data = all_items_catalog.get(item_id, {})
-            sku = c_data.get('internal_sku', '')
-            man_sku = c_data.get('manufacturer_sku', '')
-            
-            skus_str = f" | 🆔 {sku}" if sku else ""
-            if man_sku: skus_str += f" | 🏭 {man_sku}"
-            
-            label = f"{data['item_name']}{skus_str} | {data['warehouse']} (שורה {data.get('row','-')} עמ' {data.get('column','-')}) | כמות: {data['quantity']}"
-            opts[label] = {"id": d.id, "name": data['item_name']}
+        cart_panel()
+        inv_docs = cache.get("Inventory")
+        in_stock = [doc_id for doc_id, data in inv_docs.items() if data.get('quantity', 0) > 0]
 
-        if opts:
+        if in_stock:
             st.write("🔽 **שלב 1: חיפוש במלאי (שם או מק\"ט)**")
             search_pull_text = st.text_input("הקלד כאן לסינון", key="pull_search")
+            pull_wh = st.selectbox("מחסן", ["כל המחסנים"] + warehouse_names(), key="pull_wh")
             
-            filtered_opts = list(opts.keys())
+            doc_ids = in_stock
             if search_pull_text:
-                search_lower = search_pull_text.lower()
-                filtered_opts = [k for k in filtered_opts if search_lower in k.lower()]
+                doc_ids = [i for i in search.search_inventory(search_pull_text) if inv_docs.get(i, {}).get('quantity', 0) > 0]
+            if pull_wh != "כל המחסנים":
+                doc_ids = [i for i in doc_ids if inv_docs[i].get('warehouse') == pull_wh]
+
+            opts = {}
+            for doc_id in doc_ids:
+                data = inv_docs[doc_id]
+                sku = data.get('internal_sku', '')
+                man_sku = data.get('manufacturer_sku', '')
+                
+                skus_str = f" | 🆔 {sku}" if sku else ""
+                if man_sku: skus_str += f" | 🏭 {man_sku}"
+                
+                label = f"{data['item_name']}{skus_str} | {data['warehouse']} (שורה {data.get('row','-')} עמ' {data.get('column','-')}) | כמות: {data['quantity']}"
+                opts[label] = {"id": doc_id, "name": data['item_name'], "item_id": data.get('item_id'), "warehouse": data['warehouse']}
+
+            filtered_opts = list(opts.keys())
             
             if filtered_opts:
                 k = st.selectbox("בחר פריט למשיכה", filtered_opts, key="pull_select")
@@ -491,14 +1011,25 @@ else:
                 with st.form("pf"):
                     q = st.number_input("כמות", min_value=1, step=1, value=1)
                     rs = st.text_input("סיבה / שרוול")
-                    if st.form_submit_button("שלח בקשה"):
-                        db.collection("Requests").add({
+                    fc1, fc2 = st.columns(2)
+                    send = fc1.form_submit_button("שלח בקשה")
+                    if fc2.form_submit_button("🛒 הוסף לעגלה"):
+                        add_to_cart(selected_item["id"], inv_docs[selected_item["id"]], q)
+                        st.rerun()
+                    if send:
+                        sent, _ = submit("request", {
                             "user_email": st.session_state['user_email'], 
                             "item_name": selected_item["name"], 
                             "location_id": selected_item["id"], 
-                            "quantity": int(q), "reason": rs, "status": "pending", "timestamp": datetime.now()
+                            "item_id": selected_item["item_id"], "warehouse": selected_item["warehouse"],
+                            "site": inv_docs[selected_item["id"]].get('site') or warehouse_site(selected_item["warehouse"]),
+                            "quantity": int(q), "reason": rs, "status": "pending"
                         })
-                        st.success("נשלח!")
+                        get_counts.clear()
+                        if sent:
+                            st.success("נשלח!")
+                        else:
+                            st.warning(OFFLINE_MSG)
             else:
                 st.warning("לא נמצאו פריטים במלאי התואמים לחיפוש.")
         else:
@@ -510,34 +1041,153 @@ else:
     elif choice_key == "warehouses":
         with st.form("new_wh"):
             n = st.text_input("שם מחסן")
+            # מחסן חדש נפתח באתר הפעיל; בתצוגה חוצת אתרים בוחרים (או מקלידים אתר חדש)
+            new_site = view_site() or st.text_input("אתר", value=write_site())
             if st.form_submit_button("הוסף"):
-                db.collection("Warehouses").add({"name": n})
-                log_action("הוספת מחסן", n)
+                wh = {"name": n, "site": new_site.strip() or sites.DEFAULT_SITE}
+                _, wh_ref = db.collection("Warehouses").add(wh)
+                cache.put("Warehouses", wh_ref.id, wh)
+                get_sites.clear()
+                log_action("הוספת מחסן", f"{n} ({wh['site']})")
                 st.rerun()
         
         st.divider()
-        for w in db.collection("Warehouses").stream():
+        for w_id, w in site_warehouses().items():
             c1, c2 = st.columns([4,1])
-            c1.info(w.to_dict()['name'])
+            c1.info(w['name'])
             
-            if c2.button("🗑️", key=f"btn_del_wh_{w.id}"):
-                st.session_state[f"del_wh_{w.id}"] = True
+            if c2.button("🗑️", key=f"btn_del_wh_{w_id}"):
+                st.session_state[f"del_wh_{w_id}"] = True
                 st.rerun()
             
-            if st.session_state.get(f"del_wh_{w.id}", False):
-                st.error(f"למחוק את {w.to_dict()['name']}?")
+            if st.session_state.get(f"del_wh_{w_id}", False):
+                st.error(f"למחוק את {w['name']}?")
                 col_yes, col_no = st.columns(2)
-                if col_yes.button("✅", key=f"yes_wh_{w.id}"):
-                    for i in db.collection("Inventory").where("warehouse", "==", w.to_dict()['name']).stream():
-                        db.collection("Inventory").document(i.id).update({"warehouse": "מחסן זמני"})
-                    db.collection("Warehouses").document(w.id).delete()
-                    log_action("מחיקת מחסן", w.to_dict()['name'])
-                    del st.session_state[f"del_wh_{w.id}"]
+                if col_yes.button("✅", key=f"yes_wh_{w_id}"):
+                    # קודם כל השורות עוברות (העברה כמו move_stock - עם יומן התנועות והסיכומים, בנתחים
+                    # שניתן להמשיך), ורק אז המחסן נמחק - מחיקה שנקטעה משאירה את המחסן, ולחיצה חוזרת משלימה אותה
+                    total = sum(1 for i in cache.get("Inventory").values() if i.get('warehouse') == w['name'])
+                    bar = st.progress(0)
+                    moved, new_rows = inventory_ops.evacuate_warehouse(
+                        db, w['name'], {"warehouse": "מחסן זמני", "site": warehouse_site("מחסן זמני")}, st.session_state['user_email'],
+                        progress=lambda done: bar.progress(min(done / max(total, 1), 1.0), text=f"{done}/{total} שורות"))
+                    for old_id in moved:
+                        cache.drop("Inventory", old_id)
+                    cache.put_many("Inventory", list(new_rows.items()))
+                    db.collection("Warehouses").document(w_id).delete()
+                    cache.drop("Warehouses", w_id)
+                    log_action("מחיקת מחסן", w['name'])
+                    del st.session_state[f"del_wh_{w_id}"]
                     st.rerun()
-                if col_no.button("❌", key=f"no_wh_{w.id}"):
-                    del st.session_state[f"del_wh_{w.id}"]
+                if col_no.button("❌", key=f"no_wh_{w_id}"):
+                    del st.session_state[f"del_wh_{w_id}"]
                     st.rerun()
 
+        # --- מבנה המחסן ומפת המיקומים (locations.py) - מסמך מפה לכל שורה במחסן, בלי מעבר על המלאי ---
+        whs = {w['name']: w_id for w_id, w in site_warehouses().items()}
+        if whs:
+            st.divider()
+            st.subheader("🗺️ מפת מיקומים")
+            map_wh = st.selectbox("מחסן", list(whs), key="loc_wh")
+            layout = warehouse_layout(map_wh)
+            with st.expander("📐 מבנה המחסן", expanded=layout is None):
+                with st.form(f"layout_{whs[map_wh]}"):
+                    lc1, lc2, lc3 = st.columns(3)
+                    l_rows = lc1.number_input("שורות", min_value=1, step=1, value=layout['rows'] if layout else 1)
+                    l_cols = lc2.text_input("עמודות (מופרדות בפסיק)", value=",".join(layout['columns']) if layout else "")
+                    l_floors = lc3.number_input("קומות", min_value=1, step=1, value=layout['floors'] if layout else 1)
+                    if st.form_submit_button("שמור מבנה"):
+                        cols = [c.strip() for c in l_cols.split(",") if c.strip()]
+                        if not cols:
+                            st.error("חובה להגדיר לפחות עמודה אחת")
+                        else:
+                            new_layout = {"rows": int(l_rows), "columns": cols, "floors": int(l_floors)}
+                            db.collection("Warehouses").document(whs[map_wh]).update({"layout": new_layout})
+                            cache.merge("Warehouses", whs[map_wh], {"layout": new_layout})
+                            log_action("מבנה מחסן", f"{map_wh}: {l_rows} שורות, {len(cols)} עמודות, {l_floors} קומות")
+                            st.rerun()
+
+            slots = locations.slot_map(db, map_wh)
+            items = cache.get("Items")
+            describe = lambda content: ", ".join(f"{items.get(i, {}).get('description', i)} ({q})" for i, q in content.items())
+            if layout:
+                used, total = locations.occupancy(slots, layout)
+                oc1, oc2 = st.columns(2)
+                oc1.metric("תאים תפוסים", f"{used}/{total}")
+                oc2.metric("תפוסה", f"{used / total:.0%}")
+                floor = st.number_input("קומה", min_value=1, max_value=layout['floors'], step=1, value=1, key="loc_floor")
+                grid = locations.floor_grid(slots, layout, floor)
+                st.dataframe([{"שורה": r, **{c: describe(content) for c, content in row.items()}} for r, row in grid.items()],
+                             hide_index=True, use_container_width=True)
+            else:
+                st.caption(f"לא הוגדר מבנה - {len(slots)} תאים תפוסים")
+
+            st.caption("מה יש במיקום:")
+            qc1, qc2, qc3 = st.columns(3)
+            q_r = qc1.number_input("שורה", min_value=1, step=1, value=1, key="loc_q_row")
+            q_c = qc2.text_input("עמודה", key="loc_q_col")
+            q_f = qc3.number_input("קומה", min_value=1, step=1, value=1, key="loc_q_floor")
+            content = locations.contents(slots, str(q_r), q_c, str(q_f))
+            if content:
+                st.info(describe(content))
+            else:
+                st.success("✅ התא פנוי")
+
+            with st.expander("🧮 בדיקת מפת המיקומים וחישוב מחדש"):
+                st.caption("משווה את המפות לשורות המלאי. תיקון כותב את המפה מחדש - משמש גם לבנייה ראשונית לנתונים קיימים.")
+                mc1, mc2 = st.columns(2)
+                fix = mc2.button("חשב מחדש ותקן", key="loc_fix")
+                if mc1.button("בדוק", key="loc_verify") or fix:
+                    drift = locations.verify(db, cache.get("Inventory"), list(whs), fix=fix)
+                    if not drift:
+                        st.success("✅ מפות המיקומים תואמות למלאי")
+                    elif fix:
+                        log_action("תיקון מפת מיקומים", f"{len(drift)} תאים תוקנו")
+                        st.success(f"✅ {len(drift)} תאים תוקנו")
+                    else:
+                        st.warning(f"{len(drift)} תאים לא תואמים")
+                        st.dataframe([{"מחסן": wh, "תא": key, "לפי המלאי": describe(exp), "במפה": describe(act)} for wh, key, exp, act in drift],
+                                     hide_index=True)
+
+        # --- חלוקה לאתרים (sites.py) - רק למשתמש עם הרשאה לכל האתרים ---
+        if sites.ALL_SITES in st.session_state.get('user_sites', []):
+            st.divider()
+            with st.expander("🏗️ חלוקה לאתרים", expanded=not sites_ready()):
+                st.caption("ההסבה מוסיפה אתר לכל המסמכים הקיימים (לפי המחסן) ונמשכת מאותו מקום אם נקטעה. "
+                           "עד שהיא מסתיימת כל הנתונים מוצגים כאתר אחד.")
+                if st.button("הפעל הסבה", key="site_migrate", disabled=sites_ready()):
+                    bar = st.progress(0)
+                    names = list(sites.PARTITIONED)
+                    result = sites.migrate(db, progress=lambda name, updated: bar.progress(
+                        (names.index(name) + 1) / len(names), text=f"{name} | {updated} מסמכים עודכנו"))
+                    sites_ready.clear()
+                    get_sites.clear()
+                    log_action("הסבה לאתרים", f"{result['updated']} מסמכים עודכנו")
+                    st.rerun()
+
+                all_whs = cache.get("Warehouses")
+                if all_whs and sites_ready():
+                    st.caption("העברת מחסן לאתר אחר - עם שורות המלאי והבקשות שלו:")
+                    wh_names = {w['name']: w_id for w_id, w in all_whs.items()}
+                    with st.form("rehome_wh"):
+                        rc1, rc2 = st.columns(2)
+                        r_wh = rc1.selectbox("מחסן", list(wh_names))
+                        r_site = rc2.text_input("אתר יעד")
+                        if st.form_submit_button("העבר לאתר"):
+                            r_site = r_site.strip()
+                            if not r_site or r_site == sites.ALL_SITES:
+                                st.error("חובה לציין שם אתר")
+                            else:
+                                bar = st.progress(0)
+                                moved = sites.rehome(db, wh_names[r_wh], r_wh, r_site,
+                                                     progress=lambda done, total, rate: bar.progress(done / total, text=f"{done}/{total} | {rate:.0f}/שנייה"))
+                                cache.merge_many("Inventory", moved["Inventory"])
+                                cache.merge("Warehouses", wh_names[r_wh], {"site": r_site})
+                                get_sites.clear()
+                                get_counts.clear()
+                                log_action("העברת מחסן לאתר", f"{r_wh} -> {r_site} ({len(moved['Inventory'])} שורות, {len(moved['Requests'])} בקשות)")
+                                st.rerun()
+
     # ==========================================
     # 6. ניהול פריטים
     # ==========================================
@@ -548,116 +1198,109 @@ else:
             
             if uploaded_file and st.button("התחל טעינה"):
                 try:
-                    if uploaded_file.name.endswith('.csv'):
-                        try:
-                            df = pd.read_csv(uploaded_file, encoding='utf-8')
-                        except UnicodeDecodeError:
-                            uploaded_file.seek(0)
-                            df = pd.read_csv(uploaded_file, encoding='windows-1255')
-                    else:
-                        df = pd.read_excel(uploaded_file)
-
-                    df.columns = [c.strip().lower() for c in df.columns]
-                    column_map = {
-                        'תיאור': 'description', 'שם פריט': 'description',
-                        'מקט': 'internal_sku', 'מק"ט': 'internal_sku', 'מק\"ט': 'internal_sku', 'מקט רשות': 'internal_sku',
-                        'יצרן': 'manufacturer_sku', 'מקט יצרן': 'manufacturer_sku'
-                    }
-                    df.rename(columns=column_map, inplace=True)
-
-                    if 'description' not in df.columns or 'internal_sku' not in df.columns:
-                        st.error(f"שגיאה בכותרות הקובץ! זוהה: {list(df.columns)}")
-                        st.stop()
-
-                    existing_skus = {doc.to_dict().get('internal_sku') for doc in db.collection("Items").stream()}
-                    added, skipped = 0, 0
+                    df = catalog_import.read_table(uploaded_file)
+                    existing_skus = {i.get('internal_sku') for i in cache.get("Items").values()}
+                    job_id = hashlib.sha1(uploaded_file.getvalue()).hexdigest()
                     progress_bar = st.progress(0)
-                    total_rows = len(df)
-
-                    for index, row in df.iterrows():
-                        desc = str(row['description']).strip()
-                        int_sku = str(row['internal_sku']).strip()
-                        man_sku = ""
-                        if 'manufacturer_sku' in row:
-                            val = str(row['manufacturer_sku']).strip()
-                            if val.lower() != 'nan' and val.lower() != 'none': man_sku = val
-                        
-                        if int_sku in existing_skus or not int_sku or int_sku == 'nan':
-                            skipped += 1
-                            continue
-                        
-                        db.collection("Items").add({"description": desc, "internal_sku": int_sku, "manufacturer_sku": man_sku})
-                        existing_skus.add(int_sku)
-                        added += 1
-                        progress_bar.progress((index + 1) / total_rows)
-                    
-                    st.success(f"✅ טעינה הסתיימה: {added} נוספו | {skipped} דולגו")
+
+                    def show_progress(done, total, rate):
+                        progress_bar.progress(min(done / total, 1.0), text=f"{done}/{total} | {rate:.0f} שורות/שנייה")
+
+                    result = catalog_import.import_items(db, df, existing_skus, job_id, progress=show_progress)
+                    cache.put_many("Items", result['added'])
+                    added = len(result['added'])
+                    log_action("ייבוא פריטים", f"{added} נוספו מ-{uploaded_file.name}")
+                    st.success(f"✅ טעינה הסתיימה: {added} נוספו | {result['skipped']} דולגו | {result['rows_per_sec']:.0f} שורות/שנייה")
+                except catalog_import.ImportFormatError as e:
+                    st.error(str(e))
                 except Exception as e:
                     st.error(f"שגיאה בקריאת הקובץ: {e}")
 
+        with st.expander("🔁 השלמת מק\"טים בשורות המלאי"):
+            st.caption("פעולה חד-פעמית: מעתיקה שם ומק\"טים מהקטלוג לכל שורות המלאי. אפשר להריץ שוב - ממשיכה מהנקודה שבה נעצרה.")
+            if st.button("הרץ השלמה"):
+                status = st.empty()
+                result = catalog_sync.migrate_inventory(db, progress=lambda n, u: status.caption(f"נסרקו {n} שורות | עודכנו {u}"))
+                log_action("השלמת מק\"טים", f"נסרקו {result['scanned']}, עודכנו {result['updated']}")
+                st.success(f"✅ נסרקו {result['scanned']} שורות | עודכנו {result['updated']} | {result['elapsed']:.1f} שניות")
+
+        with st.expander("🧾 יומן תנועות - יתרות פתיחה והתאמה"):
+            st.caption("פעולה חד-פעמית: רושמת תנועת פתיחה לכל מיקום קיים. אפשר להריץ שוב - ממשיכה מהנקודה שבה נעצרה. "
+                       "היתרות עצמן נבנות ונבדקות במסך תמונת מלאי.")
+            if st.button("פתח יומן"):
+                status = st.empty()
+                result = ledger.open_ledger(db, progress=lambda n: status.caption(f"נרשמו {n} תנועות פתיחה"))
+                log_action("פתיחת יומן תנועות", f"{result['opened']} מיקומים")
+                st.success(f"✅ {result['opened']} תנועות פתיחה | {result['elapsed']:.1f} שניות")
+
         st.divider()
         manage_search = st.text_input("🔍 חפש ברשימה", placeholder="שם או מק\"ט")
         
         with st.expander("➕ הוסף ידנית"):
             d, r, y = st.text_input("תיאור"), st.text_input("מק\"ט רשות"), st.text_input("יצרן")
             if st.button("שמור חדש"):
-                if list(db.collection("Items").where("internal_sku", "==", r).stream()): 
+                if any(i.get('internal_sku') == r for i in cache.get("Items").values()): 
                     st.error("מק\"ט קיים!")
                 else: 
-                    db.collection("Items").add({"description": d, "internal_sku": r, "manufacturer_sku": y})
+                    new_item = {"description": d, "internal_sku": r, "manufacturer_sku": y}
+                    _, item_ref = db.collection("Items").add(new_item)
+                    cache.put("Items", item_ref.id, new_item)
                     st.success("נוסף!")
                     st.rerun()
         
         st.write("---")
 
         if st.session_state['edit_item_id']:
-            doc = db.collection("Items").document(st.session_state['edit_item_id']).get()
-            if doc.exists:
-                data = doc.to_dict()
+            data = cache.get("Items").get(st.session_state['edit_item_id'])
+            if data is not None:
                 with st.form("edit_item"):
                     nd = st.text_input("תיאור", data['description'])
                     ni = st.text_input("מק\"ט רשות", data['internal_sku'])
                     nm = st.text_input("מק\"ט יצרן", data.get('manufacturer_sku', ''))
                     if st.form_submit_button("שמור"):
-                        db.collection("Items").document(st.session_state['edit_item_id']).update({"description": nd, "internal_sku": ni, "manufacturer_sku": nm})
-                        for i in db.collection("Inventory").where("item_id", "==", st.session_state['edit_item_id']).stream():
-                             db.collection("Inventory").document(i.id).update({"item_name": nd})
+                        edited = {"description": nd, "internal_sku": ni, "manufacturer_sku": nm}
+                        db.collection("Items").document(st.session_state['edit_item_id']).update(edited)
+                        cache.merge("Items", st.session_state['edit_item_id'], edited)
+                        # שם ומק"טים משוכפלים בשורות המלאי - עדכון ב-batch לכל השורות של הפריט
+                        bar = st.progress(0)
+                        fanned = catalog_sync.fan_out_item(db, st.session_state['edit_item_id'], edited, item_inventory(st.session_state['edit_item_id']),
+                                                           progress=lambda done, total, rate: bar.progress(done / total, text=f"{done}/{total} שורות מלאי"))
+                        cache.merge_many("Inventory", fanned)
                         st.session_state['edit_item_id'] = None
                         st.rerun()
                 if st.button("ביטול"): st.session_state['edit_item_id'] = None; st.rerun()
         else:
-            items_stream = list(db.collection("Items").stream())
-            ms = manage_search.lower()
-            filtered = [
-                i for i in items_stream 
-                if not ms or 
-                ms in i.to_dict().get('description', '').lower() or 
-                ms in str(i.to_dict().get('internal_sku', '')).lower() or 
-                ms in str(i.to_dict().get('manufacturer_sku', '')).lower()
-            ]
+            items_db = cache.get("Items")
+            page, size = page_window("items", manage_search)
+            end = (page + 1) * size + 1
+            item_ids = search.search_items(manage_search, limit=end) if manage_search else list(itertools.islice(items_db, end))
+            has_next = len(item_ids) > (page + 1) * size
+            filtered = [(i_id, items_db[i_id]) for i_id in item_ids[page * size:(page + 1) * size] if i_id in items_db]
             
-            for i in filtered:
-                it = i.to_dict()
+            for i_id, it in filtered:
                 cols = st.columns([4, 1, 1])
                 cols[0].write(f"🔹 {it['description']} ({it['internal_sku']})")
                 
-                if cols[1].button("🗑️", key=f"btn_del_it_{i.id}"):
-                    st.session_state[f"del_it_{i.id}"] = True
+                if cols[1].button("🗑️", key=f"btn_del_it_{i_id}"):
+                    st.session_state[f"del_it_{i_id}"] = True
                     st.rerun()
                 
-                if st.session_state.get(f"del_it_{i.id}", False):
+                if st.session_state.get(f"del_it_{i_id}", False):
                     st.error(f"למחוק את {it['description']}?")
                     cy, cn = st.columns(2)
-                    if cy.button("כן", key=f"yes_it_{i.id}"):
-                        db.collection("Items").document(i.id).delete()
+                    if cy.button("כן", key=f"yes_it_{i_id}"):
+                        db.collection("Items").document(i_id).delete()
+                        cache.drop("Items", i_id)
                         log_action("מחיקת פריט", it['description'])
-                        del st.session_state[f"del_it_{i.id}"]
+                        del st.session_state[f"del_it_{i_id}"]
                         st.rerun()
-                    if cn.button("ביטול", key=f"no_it_{i.id}"):
-                        del st.session_state[f"del_it_{i.id}"]
+                    if cn.button("ביטול", key=f"no_it_{i_id}"):
+                        del st.session_state[f"del_it_{i_id}"]
                         st.rerun()
 
-                if cols[2].button("✏️", key=f"e_{i.id}"): st.session_state['edit_item_id'] = i.id; st.rerun()
+                if cols[2].button("✏️", key=f"e_{i_id}"): st.session_state['edit_item_id'] = i_id; st.rerun()
+
+            page_nav("items", page, has_next)
 
     # ==========================================
     # 7. ניהול משתמשים
@@ -669,6 +1312,11 @@ else:
         pending = [u for u in users_stream if not u.to_dict().get('approved')]
         reset_reqs = [u for u in users_stream if u.to_dict().get('reset_requested')]
         approved = [u for u in users_stream if u.to_dict().get('approved')]
+        # מנהל של אתרים מסוימים רואה רק את המשתמשים שחולקים איתו אתר
+        my_sites = st.session_state.get('user_sites', [])
+        all_sites = sites.ALL_SITES in my_sites
+        if not all_sites:
+            approved = [u for u in approved if set(sites.user_sites(u.to_dict())) & set(my_sites)]
         
         if reset_reqs:
             st.warning(f"🔒 {len(reset_reqs)} בקשות איפוס")
@@ -678,6 +1326,7 @@ else:
                     st.write(f"{data['email']} מבקש איפוס")
                     if st.button("אפס ל-123456", key=f"rst_{u.id}"):
                         db.collection("Users").document(u.id).update({"password": "123456", "reset_requested": False})
+                        get_counts.clear()
                         st.rerun()
 
         if pending:
@@ -689,9 +1338,11 @@ else:
                     c1.write(f"**{data['email']}** ({data.get('role')})")
                     if c2.button("אשר", key=f"ap_{u.id}"):
                         db.collection("Users").document(u.id).update({"approved": True})
+                        get_counts.clear()
                         st.rerun()
                     if c3.button("מחק", key=f"dl_{u.id}"):
                         db.collection("Users").document(u.id).delete()
+                        get_counts.clear()
                         st.rerun()
 
         st.divider()
@@ -708,6 +1359,17 @@ else:
                     db.collection("Users").document(u.id).update({"role": new_role})
                     st.success("עודכן")
                     st.rerun()
+
+                if all_sites:
+                    curr_sites = sites.user_sites(data)
+                    site_opts = [sites.ALL_SITES] + sites.known_sites(cache.get("Warehouses"), curr_sites)
+                    new_sites = c1.multiselect("אתרים", site_opts, default=curr_sites, key=f"st_{u.id}",
+                                               format_func=lambda x: "🌐 כל האתרים" if x == sites.ALL_SITES else x)
+                    if c1.button("עדכן אתרים", key=f"upd_st_{u.id}", disabled=not new_sites):
+                        db.collection("Users").document(u.id).update({"sites": new_sites})
+                        log_action("עדכון אתרי משתמש", f"{data['email']}: {', '.join(new_sites)}")
+                        st.success("עודכן")
+                        st.rerun()
                 
                 if c2.button("מחק משתמש", key=f"btn_del_u_{u.id}"):
                     st.session_state[f"del_u_{u.id}"] = True
@@ -730,13 +1392,25 @@ else:
     # ==========================================
     elif choice_key == "logs":
         st.subheader("📜 יומן פעילות")
+        # היומן נכתב ברקע כל חצי שנייה (audit_log); רענון יזום ממתין גם לרשומות שעוד בתור
+        if st.button("🔄 רענן", key="lg_refresh"):
+            log_sink.flush(timeout=2)
+
+        fc1, fc2 = st.columns(2)
+        f_user = fc1.text_input("משתמש (אימייל)", key="lg_user").strip()
+        f_action = fc2.selectbox("פעולה", ["הכל"] + LOG_ACTIONS, key="lg_action")
+        f_dates = st.date_input("טווח תאריכים", value=(), key="lg_dates")
+        f_action = None if f_action == "הכל" else f_action
+        signature = (f_user, f_action, tuple(f_dates))
+
         try:
-            logs = db.collection("Logs").order_by("timestamp", direction=firestore.Query.DESCENDING).limit(50).stream()
+            pager = query_pager("logs", lambda: logs_query(f_user, f_action, f_dates), signature, live=True)
+            page, _ = page_window("logs", signature)
             data = []
-            for log in logs:
+            for log in pager.page(page):
                 l = log.to_dict()
                 ts = l.get('timestamp')
-                time_str = ts.strftime("%d/%m %H:%M") if ts else "?"
+                time_str = ts.strftime("%d/%m/%y %H:%M") if ts else "?"
                 data.append({
                     "זמן": time_str,
                     "משתמש": l.get('user', '?'),
@@ -747,5 +1421,210 @@ else:
                 st.table(data)
             else:
                 st.info("היומן ריק")
+            page_nav("logs", page, pager.has_next(page))
         except Exception as e:
-            st.error(f"לא ניתן לטעון לוגים: {e}")
\ No newline at end of file
+            st.error(f"לא ניתן לטעון לוגים: {e}")
+
+        with st.expander("📤 ייצוא לפי הסינון"):
+            fmt = st.radio("פורמט", ["CSV", "Parquet"], horizontal=True, key="lg_fmt")
+            if st.button("הכן קובץ"):
+                status = st.empty()
+                show = lambda n, rate: status.caption(f"{n} רשומות | {rate:.0f} רשומות/שנייה")
+                rows = (d.to_dict() for d in export.iter_docs(logs_query(f_user, f_action, f_dates)))
+                try:
+                    if fmt == "CSV":
+                        path, stats = export.write_csv(rows, LOG_COLUMNS, show)
+                    else:
+                        path, stats = export.write_parquet(rows, LOG_COLUMNS, {"timestamp"}, show)
+                    replace_export("logs", path)
+                    status.caption(f"✅ {stats['rows']} רשומות | {stats['rows_per_sec']:.0f} רשומות/שנייה")
+                    log_action("ייצוא יומן", f"{stats['rows']} רשומות ({fmt})")
+                except export.ExportError as e:
+                    st.error(str(e))
+            export_download("logs")
+
+
+    # ==========================================
+    # 9. תמונת מלאי (סיכומים מחושבים מראש)
+    # ==========================================
+    elif choice_key == "dashboard":
+        # הכל נקרא ממסמכי הסיכום (rollups.py) - בלי מעבר על שורות המלאי
+        totals = rollups.warehouse_totals(db, view_site())
+        if totals:
+            cols = st.columns(min(len(totals), 4))
+            for i, (wh, qty) in enumerate(sorted(totals.items())):
+                cols[i % len(cols)].metric(wh, qty)
+        else:
+            st.info("אין עדיין סיכומים - הרץ חישוב מחדש למטה")
+
+        items = cache.get("Items")
+        item_name = lambda item_id: items.get(item_id, {}).get('description', item_id)
+
+        st.subheader("🔍 פריט בכל המחסנים")
+        dq = st.text_input("שם או מק\"ט", key="dash_item")
+        if dq:
+            for item_id in search.search_items(dq, limit=5):
+                split = rollups.item_by_warehouse(db, item_id)
+                with st.container(border=True):
+                    dc1, dc2 = st.columns([1, 2])
+                    dc1.metric(item_name(item_id), rollups.item_total(db, item_id))
+                    dc2.caption(" | ".join(f"{wh}: {qty}" for wh, qty in sorted(split.items()) if qty) or "אין במלאי")
+
+        st.subheader("⚠️ מלאי נמוך")
+        lc1, lc2 = st.columns(2)
+        threshold = lc1.number_input("סף", min_value=0, value=rollups.LOW_STOCK, key="dash_low")
+        low_wh = lc2.selectbox("מחסן", ["כל המחסנים"] + warehouse_names(), key="dash_wh")
+        low = rollups.low_stock(db, threshold, None if low_wh == "כל המחסנים" else low_wh, view_site())
+        if low:
+            st.dataframe([{"פריט": item_name(item_id), **({"מחסן": wh} if wh else {}), "כמות": qty} for item_id, wh, qty in low],
+                         hide_index=True)
+        else:
+            st.success("✅ אין פריטים מתחת לסף")
+
+        with st.expander("🧮 בדיקת סיכומים וחישוב מחדש"):
+            st.caption("משווה את הסיכומים לשורות המלאי. תיקון כותב ערכים מוחלטים - משמש גם לבנייה ראשונית לנתונים קיימים.")
+            vc1, vc2 = st.columns(2)
+            fix = vc2.button("חשב מחדש ותקן")
+            if vc1.button("בדוק") or fix:
+                drift = rollups.verify(db, all_inventory(), fix=fix)
+                rows = [{"רמה": level, "מזהה": key, "לפי המלאי": want, "בסיכום": got}
+                        for level, diffs in drift.items() for key, want, got in diffs]
+                if not rows:
+                    st.success("✅ כל הסיכומים תואמים למלאי")
+                elif fix:
+                    log_action("תיקון סיכומי מלאי", f"{len(rows)} סיכומים תוקנו")
+                    st.success(f"✅ {len(rows)} סיכומים תוקנו")
+                else:
+                    st.warning(f"{len(rows)} סיכומים לא תואמים")
+                    st.dataframe(rows, hide_index=True)
+
+    # ==========================================
+    # 10. ייצוא לביקורת
+    # ==========================================
+    elif choice_key == "export":
+        # הקובץ נכתב תוך כדי דפדוף בשאילתה - זיכרון קבוע גם במאות אלפי שורות
+        datasets = {"inventory": "מלאי (לפי מיקום)", "items": "קטלוג (עם סה\"כ במלאי)", "requests": "בקשות משיכה (עם המיקום)"}
+        dataset = st.radio("מה לייצא", list(datasets), format_func=datasets.get, key="ex_dataset")
+        whs = ["כל המחסנים"] + warehouse_names()
+        if dataset == "inventory":
+            ex_wh = st.selectbox("מחסן", whs, key="ex_inv_wh")
+            q = db.collection("Inventory")
+            if ex_wh != "כל המחסנים":
+                q = q.where("warehouse", "==", ex_wh)
+            else:
+                q = sites.scoped(q, view_site())
+            make_rows, columns = (lambda: export.inventory_rows(q)), export.INVENTORY_COLUMNS
+        elif dataset == "items":
+            make_rows, columns = (lambda: export.item_rows(db, db.collection("Items"))), export.ITEM_COLUMNS
+        else:
+            ec1, ec2 = st.columns(2)
+            ex_status = ec1.selectbox("סטטוס", ["הכל"] + list(REQUEST_STATUSES), format_func=lambda x: REQUEST_STATUSES.get(x, x), key="ex_req_status")
+            ex_wh = ec2.selectbox("מחסן", whs, key="ex_req_wh")
+            ex_dates = st.date_input("טווח תאריכים", value=(), key="ex_req_dates")
+            q = requests_query(None if ex_status == "הכל" else ex_status, None if ex_wh == "כל המחסנים" else ex_wh, ex_dates)
+            make_rows, columns = (lambda: export.request_rows(db, q)), export.REQUEST_COLUMNS
+
+        fmt = st.radio("פורמט", ["XLSX", "CSV"], horizontal=True, key="ex_fmt")
+        if st.button("הכן קובץ", key="ex_go"):
+            status = st.empty()
+            show = lambda n, rate: status.caption(f"{n} שורות | {rate:.0f} שורות/שנייה")
+            try:
+                if fmt == "CSV":
+                    path, stats = export.write_csv(make_rows(), columns, show)
+                else:
+                    path, stats = export.write_xlsx(make_rows(), columns, show, sheet_title=dataset)
+                replace_export(dataset, path)
+                status.caption(f"✅ {stats['rows']} שורות | {stats['elapsed']:.1f} שניות | {stats['rows_per_sec']:.0f} שורות/שנייה")
+                log_action("ייצוא לביקורת", f"{datasets[dataset]}: {stats['rows']} שורות ({fmt})")
+            except export.ExportError as e:
+                st.error(str(e))
+        export_download(dataset)
+
+    # ==========================================
+    # 11. מסלול ליקוט
+    # ==========================================
+    elif choice_key == "pick":
+        # בקשות שאושרו מקובצות לתחנות לפי תא, ולכל מחסן סדר ביקור קצר (pick_route.py)
+        pc1, pc2 = st.columns(2)
+        pk_wh = pc1.selectbox("מחסן", ["כל המחסנים"] + warehouse_names(), key="pk_wh")
+        today = datetime.now().date()
+        pk_dates = pc2.date_input("בקשות מתאריך", value=(today, today), key="pk_dates")
+        if st.button("🧭 חשב מסלול", key="pk_go"):
+            q = requests_query("approved", None if pk_wh == "כל המחסנים" else pk_wh, pk_dates)
+            reqs = [(d.id, d.to_dict()) for d in q.limit(PICK_LIMIT).stream()]
+            layouts = {wh: warehouse_layout(wh) for wh in warehouse_names()}
+            routes, missing = pick_route.plan(reqs, cache.get("Inventory"), layouts)
+            st.session_state['pick_plan'] = {"routes": routes, "missing": missing, "requests": len(reqs)}
+
+        result = st.session_state.get('pick_plan')
+        if result:
+            if result['requests'] >= PICK_LIMIT:
+                st.warning(f"חושב ל-{PICK_LIMIT} הבקשות הראשונות בלבד - צמצם את הטווח")
+            if result['missing']:
+                st.warning(f"{len(result['missing'])} בקשות בלי מיקום במלאי - לא נכללו במסלול")
+            if not result['routes']:
+                st.info("אין בקשות מאושרות בטווח")
+            for wh, r in sorted(result['routes'].items()):
+                st.subheader(f"🏭 {wh}")
+                saved = 1 - r['length'] / r['baseline'] if r['baseline'] else 0
+                m1, m2, m3, m4 = st.columns(4)
+                m1.metric("תחנות", len(r['stops']))
+                m2.metric("אורך מסלול", f"{r['length']:.0f}")
+                m3.metric("לפי סדר הבקשות", f"{r['baseline']:.0f}")
+                m4.metric("חיסכון", f"{saved:.0%}")
+                st.caption(f"{r['method']} | {r['elapsed'] * 1000:.0f}ms")
+                st.dataframe([{
+                    "#": n, "שורה": s['row'], "עמודה": s['column'], "קומה": s['floor'],
+                    "פריט": line['item_name'], "כמות": line['quantity'], "מבקש": line['user_email']
+                } for n, s in enumerate(r['stops'], 1) for line in s['lines']], hide_index=True, use_container_width=True)
+
+    # ==========================================
+    # 12. תחזית צריכה ונקודות הזמנה
+    # ==========================================
+    elif choice_key == "forecast":
+        # צבירה מצטברת של בקשות שאושרו מאז הריצה הקודמת (forecast.py) - במטמון לפי FORECAST_TTL,
+        # והסדרות נקראות מחדש רק כשה-watermark זז
+        with st.expander("🧮 חישוב מחדש מכל ההיסטוריה"):
+            st.caption("בונה את סדרות הצריכה מאפס מכל הבקשות שאושרו - לנתונים קיימים או אחרי תיקון ידני של בקשות.")
+            if st.button("חשב מחדש", key="fc_rebuild"):
+                status = st.empty()
+                try:
+                    res = forecast.rebuild(db, progress=lambda n: status.caption(f"{n} בקשות"))
+                    forecast_refresh.clear()
+                    demand_series.clear()
+                    log_action("חישוב תחזית מחדש", f"{res['rows']} בקשות, {res['items']} פריטים")
+                    status.caption(f"✅ {res['rows']} בקשות | {res['items']} פריטים")
+                except forecast.ForecastError as e:
+                    status.error(str(e))
+        if st.button("🔄 עדכן נתונים", key="fc_refresh"):
+            forecast_refresh.clear()
+        res = forecast_refresh()
+        mark = res['watermark']
+        if res.get('busy'):
+            st.caption("⏳ עדכון אחר רץ כרגע - מוצגים הנתונים עד סיומו")
+        series = demand_series(mark) if mark is not None else {}
+
+        fc1, fc2, fc3 = st.columns(3)
+        window = fc1.number_input("חלון (ימים)", min_value=7, max_value=365, step=1, value=forecast.WINDOW_DAYS, key="fc_window")
+        lead = fc2.number_input("זמן אספקה (ימים)", min_value=1, step=1, value=forecast.LEAD_TIME_DAYS, key="fc_lead")
+        level = fc3.selectbox("רמת שירות", list(forecast.SERVICE_LEVELS), index=1, key="fc_level")
+        if mark is None:
+            st.info("אין עדיין בקשות מאושרות לחישוב")
+        else:
+            table = forecast.metrics(series, stock_on_hand(mark), mark, int(window), int(lead), forecast.SERVICE_LEVELS[level])
+            items = cache.get("Items")
+            mc1, mc2 = st.columns(2)
+            mc1.metric("פריטים להזמנה", int(table['reorder'].sum()))
+            mc2.metric("פריטים עם צריכה", int((table['rate'] > 0).sum()))
+            st.caption(f"נתונים עד {mark:%d/%m/%Y %H:%M} | {res['rows']} בקשות חדשות נצברו בעדכון האחרון")
+            if st.toggle("רק פריטים להזמנה", value=True, key="fc_only"):
+                table = table[table['reorder']]
+            table = table.sort_values("days_of_cover")
+            st.dataframe([{
+                "פריט": items.get(item_id, {}).get('description', item_id), "מק\"ט": items.get(item_id, {}).get('internal_sku', ''),
+                "צריכה ליום": round(r.rate, 2), "במלאי": int(r.on_hand), "נקודת הזמנה": int(r.reorder_point),
+                "מלאי ביטחון": int(r.safety_stock), "ימי כיסוי": None if r.days_of_cover == float("inf") else round(r.days_of_cover, 1),
+                "סטטוס": "🔴 להזמין" if r.reorder else ""
+            } for item_id, r in zip(table.index, table.itertuples())], hide_index=True, use_container_width=True)
+
+finish_profile()
@@ -0,0 +1,102 @@
+import atexit
+import queue
+import threading
+import time
+
+# --- כתיבת יומן פעילות אסינכרונית ---
+# log_action רק מכניס רשומה לתור חסום-גודל; תהליכון רקע מרוקן אותו לכתיבות batch.
+# כשהתור מלא הכותב ממתין עד put_timeout (לחץ חוזר) ואז הרשומה נזרקת ונספרת.
+# בסגירת התהליך (atexit) כל מה שבתור נכתב לפני היציאה.
+
+MAX_QUEUE = 10000
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 0.5
+PUT_TIMEOUT = 0.05
+WRITE_ATTEMPTS = 3
+
+_STOP = object()
+
+
+class LogSink:
+    def __init__(self, db, max_queue=MAX_QUEUE, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, put_timeout=PUT_TIMEOUT):
+        self._db = db
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.metrics = {"enqueued": 0, "written": 0, "dropped": 0, "batches": 0, "errors": 0, "last_flush_ms": 0.0, "max_flush_ms": 0.0}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.metrics[key] += n
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def write(self, entry):
+        try:
+            self._queue.put(entry, timeout=self.put_timeout)
+            self._count("enqueued")
+        except queue.Full:
+            self._count("dropped")
+
+    def _run(self):
+        while True:
+            entries = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while entries[-1] is not _STOP and len(entries) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entries.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            stop = entries[-1] is _STOP
+            if stop:
+                entries.pop()
+            if entries:
+                self._flush(entries)
+            for _ in range(len(entries) + stop):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _flush(self, entries):
+        start = time.perf_counter()
+        for attempt in range(WRITE_ATTEMPTS):
+            try:
+                batch = self._db.batch()
+                for entry in entries:
+                    batch.set(self._db.collection("Logs").document(), entry)
+                batch.commit()
+                break
+            except Exception:
+                self._count("errors")
+                if attempt == WRITE_ATTEMPTS - 1:
+                    self._count("dropped", len(entries))
+                    return
+                time.sleep(0.2 * 2 ** attempt)
+        ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.metrics["written"] += len(entries)
+            self.metrics["batches"] += 1
+            self.metrics["last_flush_ms"] = ms
+            self.metrics["max_flush_ms"] = max(self.metrics["max_flush_ms"], ms)
+
+    def flush(self, timeout=5.0):
+        # ממתין עד שכל מה שבתור נכתב (למשל לפני הצגת היומן)
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self._queue.unfinished_tasks
+
+    def close(self, timeout=10.0):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
@@ -0,0 +1,856 @@
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from google.cloud import firestore
+
+import catalog_import
+import catalog_sync
+import bulk_ops
+import export
+import forecast
+import inventory_ops
+import pick_route
+import sites
+import storage
+from audit_log import LogSink
+from metering import MeteredClient
+from search_index import CatalogSearch
+from snapshot_cache import SnapshotCache
+from write_queue import WriteQueue
+
+# --- בדיקות עומס וביצועים ---
+# מריצים מול אמולטור Firestore בלבד (לא מול הפרויקט האמיתי!):
+#   firebase emulators:start --only firestore
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 python bench.py stress
+# השוואת מנועי האחסון (backends) רצה גם בלי אמולטור - על memory ו-sqlite בלבד.
+# סימולציית משתמשים (load) רצה על --backend memory|sqlite|emulator.
+# זמן עלייה (startup) מריץ את app.py בתהליך נקי (AppTest) - בלי Firebase ובלי אמולטור.
+# מסלול ליקוט (route) - חישוב בלבד, בלי מסד נתונים. תחזית (forecast) - חישוב בזיכרון + צבירה על sqlite.
+
+
+def emulator_client():
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        sys.exit("FIRESTORE_EMULATOR_HOST לא מוגדר - הבדיקה רצה רק מול האמולטור")
+    return firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "warehouse-bench"))
+
+
+# ==========================================
+# עדכוני כמויות במקביל - הוכחה שאין אובדן עדכונים
+# ==========================================
+def stress(args):
+    db = emulator_client()
+    loc_id = f"bench_{int(time.time())}"
+    initial = args.pulls * args.workers
+    db.collection("Inventory").document(loc_id).set({
+        "item_name": "bench", "warehouse": "bench", "row": "1", "column": "A", "floor": "1",
+        "quantity": initial, "item_id": "bench"
+    })
+
+    def receiver(_):
+        for _ in range(args.adds):
+            inventory_ops.add_stock(db, loc_id, 1)
+
+    def picker(_):
+        approved = 0
+        for _ in range(args.pulls):
+            _, ref = db.collection("Requests").add({
+                "user_email": "bench", "item_name": "bench", "location_id": loc_id,
+                "quantity": 1, "reason": "", "status": "pending", "timestamp": time.time()
+            })
+            try:
+                inventory_ops.approve_request(db, ref.id, loc_id)
+                approved += 1
+            except inventory_ops.ContentionError:
+                pass
+        return approved
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers * 2) as pool:
+        adds = [pool.submit(receiver, i) for i in range(args.workers)]
+        pulls = [pool.submit(picker, i) for i in range(args.workers)]
+        approved = sum(f.result() for f in pulls)
+        for f in adds:
+            f.result()
+    elapsed = time.perf_counter() - start
+
+    final = db.collection("Inventory").document(loc_id).get().get('quantity')
+    expected = initial + args.adds * args.workers - approved
+    writes = args.adds * args.workers + approved
+    print(f"writes: {writes} in {elapsed:.2f}s ({writes / elapsed:.0f}/s)")
+    print(f"stats: {inventory_ops.stats}")
+    print(f"final quantity: {final} | expected: {expected}")
+    if final != expected:
+        sys.exit("LOST UPDATES")
+    print("OK - no lost updates")
+
+
+# ==========================================
+# ייבוא קטלוג - הלולאה הישנה מול הצינור החדש
+# ==========================================
+def synthetic_catalog(rows, prefix):
+    import pandas as pd
+    return pd.DataFrame({
+        "תיאור": [f"שרוול בדיקה {i}" for i in range(rows)],
+        "מק\"ט": [f"{prefix}{i:07d}" for i in range(rows)],
+        "יצרן": [f"MX-{i}" if i % 3 else None for i in range(rows)],
+    })
+
+
+def legacy_import(db, df):
+    # העתק של הלולאה המקורית: iterrows + add לכל שורה
+    df = df.rename(columns=lambda c: str(c).strip().lower()).rename(columns=catalog_import.COLUMN_MAP)
+    existing_skus = {doc.to_dict().get('internal_sku') for doc in db.collection("Items").stream()}
+    added = 0
+    for _, row in df.iterrows():
+        desc = str(row['description']).strip()
+        int_sku = str(row['internal_sku']).strip()
+        man_sku = ""
+        val = str(row['manufacturer_sku']).strip()
+        if val.lower() != 'nan' and val.lower() != 'none': man_sku = val
+        if int_sku in existing_skus or not int_sku or int_sku == 'nan':
+            continue
+        db.collection("Items").add({"description": desc, "internal_sku": int_sku, "manufacturer_sku": man_sku})
+        existing_skus.add(int_sku)
+        added += 1
+    return added
+
+
+def import_bench(args):
+    db = emulator_client()
+    run = int(time.time())
+    if not args.skip_legacy:
+        df = synthetic_catalog(args.rows, f"L{run}-")
+        start = time.perf_counter()
+        added = legacy_import(db, df)
+        elapsed = time.perf_counter() - start
+        print(f"legacy:   {added} rows in {elapsed:.1f}s ({added / elapsed:.0f} rows/s)")
+
+    df = synthetic_catalog(args.rows, f"B{run}-")
+    result = catalog_import.import_items(db, df, set(), f"bench_{run}", workers=args.workers)
+    print(f"batched:  {len(result['added'])} rows in {result['elapsed']:.1f}s ({result['rows_per_sec']:.0f} rows/s)")
+
+
+# ==========================================
+# קריאות מסמכים למסך - משיכה ואישור, לפני ואחרי
+# ==========================================
+def seed_requests(db, run, warehouses, items, requests):
+    batch, ops = db.batch(), 0
+    for i in range(items):
+        wh = f"wh{run}_{i % warehouses}"
+        loc = f"{wh}_1_A_1_item{run}_{i}"
+        batch.set(db.collection("Items").document(f"item{run}_{i}"), {"description": f"bench {i}", "internal_sku": f"S{run}-{i}", "manufacturer_sku": ""})
+        batch.set(db.collection("Inventory").document(loc), {
+            "item_name": f"bench {i}", "warehouse": wh, "row": "1", "column": "A", "floor": "1", "quantity": 100, "item_id": f"item{run}_{i}"
+        })
+        ops += 2
+        if ops >= 498:
+            batch.commit()
+            batch, ops = db.batch(), 0
+    for i in range(requests):
+        n = i % items
+        wh = f"wh{run}_{n % warehouses}"
+        batch.set(db.collection("Requests").document(), {
+            "user_email": "bench", "item_name": f"bench {n}", "location_id": f"{wh}_1_A_1_item{run}_{n}",
+            "item_id": f"item{run}_{n}", "warehouse": wh, "quantity": 1, "reason": "", "status": "pending", "timestamp": time.time()
+        })
+        ops += 1
+        if ops >= 498:
+            batch.commit()
+            batch, ops = db.batch(), 0
+    batch.commit()
+
+
+def reads_bench(args):
+    db = emulator_client()
+    run = int(time.time())
+    seed_requests(db, run, args.warehouses, args.items, args.requests)
+    wh = f"wh{run}_0"
+
+    # לפני: כל הבקשות הממתינות נמשכות, וכל אישור קורא את המיקום בנפרד
+    legacy_approve = len(list(db.collection("Requests").where("status", "==", "pending").stream()))
+    # אחרי: עמוד אחד, מסונן בשרת לפי מחסן
+    pending = db.collection("Requests").where("status", "==", "pending").where("warehouse", "==", wh).order_by("timestamp")
+    paged_approve = len(list(pending.limit(args.page_size).stream()))
+
+    # לפני: כל הקטלוג + כל המלאי בכל ריצה של המסך; אחרי: מטמון - 0 קריאות אחרי הטעינה הראשונה
+    legacy_pull = len(list(db.collection("Items").stream())) + len(list(db.collection("Inventory").where("quantity", ">", 0).stream()))
+
+    print(f"approve screen reads: {legacy_approve} -> {paged_approve} (page of {args.page_size}, warehouse filter)")
+    print("approve click: get + 2 separate updates (3 round trips) -> one get_all + one transactional commit (2 round trips)")
+    print(f"pull screen reads per rerun: {legacy_pull} -> 0 (snapshot cache)")
+
+
+# ==========================================
+# אישור מרובה מול אישור אחד-אחד
+# ==========================================
+def bulk_bench(args):
+    db = emulator_client()
+    run = int(time.time())
+    seed_requests(db, run, args.warehouses, args.items, args.requests * 2)
+
+    def log_entry(action, details):
+        return {"timestamp": datetime.now(), "user": "bench", "role": "bench", "action": action, "details": details, "site": sites.DEFAULT_SITE}
+
+    pending = [(d.id, d.to_dict()) for d in db.collection("Requests").where("status", "==", "pending")
+               .where("warehouse", "==", f"wh{run}_0").stream()]
+    pending += [(d.id, d.to_dict()) for d in db.collection("Requests").where("status", "==", "pending")
+                .where("warehouse", "==", f"wh{run}_1").stream()]
+    single, bulk = pending[:args.requests], pending[args.requests:2 * args.requests]
+
+    start = time.perf_counter()
+    for req_id, r in single:
+        inventory_ops.approve_request(db, req_id, r['location_id'])
+        db.collection("Logs").add(log_entry("אישור משיכה", req_id))
+    elapsed = time.perf_counter() - start
+    print(f"one by one: {len(single)} requests in {elapsed:.2f}s ({len(single) / elapsed:.1f} req/s)")
+
+    result = inventory_ops.decide_requests(db, bulk, True, log_entry)
+    print(f"bulk:       {len(result['done'])} requests in {result['elapsed']:.2f}s ({result['per_sec']:.1f} req/s), {len(result['skipped'])} skipped")
+
+
+# ==========================================
+# השוואת מנועי אחסון - זמן לפעולה
+# ==========================================
+def _timed(fn, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        fn(i)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def backend_ops(db, args):
+    run = int(time.time())
+    seed_requests(db, run, args.warehouses, args.items, args.requests)
+    wh = f"wh{run}_0"
+    loc = lambda i: f"wh{run}_{i % args.warehouses}_1_A_1_item{run}_{i % args.items}"
+    pending = db.collection("Requests").where("status", "==", "pending").where("warehouse", "==", wh).order_by("timestamp")
+    to_approve = [(d.id, d.to_dict()) for d in pending.limit(args.repeat * 2).stream()]
+    single, bulk = to_approve[:args.repeat], to_approve[args.repeat:]
+
+    def log_entry(action, details):
+        return {"timestamp": datetime.now(), "user": "bench", "role": "bench", "action": action, "details": details, "site": sites.DEFAULT_SITE}
+
+    return {
+        "get doc": _timed(lambda i: db.collection("Inventory").document(loc(i)).get(), args.repeat),
+        "page (filter+order)": _timed(lambda i: list(pending.limit(20).stream()), args.repeat),
+        "count": _timed(lambda i: pending.count().get(), args.repeat),
+        "add_stock": _timed(lambda i: inventory_ops.add_stock(db, loc(i), 1), args.repeat),
+        "approve (tx)": _timed(lambda i: inventory_ops.approve_request(db, single[i][0], single[i][1]['location_id']), len(single)),
+        "bulk approve / req": inventory_ops.decide_requests(db, bulk, True, log_entry)["elapsed"] / max(len(bulk), 1) * 1000,
+    }
+
+
+def backends_bench(args):
+    backends = [("memory", storage.MemoryClient())]
+    path = os.path.join(args.dir, f"bench_{int(time.time())}.db")
+    backends.append(("sqlite", storage.SQLiteClient(path)))
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        backends.append(("emulator", emulator_client()))
+    results = {}
+    for name, db in backends:
+        results[name] = backend_ops(db, args)
+        db.close()
+    os.remove(path)
+    print(f"{'ms per op':<22}" + "".join(f"{name:>12}" for name in results))
+    for op in next(iter(results.values())):
+        print(f"{op:<22}" + "".join(f"{r[op]:>12.3f}" for r in results.values()))
+
+
+# ==========================================
+# fan-out - עדכון שדה בשורות רבות (כמו עריכת פריט או העברה לאתר): אחת-אחת מול bulk_ops
+# ==========================================
+def fanout_bench(args):
+    run = int(time.time())
+    path = os.path.join(args.dir, f"fanout_{run}.db")
+    db = emulator_client() if args.backend == "emulator" else storage.open_backend(args.backend, path)
+    wh = f"fan{run}"
+    for prefix in ("L", "B"):
+        batch = db.batch()
+        for i in range(args.rows):
+            batch.set(db.collection("Inventory").document(f"{prefix}{wh}_{i:06d}"), {"item_name": f"bench {i}", "warehouse": f"{prefix}{wh}", "quantity": 1, "item_id": f"item{i}"})
+            if i % 500 == 499:
+                batch.commit()
+                batch = db.batch()
+        batch.commit()
+
+    rows = [f"L{wh}_{i:06d}" for i in range(args.legacy_rows)]
+    start = time.perf_counter()
+    for doc_id in rows:
+        db.collection("Inventory").document(doc_id).update({"warehouse": "מחסן זמני"})
+    elapsed = time.perf_counter() - start
+    print(f"one by one: {len(rows)} rows in {elapsed:.2f}s ({len(rows) / elapsed:.0f} rows/s)")
+
+    moved = {f"B{wh}_{i:06d}": {"warehouse": "מחסן זמני"} for i in range(args.rows)}
+    job_id = bulk_ops.job_key(f"bench_{run}", moved)
+    # נקטע אחרי הנתח הראשון, ואז ממשיך עם אותו job_id
+    first = dict(sorted(moved.items())[:bulk_ops.CHUNK_SIZE])
+    chunk = bulk_ops.apply_updates(db, "Inventory", first, job_id)
+    result = bulk_ops.apply_updates(db, "Inventory", moved, job_id, workers=args.workers)
+    print(f"bulk:       {result['updated']} rows in {result['elapsed']:.2f}s ({result['per_sec']:.0f} rows/s), "
+          f"resumed after {chunk['updated']} rows ({result['skipped']} skipped)")
+    again = bulk_ops.apply_updates(db, "Inventory", moved, job_id)
+    left = sum(1 for d in db.collection("Inventory").where("warehouse", "==", f"B{wh}").stream())
+    print(f"re-run: {again['updated']} written, {again['skipped']} skipped | rows left in warehouse: {left}")
+    db.close()
+    if args.backend == "sqlite":
+        os.remove(path)
+
+
+# ==========================================
+# סימולציית עומס - מלקטים ומנהלים במקביל
+# ==========================================
+def seed_catalog(db, run, items, warehouses):
+    batch, ops = db.batch(), 0
+
+    def add(ref, data):
+        nonlocal batch, ops
+        batch.set(ref, data)
+        ops += 1
+        if ops == 500:
+            batch.commit()
+            batch, ops = db.batch(), 0
+
+    for w in range(warehouses):
+        add(db.collection("Warehouses").document(f"wh{run}_{w}"), {"name": f"wh{run}_{w}", "location": "bench", "site": sites.DEFAULT_SITE})
+    for i in range(items):
+        wh = f"wh{run}_{i % warehouses}"
+        add(db.collection("Items").document(f"item{run}_{i}"), {
+            "description": f"שרוול {i % 97} דגם {i}", "internal_sku": f"S{run}-{i:06d}", "manufacturer_sku": f"MX-{i}" if i % 3 else ""
+        })
+        add(db.collection("Inventory").document(f"{wh}_{i % 20 + 1}_A_1_item{run}_{i}"), {
+            "item_name": f"שרוול {i % 97} דגם {i}", "internal_sku": f"S{run}-{i:06d}", "manufacturer_sku": f"MX-{i}" if i % 3 else "", "warehouse": wh, "row": str(i % 20 + 1), "column": "A", "floor": "1",
+            "quantity": 1000, "item_id": f"item{run}_{i}", "site": sites.DEFAULT_SITE
+        })
+    batch.commit()
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class LoadRun:
+    # אותן קריאות שהמסכים ב-app.py עושים, בלי Streamlit: מטמון + אינדקס משותפים לכל הסשנים,
+    # והכתיבות דרך אותו תור (write_queue) ואותן פונקציות ב-inventory_ops
+    def __init__(self, db, run, args, queue_path):
+        self.db = db
+        self.run = run
+        self.args = args
+        self.cache = SnapshotCache(db)
+        self.search = CatalogSearch()
+        self.cache.subscribe(self.search.on_change)
+        self.log_sink = LogSink(db)
+        self.outbox = WriteQueue(db, queue_path)
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._imports = 0
+
+    def log_entry(self, action, details):
+        return {"timestamp": datetime.now(), "user": "bench", "role": "bench", "action": action, "details": details, "site": sites.DEFAULT_SITE}
+
+    def record(self, action, fn):
+        with self.db.meter.scope() as counts:
+            start = time.perf_counter()
+            try:
+                fn()
+                failed = False
+            except inventory_ops.InventoryError:
+                failed = True
+            ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.samples.setdefault(action, []).append((ms, counts["reads"], counts["writes"]))
+            if failed:
+                self.errors[action] = self.errors.get(action, 0) + 1
+
+    def search_term(self, rng):
+        i = rng.randrange(self.args.items)
+        return rng.choice([f"דגם {i}", f"S{self.run}-{i:06d}"[:-2], f"MX-{i}", f"שרוול {i % 97}"])
+
+    # --- פעולות מלקט ---
+    def do_search(self, rng):
+        inv_docs = self.cache.get("Inventory")
+        ids = self.search.search_inventory(self.search_term(rng), limit=self.args.page_size + 1)
+        [inv_docs.get(i) for i in ids]
+        self.search.search_catalog_only(self.search_term(rng), limit=self.args.page_size + 1)
+
+    def do_pull(self, rng):
+        inv_docs = self.cache.get("Inventory")
+        ids = [i for i in self.search.search_inventory(self.search_term(rng), limit=self.args.page_size) if inv_docs.get(i, {}).get('quantity', 0) > 0]
+        if not ids:
+            return
+        loc = rng.choice(ids)
+        d = inv_docs[loc]
+        self.outbox.submit("request", {
+            "user_email": "bench", "item_name": d['item_name'], "location_id": loc, "item_id": d['item_id'],
+            "warehouse": d['warehouse'], "site": d.get('site') or sites.DEFAULT_SITE,
+            "quantity": rng.randint(1, 3), "reason": "", "status": "pending"
+        })
+        self.log_sink.write(self.log_entry("בקשת משיכה", loc))
+
+    # --- פעולות מנהל ---
+    def do_approve(self, rng):
+        wh = f"wh{self.run}_{rng.randrange(self.args.warehouses)}"
+        page = list(self.db.collection("Requests").where("status", "==", "pending").where("warehouse", "==", wh)
+                    .order_by("timestamp").limit(self.args.page_size).stream())
+        if not page:
+            return
+        req = page[0]
+        sent, new_qty = self.outbox.submit("approve", {"request_id": req.id, "location_id": req.get('location_id'), "user": "bench"})
+        if sent:
+            self.cache.merge("Inventory", req.get('location_id'), {"quantity": new_qty})
+        self.log_sink.write(self.log_entry("אישור משיכה", req.id))
+
+    def do_stock_in(self, rng):
+        ids = self.search.search_items(self.search_term(rng), limit=self.args.page_size)
+        if not ids:
+            return
+        item_id = rng.choice(ids)
+        wh = f"wh{self.run}_{rng.randrange(self.args.warehouses)}"
+        loc = f"{wh}_{rng.randint(1, 20)}_B_1_{item_id}"
+        new_row = {**catalog_sync.inventory_fields(self.cache.get("Items")[item_id]), "warehouse": wh, "row": loc.split("_")[2], "column": "B", "floor": "1", "item_id": item_id,
+                   "site": sites.DEFAULT_SITE}
+        qty = rng.randint(1, 50)
+        self.outbox.submit("add_stock", {"loc_id": loc, "qty": qty, "new_row": new_row, "user": "bench"})
+        cached_qty = self.cache.get("Inventory").get(loc, {}).get('quantity', 0)
+        self.cache.put("Inventory", loc, {**new_row, "quantity": cached_qty + qty})
+        self.log_sink.write(self.log_entry("קליטה", loc))
+
+    def do_import(self, rng):
+        with self._lock:
+            self._imports += 1
+            n = self._imports
+        df = synthetic_catalog(self.args.import_rows, f"I{self.run}-{n}-")
+        existing = {d.get('internal_sku') for d in self.cache.get("Items").values()}
+        # worker אחד - כדי שהכתיבות ייספרו ב-scope של הסשן
+        result = catalog_import.import_items(self.db, df, existing, f"bench_{self.run}_{n}", workers=1)
+        for item_id, data in result['added']:
+            self.cache.put("Items", item_id, data)
+        self.log_sink.write(self.log_entry("ייבוא", str(len(result['added']))))
+
+    def session(self, seed, actions, deadline):
+        rng = random.Random(seed)
+        names, weights = zip(*actions)
+        while time.monotonic() < deadline:
+            action = rng.choices(names, weights)[0]
+            self.record(action, lambda: getattr(self, f"do_{action}")(rng))
+            if self.args.think:
+                time.sleep(rng.uniform(0, 2 * self.args.think))
+
+
+def load_bench(args):
+    run = int(time.time())
+    path = os.path.join(args.dir, f"load_{run}.db")
+    raw = emulator_client() if args.backend == "emulator" else storage.open_backend(args.backend, path)
+    start = time.perf_counter()
+    seed_catalog(raw, run, args.items, args.warehouses)
+    print(f"seeded {args.items} items / {args.items} inventory rows in {time.perf_counter() - start:.1f}s ({args.backend})")
+
+    db = MeteredClient(raw)
+    start = time.perf_counter()
+    queue_path = os.path.join(args.dir, f"outbox_{run}.db")
+    sim = LoadRun(db, run, args, queue_path)
+    sim.cache.get("Items"), sim.cache.get("Inventory")
+    print(f"cache + index warm-up: {time.perf_counter() - start:.1f}s, {db.meter.totals['reads']} reads")
+
+    pickers = [("search", 3), ("pull", 1)]
+    managers = [("approve", 4), ("stock_in", 2), ("import", args.import_weight)]
+    deadline = time.monotonic() + args.duration
+    before = db.meter.snapshot()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=sim.session, args=(i, pickers, deadline)) for i in range(args.pickers)]
+    threads += [threading.Thread(target=sim.session, args=(1000 + i, managers, deadline)) for i in range(args.managers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    sim.log_sink.flush()
+    totals = {k: v - before[k] for k, v in db.meter.snapshot().items()}
+
+    report = {"backend": args.backend, "items": args.items, "pickers": args.pickers, "managers": args.managers,
+              "elapsed": elapsed, "totals": totals, "log_sink": dict(sim.log_sink.metrics), "outbox": dict(sim.outbox.metrics),
+              "actions": {}}
+    print(f"{'action':<10}{'count':>8}{'ops/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'reads/op':>10}{'writes/op':>10}{'errors':>8}")
+    for action, samples in sorted(sim.samples.items()):
+        ms = [s[0] for s in samples]
+        row = {
+            "count": len(samples), "per_sec": len(samples) / elapsed,
+            "p50": percentile(ms, 50), "p95": percentile(ms, 95), "p99": percentile(ms, 99),
+            "reads_per_op": sum(s[1] for s in samples) / len(samples), "writes_per_op": sum(s[2] for s in samples) / len(samples),
+            "errors": sim.errors.get(action, 0),
+        }
+        report["actions"][action] = row
+        print(f"{action:<10}{row['count']:>8}{row['per_sec']:>9.1f}{row['p50']:>9.2f}{row['p95']:>9.2f}{row['p99']:>9.2f}"
+              f"{row['reads_per_op']:>10.1f}{row['writes_per_op']:>10.1f}{row['errors']:>8}")
+    print(f"total: {sum(len(s) for s in sim.samples.values()) / elapsed:.1f} actions/s | reads {totals['reads']} "
+          f"(incl. listeners) | writes {totals['writes']} (incl. log sink) | round trips {totals['round_trips']}")
+    sim.log_sink.close()
+    sim.outbox.close()
+    sim.cache.close()
+    raw.close()
+    if args.backend == "sqlite":
+        os.remove(path)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(queue_path + suffix):
+            os.remove(queue_path + suffix)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+# ==========================================
+# ייצוא לביקורת - שורות לשנייה וזיכרון שיא לפי פורמט
+# ==========================================
+def export_bench(args):
+    run = int(time.time())
+    path = os.path.join(args.dir, f"export_{run}.db")
+    db = storage.open_backend(args.backend, path)
+    seed_requests(db, run, args.warehouses, args.rows, args.requests)
+    datasets = {
+        "inventory": (lambda: export.inventory_rows(db.collection("Inventory")), export.INVENTORY_COLUMNS),
+        "items": (lambda: export.item_rows(db, db.collection("Items")), export.ITEM_COLUMNS),
+        "requests": (lambda: export.request_rows(db, db.collection("Requests").order_by("timestamp")), export.REQUEST_COLUMNS),
+    }
+    writers = {"csv": export.write_csv, "xlsx": export.write_xlsx}
+    print(f"{'dataset':<12}{'format':<8}{'rows':>10}{'rows/s':>12}{'MB':>10}{'peak MB':>10}")
+    for name, (make_rows, columns) in datasets.items():
+        for fmt, write in writers.items():
+            out, stats = write(make_rows(), columns)
+            size = os.path.getsize(out) / 2 ** 20
+            os.remove(out)
+            peak = ""
+            if args.memory:
+                # מעבר נפרד - tracemalloc מאט, ולכן לא נמדד יחד עם קצב הכתיבה
+                tracemalloc.start()
+                out, _ = write(make_rows(), columns)
+                peak = f"{tracemalloc.get_traced_memory()[1] / 2 ** 20:.1f}"
+                tracemalloc.stop()
+                os.remove(out)
+            print(f"{name:<12}{fmt:<8}{stats['rows']:>10}{stats['rows_per_sec']:>12.0f}{size:>10.1f}{peak:>10}")
+    db.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# ==========================================
+# עגלת ליקוט - בקשה אחת לכל שורה מול עגלה בטרנזקציה אחת
+# ==========================================
+def cart_bench(args):
+    run = int(time.time())
+    path = os.path.join(args.dir, f"cart_{run}.db")
+    raw = emulator_client() if args.backend == "emulator" else storage.open_backend(args.backend, path)
+    seed_catalog(raw, run, args.items, args.warehouses)
+    db = MeteredClient(raw)
+    locs = [d for d in raw.collection("Inventory").limit(args.lines).stream()]
+    lines = {d.id: {"quantity": 1, "item_name": d.get('item_name'), "item_id": d.get('item_id'), "warehouse": d.get('warehouse')} for d in locs}
+    request = {"user_email": "bench", "reason": "", "timestamp": time.time()}
+    results = {}
+    for name, fn in (
+        ("one by one", lambda: [db.collection("Requests").add({**request, **line, "location_id": loc, "status": "pending"}) for loc, line in lines.items()]),
+        ("cart", lambda: inventory_ops.submit_cart(db, lines, request, f"bench{run}")),
+    ):
+        before = db.meter.snapshot()
+        start = time.perf_counter()
+        fn()
+        elapsed = (time.perf_counter() - start) * 1000
+        after = db.meter.snapshot()
+        results[name] = (elapsed, after["round_trips"] - before["round_trips"], after["reads"] - before["reads"], after["writes"] - before["writes"])
+    print(f"{len(lines)} lines ({args.backend})")
+    print(f"{'':<14}{'ms':>10}{'round trips':>14}{'reads':>8}{'writes':>8}")
+    for name, (ms, trips, reads, writes) in results.items():
+        print(f"{name:<14}{ms:>10.1f}{trips:>14}{reads:>8}{writes:>8}")
+    raw.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# ==========================================
+# מסלול ליקוט - זמן פתרון ואורך מסלול מול סדר הבקשות
+# ==========================================
+def synthetic_picks(rng, stops, rows, columns, floors):
+    # בקשות בסדר אקראי (כמו סדר ההגשה) לתאים שונים במחסן אחד
+    labels = [f"C{c:02}" for c in range(1, columns + 1)]
+    slots = rng.sample([(r, c, f) for r in range(1, rows + 1) for c in labels for f in range(1, floors + 1)], stops)
+    inventory, requests = {}, []
+    for n, (r, c, f) in enumerate(slots):
+        loc = f"W_{r}_{c}_{f}_item{n}"
+        inventory[loc] = {"warehouse": "W", "row": str(r), "column": c, "floor": str(f), "item_id": f"item{n}"}
+        requests.append((f"req{n}", {"location_id": loc, "item_name": f"item{n}", "quantity": 1}))
+    return requests, inventory, {"rows": rows, "columns": labels, "floors": floors}
+
+
+def route_bench(args):
+    print(f"{'stops':>7}{'request order':>15}{'serpentine':>12}{'route':>10}{'saved':>8}{'ms p50':>9}{'ms max':>9}")
+    for n in args.stops:
+        lengths, times = [], []
+        for seed in range(args.repeat):
+            requests, inventory, layout = synthetic_picks(random.Random(seed), n, args.rows, args.columns, args.floors)
+            slots, _ = pick_route.stops(requests, inventory)
+            coords, back = pick_route._coordinates(slots["W"], layout)
+            serpentine = pick_route.tour_length(pick_route._serpentine(coords), pick_route._matrix(coords, back))
+            r = pick_route.route(slots["W"], layout, args.time_limit)
+            lengths.append((r['baseline'], serpentine, r['length']))
+            times.append(r['elapsed'] * 1000)
+        base, serp, length = (statistics.mean(col) for col in zip(*lengths))
+        print(f"{n:>7}{base:>15.0f}{serp:>12.0f}{length:>10.0f}{1 - length / base:>8.1%}{statistics.median(times):>9.0f}{max(times):>9.0f}")
+
+
+# ==========================================
+# תחזית - צבירה וחישוב וקטוריים על מיליון שורות, וצבירה מצטברת מול בנייה מלאה
+# ==========================================
+def forecast_bench(args):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    end = pd.Timestamp.now(tz="UTC").floor("D")
+    frame = pd.DataFrame({
+        "item_id": pd.Series(rng.integers(0, args.items, args.rows)).map(lambda i: f"item{i}"),
+        "timestamp": end - pd.to_timedelta(rng.uniform(0, args.days, args.rows), unit="D"),
+        "quantity": rng.integers(1, 10, args.rows),
+    })
+    start = time.perf_counter()
+    daily = forecast.daily_demand(frame)
+    aggregate = time.perf_counter() - start
+    series = {}
+    for (item_id, day), qty in daily.items():
+        series.setdefault(item_id, {})[day.strftime("%Y-%m-%d")] = int(qty)
+    start = time.perf_counter()
+    table = forecast.metrics(series, {f"item{i}": 50 for i in range(args.items)}, end.to_pydatetime())
+    compute = time.perf_counter() - start
+    print(f"{args.rows} rows, {args.items} items, {args.days} days")
+    print(f"aggregate {aggregate * 1000:.0f}ms ({args.rows / aggregate:,.0f} rows/s) | metrics {compute * 1000:.0f}ms | {int(table['reorder'].sum())} to reorder")
+
+    # צבירה מהמסד: בנייה מלאה, ואחריה refresh שקורא רק את הבקשות החדשות
+    path = os.path.join(args.dir, f"forecast_{int(time.time())}.db")
+    raw = storage.open_backend("sqlite", path)
+    db = MeteredClient(raw)
+    now = datetime.now(timezone.utc)
+
+    def seed(n, newest, oldest):
+        batch, ops = raw.batch(), 0
+        for i in range(n):
+            ts = now - timedelta(days=newest + (oldest - newest) * random.random())
+            batch.set(raw.collection("Requests").document(), {
+                "item_id": f"item{i % args.items}", "quantity": 1 + i % 5, "status": "approved",
+                "timestamp": ts, "approved_at": ts
+            })
+            ops += 1
+            if ops >= 498:
+                batch.commit()
+                batch, ops = raw.batch(), 0
+        batch.commit()
+
+    # ההיסטוריה נבנית עד לפני יומיים; הבקשות החדשות (1%) נופלות בין יומיים ליום אחורה
+    seed(args.history, 2, args.days)
+    for name, fn in (("rebuild", lambda db: forecast.rebuild(db, settle_minutes=48 * 60)), ("refresh (no change)", lambda db: forecast.refresh(db, settle_minutes=48 * 60))):
+        before = db.meter.snapshot()
+        start = time.perf_counter()
+        res = fn(db)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<22}{res['rows']:>9} rows {elapsed * 1000:>9.0f}ms {db.meter.snapshot()['reads'] - before['reads']:>9} reads")
+    seed(args.history // 100, 1.1, 1.9)
+    before = db.meter.snapshot()
+    start = time.perf_counter()
+    res = forecast.refresh(db)
+    elapsed = time.perf_counter() - start
+    print(f"{'refresh (+1%)':<22}{res['rows']:>9} rows {elapsed * 1000:>9.0f}ms {db.meter.snapshot()['reads'] - before['reads']:>9} reads")
+    raw.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# ==========================================
+# זמן עלייה - ריצה ראשונה של app.py בתהליך נקי + פירוט זמני import
+# ==========================================
+# רץ בתהליך חדש עם -X importtime; כל מה שנטען אחרי הסימון נטען בגלל app.py
+# (streamlit עצמו כבר טעון - כמו בשרת). --preload מדמה import מוקדם של מודולים כבדים
+_STARTUP_PROBE = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+sys.stderr.write("--app--\\n"); sys.stderr.flush()
+start = time.perf_counter()
+for name in sys.argv[2:]:
+    __import__(name)
+at = AppTest.from_file(sys.argv[1], default_timeout=300)
+at.run()
+first = time.perf_counter() - start
+start = time.perf_counter()
+at.run()
+print(json.dumps({"first_ms": first * 1000, "rerun_ms": (time.perf_counter() - start) * 1000, "errors": len(at.exception)}))
+"""
+
+
+def _import_breakdown(stderr):
+    # מודולים ברמה העליונה בלבד (בלי הזחה), מקובצים לפי החבילה - זמן מצטבר במיקרו-שניות
+    totals, seen = {}, False
+    for line in stderr.splitlines():
+        if line == "--app--":
+            seen = True
+            continue
+        if not seen or not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        name = name[1:]
+        if name.startswith(" ") or not cumulative.strip().isdigit():
+            continue
+        package = name.split(".")[0]
+        totals[package] = totals.get(package, 0) + int(cumulative)
+    return totals
+
+
+def startup_bench(args):
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    env = {**os.environ, "WAREHOUSE_BACKEND": args.backend}
+    if args.backend == "sqlite":
+        env["WAREHOUSE_SQLITE"] = os.path.join(args.dir, f"startup_{int(time.time())}.db")
+    preload = [m for m in args.preload.split(",") if m]
+    runs, imports = [], {}
+    for _ in range(args.repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", _STARTUP_PROBE, app_path, *preload],
+                              env=env, capture_output=True, text=True)
+        if proc.returncode:
+            sys.exit(proc.stderr[-2000:])
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        for package, us in _import_breakdown(proc.stderr).items():
+            imports.setdefault(package, []).append(us)
+    if args.backend == "sqlite" and os.path.exists(env["WAREHOUSE_SQLITE"]):
+        os.remove(env["WAREHOUSE_SQLITE"])
+
+    report = {
+        "first_run_ms": statistics.median(r["first_ms"] for r in runs),
+        "rerun_ms": statistics.median(r["rerun_ms"] for r in runs),
+        "errors": max(r["errors"] for r in runs),
+        "imports_ms": {p: statistics.median(v) / 1000 for p, v in imports.items()},
+    }
+    print(f"backend={args.backend} preload={preload or '-'} runs={args.repeat} (median)")
+    print(f"first run {report['first_run_ms']:.0f} ms | rerun {report['rerun_ms']:.0f} ms | errors {report['errors']}")
+    print(f"{'import (cumulative)':<28}{'ms':>10}")
+    for package, ms in sorted(report["imports_ms"].items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"{package:<28}{ms:>10.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="warehouse benchmarks")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("stress", help="concurrent add/approve on one location (emulator)")
+    p.add_argument("--workers", type=int, default=8)
+    p.add_argument("--adds", type=int, default=50)
+    p.add_argument("--pulls", type=int, default=20)
+    p.set_defaults(fn=stress)
+
+    p = sub.add_parser("import", help="legacy row-by-row import vs batched pipeline (emulator)")
+    p.add_argument("--rows", type=int, default=50000)
+    p.add_argument("--workers", type=int, default=catalog_import.WORKERS)
+    p.add_argument("--skip-legacy", action="store_true")
+    p.set_defaults(fn=import_bench)
+
+    p = sub.add_parser("reads", help="document reads per pull/approve screen (emulator)")
+    p.add_argument("--warehouses", type=int, default=5)
+    p.add_argument("--items", type=int, default=2000)
+    p.add_argument("--requests", type=int, default=1000)
+    p.add_argument("--page-size", type=int, default=20)
+    p.set_defaults(fn=reads_bench)
+
+    p = sub.add_parser("bulk", help="bulk approve vs one-by-one approvals (emulator)")
+    p.add_argument("--warehouses", type=int, default=2)
+    p.add_argument("--items", type=int, default=50)
+    p.add_argument("--requests", type=int, default=100)
+    p.set_defaults(fn=bulk_bench)
+
+    p = sub.add_parser("backends", help="per-operation latency: memory vs sqlite (vs emulator if set)")
+    p.add_argument("--warehouses", type=int, default=5)
+    p.add_argument("--items", type=int, default=2000)
+    p.add_argument("--requests", type=int, default=5000)
+    p.add_argument("--repeat", type=int, default=200)
+    p.add_argument("--dir", default=".")
+    p.set_defaults(fn=backends_bench)
+
+    p = sub.add_parser("fanout", help="warehouse-delete fan-out: one-by-one updates vs chunked parallel bulk_ops")
+    p.add_argument("--backend", choices=["memory", "sqlite", "emulator"], default="memory")
+    p.add_argument("--rows", type=int, default=10000)
+    p.add_argument("--legacy-rows", type=int, default=2000, help="one-by-one is slow - time a sample")
+    p.add_argument("--workers", type=int, default=bulk_ops.WORKERS)
+    p.add_argument("--dir", default=".")
+    p.set_defaults(fn=fanout_bench)
+
+    p = sub.add_parser("load", help="concurrent simulated pickers/managers: p50/p95/p99, reads/writes per action")
+    p.add_argument("--backend", choices=["memory", "sqlite", "emulator"], default="memory")
+    p.add_argument("--items", type=int, default=10000)
+    p.add_argument("--warehouses", type=int, default=5)
+    p.add_argument("--pickers", type=int, default=50)
+    p.add_argument("--managers", type=int, default=5)
+    p.add_argument("--duration", type=float, default=30)
+    p.add_argument("--think", type=float, default=0, help="mean pause between actions per session (s)")
+    p.add_argument("--page-size", type=int, default=20)
+    p.add_argument("--import-rows", type=int, default=200)
+    p.add_argument("--import-weight", type=float, default=0.1)
+    p.add_argument("--json", help="write the report to this file (compare runs for regressions)")
+    p.add_argument("--dir", default=".")
+    p.set_defaults(fn=load_bench)
+
+    p = sub.add_parser("export", help="audit export throughput and peak memory: csv vs xlsx per dataset")
+    p.add_argument("--backend", choices=["memory", "sqlite"], default="sqlite", help="memory re-sorts the collection per page - sqlite pages by index")
+    p.add_argument("--rows", type=int, default=20000, help="inventory rows / catalog items")
+    p.add_argument("--requests", type=int, default=20000)
+    p.add_argument("--warehouses", type=int, default=5)
+    p.add_argument("--memory", action="store_true", help="second pass under tracemalloc for peak memory")
+    p.add_argument("--dir", default=".")
+    p.set_defaults(fn=export_bench)
+
+    p = sub.add_parser("cart", help="pick cart: one request per submit vs one transaction per cart")
+    p.add_argument("--backend", choices=["memory", "sqlite", "emulator"], default="memory")
+    p.add_argument("--lines", type=int, default=30)
+    p.add_argument("--items", type=int, default=500)
+    p.add_argument("--warehouses", type=int, default=2)
+    p.add_argument("--dir", default=".")
+    p.set_defaults(fn=cart_bench)
+
+    p = sub.add_parser("route", help="pick route: solve time and route length vs request order")
+    p.add_argument("--stops", type=int, nargs="+", default=[50, 200, 500, 1000])
+    p.add_argument("--rows", type=int, default=30)
+    p.add_argument("--columns", type=int, default=40)
+    p.add_argument("--floors", type=int, default=4)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--time-limit", type=float, default=pick_route.TIME_LIMIT)
+    p.set_defaults(fn=route_bench)
+
+    p = sub.add_parser("forecast", help="demand forecast: vectorized 1M-row aggregation, incremental refresh vs rebuild")
+    p.add_argument("--rows", type=int, default=1_000_000)
+    p.add_argument("--items", type=int, default=5000)
+    p.add_argument("--days", type=int, default=365)
+    p.add_argument("--history", type=int, default=50000, help="approved requests seeded in sqlite for rebuild/refresh")
+    p.add_argument("--dir", default=".")
+    p.set_defaults(fn=forecast_bench)
+
+    p = sub.add_parser("startup", help="cold start of app.py in a fresh process with an import-time breakdown")
+    p.add_argument("--backend", choices=["memory", "sqlite"], default="memory")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--preload", default="", help="comma-separated modules imported first (e.g. pandas,firebase_admin) - the eager baseline")
+    p.add_argument("--top", type=int, default=15)
+    p.add_argument("--json", help="write the report to this file")
+    p.add_argument("--dir", default=".")
+    p.set_defaults(fn=startup_bench)
+
+    args = parser.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
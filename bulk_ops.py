@@ -0,0 +1,77 @@
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from google.api_core import exceptions
+from google.cloud import firestore
+
+# --- עדכונים מרובים (fan-out) ---
+# עדכון של אלפי מסמכים (שינוי שם פריט בכל שורות המלאי, העברת מחסן לאתר אחר)
+# מחולק לנתחים של עד 500 פעולות שנכתבים במקביל. כל נתח כותב גם נקודת שמירה
+# (BulkJobs/{job_id}.done_chunks) באותו batch, ולכן עבודה שנקטעה ממשיכה מאותה נקודה
+# כשמריצים אותה שוב עם אותו job_id. העדכונים הם ערכים מוחלטים - הרצה חוזרת לא משנה דבר.
+
+# 499 עדכונים + נקודת השמירה = 500 פעולות, המגבלה של batch אחד
+CHUNK_SIZE = 499
+WORKERS = 8
+
+
+def _chunks(updates):
+    # סדר קבוע לפי מזהה, כך שאותה עבודה נחתכת תמיד לאותם נתחים
+    ids = sorted(updates)
+    return [ids[i:i + CHUNK_SIZE] for i in range(0, len(ids), CHUNK_SIZE)]
+
+
+def _chunk_key(ids):
+    return f"{ids[0]}|{ids[-1]}|{len(ids)}"
+
+
+def job_key(prefix, updates):
+    # מזהה עבודה לפי התוכן - אותה קבוצת עדכונים מקבלת תמיד אותו job_id
+    digest = hashlib.sha1(json.dumps(sorted(updates.items()), ensure_ascii=False, default=str).encode()).hexdigest()
+    return f"{prefix}_{digest[:16]}"
+
+
+def apply_updates(db, collection, updates, job_id, progress=None, workers=WORKERS):
+    # updates - {doc_id: שדות}; מחזיר {updated, missing, skipped, elapsed, per_sec}
+    job_ref = db.collection("BulkJobs").document(job_id)
+    job = job_ref.get()
+    done = set(job.get('done_chunks')) if job.exists else set()
+    pending = [ids for ids in _chunks(updates) if _chunk_key(ids) not in done]
+    skipped = len(updates) - sum(len(ids) for ids in pending)
+    col = db.collection(collection)
+
+    def commit(ids):
+        refs = {doc_id: col.document(doc_id) for doc_id in ids}
+        for attempt in range(2):
+            batch = db.batch()
+            for doc_id, ref in refs.items():
+                batch.update(ref, updates[doc_id])
+            batch.set(job_ref, {"done_chunks": firestore.ArrayUnion([_chunk_key(ids)]), "updated": firestore.SERVER_TIMESTAMP}, merge=True)
+            try:
+                batch.commit()
+                return len(refs), len(ids) - len(refs)
+            except exceptions.NotFound:
+                if attempt:
+                    raise
+                # מסמך נמחק מאז התכנון - מדלגים עליו וכותבים את השאר
+                refs = {s.id: s.reference for s in db.get_all(list(refs.values())) if s.exists}
+
+    updated = missing = 0
+    start = time.perf_counter()
+
+    def report():
+        if progress:
+            elapsed = time.perf_counter() - start
+            progress(skipped + updated + missing, len(updates), updated / elapsed if elapsed else 0)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for future in as_completed([pool.submit(commit, ids) for ids in pending]):
+            n, gone = future.result()
+            updated += n
+            missing += gone
+            report()
+
+    elapsed = time.perf_counter() - start
+    return {"updated": updated, "missing": missing, "skipped": skipped, "elapsed": elapsed, "per_sec": updated / elapsed if elapsed else 0}
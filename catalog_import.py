@@ -0,0 +1,109 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from google.cloud import firestore
+
+# --- ייבוא קטלוג מקובץ CSV/XLSX ---
+# נרמול וקטורי ב-pandas, כתיבה ב-WriteBatch של עד 500 פעולות במקביל, ונקודת
+# שמירה לכל נתח (לפי המק"ט הראשון בו) שנכתבת באותו batch - כך שייבוא שנקטע
+# (למשל ריצה מחדש של Streamlit) ממשיך מאיפה שעצר בלי כפילויות.
+# pandas נטען רק כשקוראים קובץ - הוא לבדו כמחצית מזמן העלייה של האפליקציה.
+
+# 499 פריטים + עדכון נקודת השמירה = 500 פעולות, המגבלה של batch אחד
+CHUNK_SIZE = 499
+WORKERS = 8
+
+COLUMN_MAP = {
+    'תיאור': 'description', 'שם פריט': 'description',
+    'מקט': 'internal_sku', 'מק"ט': 'internal_sku', 'מקט רשות': 'internal_sku',
+    'יצרן': 'manufacturer_sku', 'מקט יצרן': 'manufacturer_sku'
+}
+FIELDS = ['description', 'internal_sku', 'manufacturer_sku']
+
+
+class ImportFormatError(Exception):
+    def __init__(self, columns):
+        super().__init__(f"שגיאה בכותרות הקובץ! זוהה: {columns}")
+        self.columns = columns
+
+
+def read_table(uploaded_file):
+    import pandas as pd
+    if uploaded_file.name.endswith('.csv'):
+        try:
+            return pd.read_csv(uploaded_file, encoding='utf-8')
+        except UnicodeDecodeError:
+            uploaded_file.seek(0)
+            return pd.read_csv(uploaded_file, encoding='windows-1255')
+    return pd.read_excel(uploaded_file)
+
+
+def normalize(df):
+    df = df.rename(columns=lambda c: str(c).strip().lower()).rename(columns=COLUMN_MAP)
+    if 'description' not in df.columns or 'internal_sku' not in df.columns:
+        raise ImportFormatError(list(df.columns))
+    if 'manufacturer_sku' not in df.columns:
+        df['manufacturer_sku'] = ""
+    out = df[FIELDS].fillna("").astype(str).apply(lambda col: col.str.strip())
+    out = out.mask(out.apply(lambda col: col.str.lower().isin(['nan', 'none'])), "")
+    out = out[out['internal_sku'] != ""].drop_duplicates('internal_sku')
+    # מיון לפי מק"ט כדי שגבולות הנתחים יהיו קבועים בין ריצות
+    return out.sort_values('internal_sku', kind='stable').reset_index(drop=True)
+
+
+def import_items(db, df, existing_skus, job_id, progress=None, workers=WORKERS):
+    rows = normalize(df)
+    total = len(df)
+    records = rows.to_dict('records')
+    chunks = [records[i:i + CHUNK_SIZE] for i in range(0, len(records), CHUNK_SIZE)]
+
+    job_ref = db.collection("ImportJobs").document(job_id)
+    job = job_ref.get()
+    done = set(job.get('done_chunks')) if job.exists else set()
+
+    pending = []
+    skipped = total - len(records)
+    for chunk in chunks:
+        if chunk[0]['internal_sku'] in done:
+            skipped += len(chunk)
+            continue
+        fresh = [r for r in chunk if r['internal_sku'] not in existing_skus]
+        skipped += len(chunk) - len(fresh)
+        pending.append((chunk[0]['internal_sku'], fresh))
+
+    def commit(first_sku, items):
+        batch = db.batch()
+        written = []
+        for item in items:
+            ref = db.collection("Items").document()
+            batch.set(ref, item)
+            written.append((ref.id, item))
+        batch.set(job_ref, {"done_chunks": firestore.ArrayUnion([first_sku]), "updated": firestore.SERVER_TIMESTAMP}, merge=True)
+        batch.commit()
+        return written
+
+    added = []
+    start = time.perf_counter()
+
+    def report():
+        if progress:
+            elapsed = time.perf_counter() - start
+            progress(len(added) + skipped, total, len(added) / elapsed if elapsed else 0)
+
+    if workers <= 1:
+        # בלי מאגר תהליכונים - הכתיבות רצות בתהליכון הקורא (למשל כשמודדים אותן לפי scope)
+        for first_sku, items in pending:
+            added.extend(commit(first_sku, items))
+            report()
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(commit, first_sku, items) for first_sku, items in pending]
+            for future in as_completed(futures):
+                added.extend(future.result())
+                report()
+
+    elapsed = time.perf_counter() - start
+    return {
+        "added": added, "skipped": skipped, "elapsed": elapsed,
+        "rows_per_sec": len(added) / elapsed if elapsed else 0
+    }
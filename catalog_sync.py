@@ -0,0 +1,83 @@
+import time
+
+from google.cloud import firestore
+
+import bulk_ops
+
+# --- שדות קטלוג משוכפלים בשורות המלאי ---
+# כל שורת Inventory נושאת את שם הפריט ואת המק"טים שלו, כך שמסכי המלאי לא צריכים
+# לקרוא את הקטלוג בכלל. עריכת פריט מפיצה את השינוי לכל שורות המלאי שלו (bulk_ops),
+# ו-migrate_inventory ממלא את השדות בנתונים קיימים - בעמודים, עם נקודת עצירה
+# (Migrations/{job_id}) שנכתבת באותו batch, כך שאפשר להמשיך מאותה נקודה אחרי נפילה.
+
+# שדה בקטלוג -> שדה בשורת המלאי
+DENORMALIZED = {"description": "item_name", "internal_sku": "internal_sku", "manufacturer_sku": "manufacturer_sku"}
+MIGRATION_PAGE = 400
+MIGRATION_JOB = "inventory_skus_v1"
+
+
+def inventory_fields(item):
+    return {inv_field: item.get(field, '') for field, inv_field in DENORMALIZED.items()}
+
+
+def _stale(row, fields):
+    return {k: v for k, v in fields.items() if row.get(k) != v}
+
+
+def fan_out_item(db, item_id, item, inventory, progress=None):
+    # inventory - {loc_id: שורה} (מהמטמון); מחזיר {loc_id: שדות שעודכנו}
+    fields = inventory_fields(item)
+    updates = {loc_id: fields for loc_id, row in inventory.items() if row.get('item_id') == item_id and _stale(row, fields)}
+    if updates:
+        bulk_ops.apply_updates(db, "Inventory", updates, bulk_ops.job_key(f"item_{item_id}", updates), progress)
+    return updates
+
+
+def migrate_inventory(db, job_id=MIGRATION_JOB, page_size=MIGRATION_PAGE, progress=None):
+    job_ref = db.collection("Migrations").document(job_id)
+    job = job_ref.get()
+    state = job.to_dict() if job.exists else {}
+    if state.get('done'):
+        return {"scanned": state.get('scanned', 0), "updated": state.get('updated', 0), "elapsed": 0.0, "resumed": True}
+
+    start = time.perf_counter()
+    scanned, updated = state.get('scanned', 0), state.get('updated', 0)
+    base = db.collection("Inventory")
+    last = None
+    if state.get('last_id'):
+        last = base.document(state['last_id']).get()
+        if not last.exists:
+            # נקודת העצירה נמחקה - מתחילים מחדש; שורות מעודכנות לא ייכתבו שוב
+            last = None
+    resumed = last is not None
+
+    while True:
+        # בלי order_by - הסדר הוא לפי מזהה המסמך, ו-start_after ממשיך מהסמן
+        page = list((base if last is None else base.start_after(last)).limit(page_size).stream())
+        rows = [(doc, doc.to_dict()) for doc in page]
+        refs = [db.collection("Items").document(i) for i in {row.get('item_id') for _, row in rows} if i]
+        items = {s.id: s.to_dict() for s in db.get_all(refs) if s.exists} if refs else {}
+
+        batch = db.batch()
+        for doc, row in rows:
+            item = items.get(row.get('item_id'))
+            if item is None:
+                continue
+            stale = _stale(row, inventory_fields(item))
+            if stale:
+                batch.update(doc.reference, stale)
+                updated += 1
+        scanned += len(page)
+        done = len(page) < page_size
+        batch.set(job_ref, {
+            "last_id": page[-1].id if page else state.get('last_id'), "scanned": scanned, "updated": updated,
+            "done": done, "updated_at": firestore.SERVER_TIMESTAMP
+        }, merge=True)
+        batch.commit()
+        if progress:
+            progress(scanned, updated)
+        if done:
+            break
+        last = page[-1]
+
+    return {"scanned": scanned, "updated": updated, "elapsed": time.perf_counter() - start, "resumed": resumed}
@@ -0,0 +1,213 @@
+import csv
+import datetime
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# --- ייצוא בזיכרון קבוע ---
+# השאילתה נקראת בעמודים עם סמן (start_after/limit) והשורות נכתבות לקובץ זמני
+# תוך כדי קריאה, כך שבכל רגע נמצא בזיכרון רק עמוד אחד - גם במיליוני מסמכים.
+# צירוף נתונים (מיקום הבקשה, יתרת הפריט) נעשה לכל עמוד ב-get_all אחד, לא לכל שורה.
+# XLSX נכתב ב-openpyxl במצב write_only - השורות לא נשמרות בזיכרון עד השמירה.
+# הקבצים נכתבים לתיקייה פרטית של התהליך (export_dir) ונמחקים כשהמשתמש מכין ייצוא חדש או
+# מתנתק (app.py); קובץ של סשן שנסגר בלי התנתקות נמחק בייצוא הבא, אחרי EXPORT_TTL שניות.
+# ייצוא שעדיין נכתב לא נמחק גם אם הקובץ לא השתנה מזמן (XLSX נכתב לדיסק רק ב-save).
+
+EXPORT_PAGE = 1000
+EXPORT_PREFIX = "export_"
+EXPORT_TTL = 3600
+# מגבלת שורות בגיליון אקסל (כולל כותרת) - מעבר לה ממשיכים בגיליון נוסף
+XLSX_SHEET_ROWS = 1048576
+
+INVENTORY_COLUMNS = ["location_id", "site", "warehouse", "row", "column", "floor", "item_id", "item_name", "internal_sku", "manufacturer_sku", "quantity"]
+ITEM_COLUMNS = ["item_id", "description", "internal_sku", "manufacturer_sku", "total_quantity"]
+REQUEST_COLUMNS = ["request_id", "timestamp", "status", "user_email", "item_name", "item_id", "quantity", "reason",
+                   "site", "warehouse", "location_id", "row", "column", "floor", "location_quantity"]
+
+
+class ExportError(Exception):
+    pass
+
+
+def iter_pages(query, page_size=EXPORT_PAGE):
+    last = None
+    while True:
+        page = list((query if last is None else query.start_after(last)).limit(page_size).stream())
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        last = page[-1]
+
+
+def iter_docs(query, page_size=EXPORT_PAGE):
+    for page in iter_pages(query, page_size):
+        yield from page
+
+
+# ==========================================
+# שורות לייצוא - מלאי, קטלוג ובקשות עם הצירופים שלהן
+# ==========================================
+def inventory_rows(query, page_size=EXPORT_PAGE):
+    for d in iter_docs(query, page_size):
+        yield {"location_id": d.id, **d.to_dict()}
+
+
+def item_rows(db, query, page_size=EXPORT_PAGE):
+    # סה"כ לפריט מ-ItemBalances (rollups) - קריאה אחת לכל עמוד
+    for page in iter_pages(query, page_size):
+        totals = {s.id: s.to_dict().get('quantity', 0) for s in db.get_all([db.collection("ItemBalances").document(d.id) for d in page]) if s.exists}
+        for d in page:
+            yield {"item_id": d.id, **d.to_dict(), "total_quantity": totals.get(d.id, 0)}
+
+
+def request_rows(db, query, page_size=EXPORT_PAGE):
+    # כל בקשה עם המיקום שלה במלאי (שורה/עמודה/קומה וכמות נוכחית); מיקום שנמחק נשאר ריק
+    for page in iter_pages(query, page_size):
+        loc_ids = {d.get('location_id') for d in page if d.to_dict().get('location_id')}
+        locations = {s.id: s.to_dict() for s in db.get_all([db.collection("Inventory").document(i) for i in loc_ids]) if s.exists} if loc_ids else {}
+        for d in page:
+            r = d.to_dict()
+            loc = locations.get(r.get('location_id'), {})
+            yield {"request_id": d.id, **r, "row": loc.get('row'), "column": loc.get('column'), "floor": loc.get('floor'),
+                   "location_quantity": loc.get('quantity')}
+
+
+_dir = None
+_active = set()
+_lock = threading.Lock()
+
+
+def export_dir():
+    # תיקייה פרטית לקבצי הייצוא, נוצרת פעם אחת לתהליך
+    global _dir
+    with _lock:
+        if _dir is None or not os.path.isdir(_dir):
+            _dir = tempfile.mkdtemp(prefix="warehouse_export_")
+        return _dir
+
+
+def cleanup(max_age=EXPORT_TTL):
+    # מוחק מ-export_dir קבצים ישנים שאינם בכתיבה; מחזיר כמה נמחקו
+    folder = export_dir()
+    cutoff, removed = time.time() - max_age, 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        with _lock:
+            if path in _active:
+                continue
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            # נמחק במקביל (replace_export של אותו סשן)
+            pass
+    return removed
+
+
+@contextmanager
+def _export_file(suffix):
+    # קובץ חדש ב-export_dir, מסומן כפעיל עד סוף הכתיבה; כתיבה שנכשלה מוחקת אותו
+    cleanup()
+    fd, path = tempfile.mkstemp(prefix=EXPORT_PREFIX, suffix=suffix, dir=export_dir())
+    os.close(fd)
+    with _lock:
+        _active.add(path)
+    try:
+        yield path
+    except BaseException:
+        os.remove(path)
+        raise
+    finally:
+        with _lock:
+            _active.discard(path)
+
+
+def write_csv(rows, columns, progress=None):
+    with _export_file(".csv") as path:
+        count, start = 0, time.perf_counter()
+        # utf-8-sig - כדי שאקסל יפתח עברית כמו שצריך
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.DictWriter(f, columns, extrasaction="ignore")
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+                if progress and count % EXPORT_PAGE == 0:
+                    progress(count, count / (time.perf_counter() - start))
+        return path, _stats(count, start)
+
+
+def write_parquet(rows, columns, timestamp_columns=(), progress=None):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("ייצוא Parquet דורש את החבילה pyarrow")
+    schema = pa.schema([
+        (c, pa.timestamp("us", tz="UTC") if c in timestamp_columns else pa.string()) for c in columns
+    ])
+    with _export_file(".parquet") as path:
+        count, start, buf = 0, time.perf_counter(), []
+        with pq.ParquetWriter(path, schema) as writer:
+            for row in rows:
+                buf.append({c: row.get(c) if c in timestamp_columns else _text(row.get(c)) for c in columns})
+                if len(buf) == EXPORT_PAGE:
+                    writer.write_table(pa.Table.from_pylist(buf, schema=schema))
+                    count += len(buf)
+                    buf = []
+                    if progress:
+                        progress(count, count / (time.perf_counter() - start))
+            if buf:
+                writer.write_table(pa.Table.from_pylist(buf, schema=schema))
+                count += len(buf)
+        return path, _stats(count, start)
+
+
+def write_xlsx(rows, columns, progress=None, sheet_title="export"):
+    try:
+        from openpyxl import Workbook
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    except ImportError:
+        raise ExportError("ייצוא XLSX דורש את החבילה openpyxl")
+
+    def cell(value):
+        if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+            # אקסל לא מכיר אזורי זמן - שעון מקומי
+            return value.astimezone().replace(tzinfo=None)
+        if isinstance(value, str):
+            return ILLEGAL_CHARACTERS_RE.sub("", value)
+        if value is None or isinstance(value, (int, float, datetime.date)):
+            return value
+        return str(value)
+
+    with _export_file(".xlsx") as path:
+        count, start = 0, time.perf_counter()
+        wb = Workbook(write_only=True)
+        ws, sheet_rows = None, XLSX_SHEET_ROWS
+        for row in rows:
+            if sheet_rows == XLSX_SHEET_ROWS:
+                ws = wb.create_sheet(sheet_title if ws is None else f"{sheet_title}_{len(wb.worksheets) + 1}")
+                ws.append(columns)
+                sheet_rows = 1
+            ws.append([cell(row.get(c)) for c in columns])
+            sheet_rows += 1
+            count += 1
+            if progress and count % EXPORT_PAGE == 0:
+                progress(count, count / (time.perf_counter() - start))
+        if ws is None:
+            wb.create_sheet(sheet_title).append(columns)
+        wb.save(path)
+        return path, _stats(count, start)
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def _stats(count, start):
+    elapsed = time.perf_counter() - start
+    return {"rows": count, "elapsed": elapsed, "rows_per_sec": count / elapsed if elapsed else 0}
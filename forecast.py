@@ -0,0 +1,244 @@
+import math
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from google.cloud import firestore
+
+import export
+import inventory_ops
+import rollups
+
+# --- תחזית צריכה ונקודות הזמנה ---
+# בקשות שאושרו נצברות לסדרה יומית לכל פריט: DemandSeries/{item_id} = {"days": {"YYYY-MM-DD": כמות}}.
+# הצבירה מצטברת (refresh) לפי זמן האישור: approved_at נכתב בשעון השרת בטרנזקציית האישור (גם
+# לאישור שנשלח מהתור אחרי ניתוק), ולכן כל ריצה קוראת רק בקשות שאושרו מ-watermark ועד horizon
+# (עכשיו פחות SETTLE_MINUTES), ובקשה שתאושר אחר כך תמיד תיפול אחרי ה-watermark.
+# הטווח נתפס בטרנזקציה על מסמך המצב (חכירה ל-LEASE_SECONDS) - שתי ריצות מקבילות לא צוברות
+# אותו טווח. הריצה ניתנת להמשך: כל מסמך סדרה נושא את ה-horizon שכבר נצבר בו (through),
+# והבדיקה והכתיבה שלו באותה טרנזקציה - הרצה חוזרת אחרי נפילה לא סופרת פעמיים.
+# בנייה מלאה (rebuild) כוללת גם בקשות ישנות בלי approved_at, לפי זמן הבקשה.
+# החישוב (metrics) וקטורי ב-pandas/NumPy: קצב צריכה יומי, סטיית תקן, נקודת הזמנה
+# (קצב × זמן אספקה + מלאי ביטחון) וימי כיסוי. pandas נטען רק כשמחשבים.
+
+SERIES = "DemandSeries"
+STATE_DOC = "demand"
+PAGE = 2000
+BATCH_LIMIT = 500
+SETTLE_MINUTES = 5
+LEASE_SECONDS = 600
+WINDOW_DAYS = 90
+LEAD_TIME_DAYS = 14
+# z לרמת שירות (הסתברות שלא ייגמר המלאי בזמן האספקה)
+SERVICE_LEVELS = {"90%": 1.28, "95%": 1.65, "99%": 2.33}
+SERVICE_Z = SERVICE_LEVELS["95%"]
+
+
+class ForecastError(Exception):
+    pass
+
+
+def _state_ref(db):
+    return db.collection(rollups.ROLLUPS).document(STATE_DOC)
+
+
+def _utc(ts):
+    # Firestore מחזיר זמנים עם אזור זמן; המנועים המקומיים - בלי (UTC)
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+
+def _horizon(settle_minutes=SETTLE_MINUTES):
+    # מרווח לשעון השרת ולטרנזקציות שבאמצע commit
+    return datetime.now(timezone.utc) - timedelta(minutes=settle_minutes)
+
+
+def _claim(db, owner, settle_minutes=SETTLE_MINUTES, resume=True):
+    # תופס את מסמך המצב ל-owner; מחזיר (watermark, יעד) או None אם ריצה אחרת מחזיקה בו.
+    # resume - ריצה שנקטעה השאירה יעד והבאה ממשיכה אליו, אחרת מסמכים שכבר נצברו היו נספרים שוב
+    ref = _state_ref(db)
+
+    def apply(transaction):
+        snap = ref.get(transaction=transaction)
+        state = snap.to_dict() if snap.exists else {}
+        now = datetime.now(timezone.utc)
+        lease = state.get('lease_until')
+        if state.get('owner') not in (None, owner) and lease is not None and _utc(lease) > now:
+            return None
+        target = (state.get('target') if resume else None) or _horizon(settle_minutes)
+        transaction.set(ref, {"target": target, "owner": owner, "lease_until": now + timedelta(seconds=LEASE_SECONDS)}, merge=True)
+        return state.get('watermark'), target
+
+    return inventory_ops.run_transaction(db, apply)
+
+
+def _release(db, owner, fields):
+    # מסיים רק אם החכירה עדיין של owner - ריצה שהחכירה שלה פקעה לא מחזירה את ה-watermark אחורה
+    ref = _state_ref(db)
+
+    def apply(transaction):
+        snap = ref.get(transaction=transaction)
+        if not snap.exists or snap.to_dict().get('owner') != owner:
+            return False
+        transaction.set(ref, {**fields, "target": firestore.DELETE_FIELD, "owner": firestore.DELETE_FIELD,
+                              "lease_until": firestore.DELETE_FIELD, "updated": firestore.SERVER_TIMESTAMP}, merge=True)
+        return True
+
+    return inventory_ops.run_transaction(db, apply)
+
+
+# ==========================================
+# צבירה וקטורית
+# ==========================================
+def daily_demand(frame):
+    # frame - DataFrame עם item_id, timestamp, quantity; מחזיר Series עם (item_id, day) -> כמות
+    import pandas as pd
+
+    frame = frame[frame['item_id'].notna() & (frame['item_id'] != "")]
+    days = pd.to_datetime(frame['timestamp'], utc=True).dt.floor("D")
+    return frame['quantity'].astype("int64").groupby([frame['item_id'], days.rename("day")]).sum()
+
+
+def _fold_pages(query, progress=None, until=None):
+    # עמוד אחרי עמוד: כל עמוד מצטמצם מיד ל-(פריט, יום), כך שהזיכרון לא גדל עם מספר הבקשות.
+    # היום - יום האישור (בקשות ישנות בלי approved_at - יום הבקשה); until - דילוג על מה שאושר ממנו והלאה
+    import pandas as pd
+
+    parts, rows = [], 0
+    for page in export.iter_pages(query, PAGE):
+        docs = [d.to_dict() for d in page]
+        if until is not None:
+            docs = [r for r in docs if r.get('approved_at') is None or _utc(r['approved_at']) < _utc(until)]
+        records = [(r.get('item_id'), r.get('approved_at') or r.get('timestamp'), r.get('quantity') or 0) for r in docs]
+        parts.append(daily_demand(pd.DataFrame.from_records(records, columns=["item_id", "timestamp", "quantity"])))
+        rows += len(records)
+        if progress:
+            progress(rows)
+    if not parts:
+        return {}, rows
+    totals = pd.concat(parts).groupby(level=[0, 1]).sum()
+    out = {}
+    for (item_id, day), qty in totals.items():
+        out.setdefault(item_id, {})[day.strftime("%Y-%m-%d")] = int(qty)
+    return out, rows
+
+
+def _approved(db, start, end):
+    q = db.collection("Requests").where("status", "==", "approved")
+    if start is not None:
+        q = q.where("approved_at", ">=", start)
+    return q.where("approved_at", "<", end).order_by("approved_at")
+
+
+def _history(db):
+    # כל הבקשות שאושרו, גם ישנות בלי approved_at - לצבירה הראשונה ולבנייה מלאה (עם until)
+    return db.collection("Requests").where("status", "==", "approved").order_by("timestamp")
+
+
+def _add_chunk(db, per_item, ids, end):
+    # בדיקת through והוספה באותה טרנזקציה - מסמך שכבר נצבר עד end לא מקבל את הטווח שוב
+    refs = [db.collection(SERIES).document(item_id) for item_id in ids]
+
+    def apply(transaction):
+        done = {s.id for s in transaction.get_all(refs)
+                if s.exists and s.to_dict().get('through') is not None and _utc(s.get('through')) >= _utc(end)}
+        for ref in refs:
+            if ref.id not in done:
+                transaction.set(ref, {
+                    "days": {day: firestore.Increment(qty) for day, qty in per_item[ref.id].items()}, "through": end
+                }, merge=True)
+
+    inventory_ops.run_transaction(db, apply)
+
+
+def refresh(db, progress=None, settle_minutes=SETTLE_MINUTES):
+    # צבירה מה-watermark ועד horizon; מחזיר {"rows", "items", "watermark", "busy"} -
+    # busy: ריצה אחרת מחזיקה בטווח, ולא נצבר דבר
+    owner = uuid.uuid4().hex
+    claim = _claim(db, owner, settle_minutes)
+    if claim is None:
+        return {"rows": 0, "items": 0, "watermark": watermark(db), "busy": True}
+    start, end = claim
+    if start is not None and _utc(end) <= _utc(start):
+        _release(db, owner, {})
+        return {"rows": 0, "items": 0, "watermark": start, "busy": False}
+
+    per_item, rows = _fold_pages(_approved(db, start, end) if start is not None else _history(db), progress, until=end)
+    ids = list(per_item)
+    for i in range(0, len(ids), BATCH_LIMIT):
+        _add_chunk(db, per_item, ids[i:i + BATCH_LIMIT], end)
+    _release(db, owner, {"watermark": end})
+    return {"rows": rows, "items": len(ids), "watermark": end, "busy": False}
+
+
+def rebuild(db, progress=None, settle_minutes=SETTLE_MINUTES):
+    # בנייה מלאה מכל ההיסטוריה - ערכים מוחלטים, ולכן בטוחה להרצה חוזרת
+    owner = uuid.uuid4().hex
+    claim = _claim(db, owner, settle_minutes, resume=False)
+    if claim is None:
+        raise ForecastError("חישוב תחזית אחר רץ כרגע - נסה שוב בעוד כמה דקות")
+    end = claim[1]
+    per_item, rows = _fold_pages(_history(db), progress, until=end)
+    stale = [d.reference for d in db.collection(SERIES).stream() if d.id not in per_item]
+    writes = [(db.collection(SERIES).document(item_id), {"days": days, "through": end}) for item_id, days in per_item.items()]
+    for i in range(0, len(writes), BATCH_LIMIT):
+        batch = db.batch()
+        for ref, fields in writes[i:i + BATCH_LIMIT]:
+            batch.set(ref, fields)
+        batch.commit()
+    for i in range(0, len(stale), BATCH_LIMIT):
+        batch = db.batch()
+        for ref in stale[i:i + BATCH_LIMIT]:
+            batch.delete(ref)
+        batch.commit()
+    _release(db, owner, {"watermark": end})
+    return {"rows": rows, "items": len(writes), "watermark": end}
+
+
+def watermark(db):
+    snap = _state_ref(db).get()
+    return (snap.to_dict() or {}).get('watermark') if snap.exists else None
+
+
+# ==========================================
+# חישוב
+# ==========================================
+def load_series(db):
+    # {item_id: {day: כמות}} - מסמך אחד לכל פריט עם צריכה
+    return {d.id: d.get('days') or {} for d in db.collection(SERIES).stream()}
+
+
+def metrics(series, on_hand, as_of, window=WINDOW_DAYS, lead_time=LEAD_TIME_DAYS, z=SERVICE_Z):
+    # series - {item_id: {day: כמות}}; on_hand - {item_id: כמות}; lead_time - מספר או {item_id: ימים}.
+    # מחזיר DataFrame לפי item_id: rate, std, safety_stock, reorder_point, on_hand, days_of_cover, reorder
+    import numpy as np
+    import pandas as pd
+
+    if window < 1:
+        raise ForecastError("חלון החישוב חייב להיות לפחות יום אחד")
+    items = sorted(set(series) | {i for i, q in on_hand.items() if q})
+    # as_of - ה-watermark; החלון נגמר ביום המלא האחרון לפניו
+    end = pd.Timestamp(_utc(as_of)).floor("D").tz_localize(None) - pd.Timedelta(days=1)
+    days = pd.date_range(end - pd.Timedelta(days=window - 1), end, freq="D").strftime("%Y-%m-%d")
+
+    long = pd.DataFrame.from_records([(i, d, q) for i, s in series.items() for d, q in s.items()], columns=["item_id", "day", "quantity"])
+    recent = long[(long['day'] >= days[0]) & (long['day'] <= days[-1])]
+    demand = np.zeros((len(items), window))
+    if len(recent):
+        demand = (recent.pivot_table(index="item_id", columns="day", values="quantity", aggfunc="sum")
+                  .reindex(index=items, columns=days).fillna(0).to_numpy(dtype=float))
+    # פריט חדש נמדד מיום הצריכה הראשון שלו, לא על פני כל החלון
+    first_day = pd.to_datetime(pd.Series({i: min(s) for i, s in series.items() if s}, dtype=object).reindex(items))
+    offset = (first_day - pd.Timestamp(days[0])).dt.days.clip(lower=0).fillna(0).to_numpy()
+    active = np.maximum(window - offset, 1)
+    rate = demand.sum(axis=1) / active
+    var = np.maximum((demand ** 2).sum(axis=1) / active - rate ** 2, 0)
+    lead = np.array([lead_time.get(i, LEAD_TIME_DAYS) for i in items], dtype=float) if isinstance(lead_time, dict) else np.full(len(items), float(lead_time))
+    safety = z * np.sqrt(var * lead)
+    reorder_point = np.ceil(rate * lead + safety)
+    stock = np.array([on_hand.get(i, 0) for i in items], dtype=float)
+    with np.errstate(divide="ignore"):
+        cover = np.where(rate > 0, stock / rate, math.inf)
+    return pd.DataFrame({
+        "rate": rate, "std": np.sqrt(var), "lead_time": lead, "safety_stock": np.ceil(safety),
+        "reorder_point": reorder_point, "on_hand": stock, "days_of_cover": cover,
+        "reorder": (rate > 0) & (stock <= reorder_point)
+    }, index=pd.Index(items, name="item_id"))
@@ -0,0 +1,418 @@
+import random
+import threading
+import time
+
+from google.api_core import exceptions
+from google.cloud import firestore
+
+import ledger
+import locations
+import rollups
+
+# --- שכבת עדכוני כמויות מלאי ---
+# הוספות נעשות עם firestore.Increment (בלי קריאה, בלי אובדן עדכונים).
+# הורדות (אישור משיכה) רצות בטרנזקציה שבודקת זמינות, עם מספר ניסיונות חוזרים
+# מוגבל ו-backoff אקספוננציאלי. סטטיסטיקת התנגשויות וניסיונות חוזרים נאספת ב-stats.
+# כל שינוי כמות נרשם ביומן התנועות (ledger), בסיכומי המלאי (rollups) ובמפת המיקומים (locations)
+# באותה כתיבה אטומית.
+# op_id - מפתח idempotency (מתור הכתיבות, write_queue): הוא מזהה התנועה / הבקשה שנכתבת,
+# והטרנזקציה בודקת אותו קודם - שליחה חוזרת של פעולה שכבר נכתבה לא עושה דבר.
+
+MAX_ATTEMPTS = 5
+BASE_DELAY = 0.05
+MAX_DELAY = 1.0
+# תקציב כתיבות לטרנזקציה אחת בפעולה מרובה (מגבלת Firestore): לכל בקשה עדכון סטטוס,
+# רשומת יומן ותנועה; לכל מיקום עדכון מלאי, עד שני סיכומים (מחסן×פריט, פריט), רסיס אחד של
+# סה"כ המחסן ושורה אחת במפת המיקומים
+BULK_WRITES = 500
+# עגלת ליקוט נשלחת בטרנזקציה אחת - בקשה (כתיבה אחת) לכל שורה
+MAX_CART_LINES = 400
+WRITES_PER_REQUEST = 3
+WRITES_PER_LOCATION = 5
+# פינוי מחסן: מיקומים לטרנזקציה - מגבלת "in" בשאילתת הבקשות הממתינות; לכל מיקום עד 4 כתיבות
+# (שורה חדשה, מחיקה, שתי תנועות) ועד ארבע בסיכומים ובמפה - הרבה מתחת ל-BULK_WRITES
+EVACUATE_CHUNK = 30
+
+stats = {"commits": 0, "conflicts": 0, "retries": 0, "failures": 0}
+_stats_lock = threading.Lock()
+
+
+class InventoryError(Exception):
+    pass
+
+
+class InsufficientStock(InventoryError):
+    def __init__(self, available, requested):
+        super().__init__(f"אין מספיק מלאי: זמין {available}, התבקש {requested}")
+        self.available = available
+        self.requested = requested
+
+
+class RequestNotPending(InventoryError):
+    def __init__(self):
+        super().__init__("הבקשה כבר טופלה")
+
+
+class LocationMissing(InventoryError):
+    def __init__(self):
+        super().__init__("הפריט כבר לא קיים במלאי")
+
+
+class CartInvalid(InventoryError):
+    def __init__(self, problems):
+        # problems - {loc_id: הודעה}
+        super().__init__("העגלה לא נשלחה: " + "; ".join(problems.values()))
+        self.problems = problems
+
+
+class ContentionError(InventoryError):
+    def __init__(self, attempts):
+        super().__init__(f"עומס עדכונים - הפעולה נכשלה אחרי {attempts} ניסיונות, נסה שוב")
+        self.attempts = attempts
+
+
+def _count(key, n=1):
+    with _stats_lock:
+        stats[key] += n
+
+
+def _is_conflict(error):
+    # ספריית firestore עוטפת commit שנדחה בגלל התנגשות ב-ValueError שהסיבה שלו Aborted;
+    # כל ValueError אחר (באג או קלט שגוי בתוך fn) עובר הלאה ולא נספר כעומס
+    return isinstance(error, exceptions.Aborted) or isinstance(error.__cause__, exceptions.Aborted)
+
+
+def run_transaction(db, fn, max_attempts=MAX_ATTEMPTS):
+    # fn(transaction) -> תוצאה; כל ניסיון הוא טרנזקציה חדשה עם ניסיון commit יחיד.
+    # מנוע אחסון מקומי (storage.py) מספק run_transaction משלו
+    local = getattr(db, "run_transaction", None)
+    for attempt in range(1, max_attempts + 1):
+        try:
+            result = local(fn) if local else firestore.transactional(fn)(db.transaction(max_attempts=1))
+            _count("commits")
+            return result
+        except (exceptions.Aborted, ValueError) as e:
+            if not _is_conflict(e):
+                raise
+            _count("conflicts")
+            if attempt == max_attempts:
+                break
+            _count("retries")
+            time.sleep(min(MAX_DELAY, BASE_DELAY * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+    _count("failures")
+    raise ContentionError(max_attempts)
+
+
+def location_id(target, item_id):
+    # מזהה המיקום מקודד את המיקום עצמו: מחסן_שורה_עמודה_קומה_פריט
+    return f"{target['warehouse']}_{target['row']}_{target['column']}_{target['floor']}_{item_id}"
+
+
+def add_stock(db, loc_id, qty, new_row=None, row=None, user="", op_id=None):
+    # new_row - שדות המיקום ליצירה אם עדיין לא קיים (קליטה); בלי new_row המיקום חייב להיות קיים.
+    # row - שורת המיקום הקיימת (item_id, warehouse) לרישום התנועה
+    ref = db.collection("Inventory").document(loc_id)
+    row = new_row or row or {}
+
+    def write(writer):
+        if new_row is None:
+            writer.update(ref, {"quantity": firestore.Increment(int(qty))})
+        else:
+            writer.set(ref, {**new_row, "quantity": firestore.Increment(int(qty))}, merge=True)
+        ledger.record(writer, db, ledger.RECEIPT, row, loc_id, qty, user, doc_id=op_id, create=op_id is not None)
+        rollups.apply(writer, db, rollups.delta(row, qty))
+        locations.apply(writer, db, locations.delta(row, qty))
+
+    # batch בלי קריאה גם עם מפתח: רשומת התנועה ב-op_id נכתבת ב-create, ושליחה חוזרת
+    # (write_queue) נדחית כולה ב-AlreadyExists - הכמות לא נספרת פעמיים
+    batch = db.batch()
+    write(batch)
+    try:
+        batch.commit()
+    except exceptions.AlreadyExists:
+        if op_id is None:
+            raise
+        return
+    _count("commits")
+
+
+def create_request(db, request, request_id=None):
+    # בקשת משיכה חדשה; עם request_id (מפתח idempotency) נכתבת רק אם עוד לא קיימת
+    if request_id is None:
+        db.collection("Requests").add(request)
+        return
+    ref = db.collection("Requests").document(request_id)
+
+    def apply(transaction):
+        if not ref.get(transaction=transaction).exists:
+            transaction.set(ref, request)
+
+    run_transaction(db, apply)
+
+
+def submit_cart(db, lines, request, cart_id):
+    # lines - {loc_id: {quantity, item_name, item_id, warehouse, site}}; request - שדות משותפים (user_email, reason, timestamp).
+    # כל המיקומים נקראים ב-get_all אחד, וכל הבקשות נכתבות באותה טרנזקציה - הכל או כלום.
+    # מזהי הבקשות נגזרים מ-cart_id, כך ששליחה חוזרת (write_queue) לא יוצרת כפילויות
+    if len(lines) > MAX_CART_LINES:
+        raise CartInvalid({"": f"עד {MAX_CART_LINES} שורות בעגלה"})
+    loc_ids = sorted(lines)
+    req_refs = {loc: db.collection("Requests").document(f"{cart_id}_{i}") for i, loc in enumerate(loc_ids)}
+    inv_refs = {loc: db.collection("Inventory").document(loc) for loc in loc_ids}
+
+    def apply(transaction):
+        first = req_refs[loc_ids[0]]
+        snaps = {snap.reference.path: snap for snap in transaction.get_all([first] + list(inv_refs.values()))}
+        if snaps[first.path].exists:
+            return [ref.id for ref in req_refs.values()]
+        problems = {}
+        for loc in loc_ids:
+            inv, line = snaps[inv_refs[loc].path], lines[loc]
+            if not inv.exists:
+                problems[loc] = f"{line['item_name']}: {LocationMissing()}"
+            elif inv.get('quantity') < line['quantity']:
+                problems[loc] = f"{line['item_name']}: {InsufficientStock(inv.get('quantity'), line['quantity'])}"
+        if problems:
+            raise CartInvalid(problems)
+        for loc in loc_ids:
+            line = lines[loc]
+            transaction.set(req_refs[loc], {
+                **request, "item_name": line['item_name'], "location_id": loc, "item_id": line.get('item_id'),
+                "warehouse": line.get('warehouse'), "site": line.get('site'), "quantity": int(line['quantity']),
+                "status": "pending", "cart_id": cart_id
+            })
+        return [ref.id for ref in req_refs.values()]
+
+    return run_transaction(db, apply)
+
+
+def approve_request(db, request_id, location_id, user="", op_id=None):
+    req_ref = db.collection("Requests").document(request_id)
+    inv_ref = db.collection("Inventory").document(location_id)
+    refs = [req_ref, inv_ref] + ([db.collection(ledger.MOVEMENTS).document(op_id)] if op_id else [])
+
+    def apply(transaction):
+        # הבקשה והמיקום נקראים יחד ב-get_all - סבב אחד לשרת במקום שניים
+        snaps = {snap.reference.path: snap for snap in transaction.get_all(refs)}
+        req, inv = snaps[req_ref.path], snaps[inv_ref.path]
+        if op_id and snaps[refs[2].path].exists:
+            return inv.get('quantity') if inv.exists else 0
+        if not req.exists or req.get('status') != "pending":
+            raise RequestNotPending()
+        if not inv.exists:
+            raise LocationMissing()
+        requested = req.get('quantity')
+        available = inv.get('quantity')
+        if available < requested:
+            raise InsufficientStock(available, requested)
+        transaction.update(inv_ref, {"quantity": available - requested})
+        # זמן האישור בשעון השרת - לפיו נצברת התחזית (forecast.py)
+        transaction.update(req_ref, {"status": "approved", "approved_at": firestore.SERVER_TIMESTAMP})
+        row = inv.to_dict()
+        ledger.record(transaction, db, ledger.PULL, row, location_id, -requested, user, doc_id=op_id, request_id=request_id)
+        rollups.apply(transaction, db, rollups.delta(row, -requested))
+        locations.apply(transaction, db, locations.delta(row, -requested))
+        return available - requested
+
+    return run_transaction(db, apply)
+
+
+def move_stock(db, loc_id, target, user="", op_id=None):
+    # העברת כל הכמות למיקום חדש: target - {warehouse, site, row, column, floor}. מזהה המיקום
+    # מקודד את המיקום, ולכן נוצרת (או מתווספת) שורה במזהה החדש והישנה נמחקת; בקשות
+    # ממתינות על המיקום הישן עוברות איתה. מחזיר (מזהה חדש, השורה החדשה)
+    src_ref = db.collection("Inventory").document(loc_id)
+    done_ref = db.collection(ledger.MOVEMENTS).document(f"{op_id}_in") if op_id else None
+
+    def apply(transaction):
+        if done_ref is not None:
+            done = done_ref.get(transaction=transaction)
+            if done.exists:
+                dst = db.collection("Inventory").document(done.get('location_id')).get(transaction=transaction)
+                return dst.id, dst.to_dict() or {}
+        src = src_ref.get(transaction=transaction)
+        if not src.exists:
+            raise LocationMissing()
+        row = src.to_dict()
+        new_id = location_id(target, row.get('item_id'))
+        if new_id == loc_id:
+            return loc_id, row
+        dst_ref = db.collection("Inventory").document(new_id)
+        dst = dst_ref.get(transaction=transaction)
+        pending = list(transaction.get(db.collection("Requests").where("status", "==", "pending").where("location_id", "==", loc_id)))
+        qty = row.get('quantity', 0)
+        new_row = {**(dst.to_dict() if dst.exists else {**row, **target}), "quantity": (dst.get('quantity') if dst.exists else 0) + qty}
+        transaction.set(dst_ref, new_row)
+        transaction.delete(src_ref)
+        for req in pending:
+            moved = {"location_id": new_id, "warehouse": target['warehouse']}
+            if new_row.get('site'):
+                moved["site"] = new_row['site']
+            transaction.update(req.reference, moved)
+        transfer_id = op_id or ledger.new_transfer_id()
+        ledger.record(transaction, db, ledger.TRANSFER, row, loc_id, -qty, user, doc_id=op_id and f"{op_id}_out", transfer_id=transfer_id)
+        ledger.record(transaction, db, ledger.TRANSFER, new_row, new_id, qty, user, doc_id=op_id and f"{op_id}_in", transfer_id=transfer_id)
+        # בין מחסנים הסיכום עובר; באותו מחסן השינויים מתקזזים ו-apply לא כותב דבר
+        deltas = rollups.delta(row, -qty)
+        dst_key = rollups.delta_key(new_row)
+        deltas[dst_key] = deltas.get(dst_key, 0) + qty
+        rollups.apply(transaction, db, deltas)
+        locations.apply(transaction, db, locations.merge_deltas(locations.delta(row, -qty), locations.delta(new_row, qty)))
+        return new_id, new_row
+
+    return run_transaction(db, apply)
+
+
+# ==========================================
+# פינוי מחסן (מחיקה) - אותו מסלול כמו move_stock, בנתחים
+# ==========================================
+def _evacuate_chunk(db, transaction, loc_ids, target, user):
+    # loc_ids - עד EVACUATE_CHUNK מיקומים של המחסן; כל מיקום עובר כמו ב-move_stock: שורה חדשה
+    # במזהה של target (או תוספת לקיימת), מחיקת הישנה, בקשות ממתינות, זוג תנועות העברה וסיכומים
+    src_refs = {loc: db.collection("Inventory").document(loc) for loc in loc_ids}
+    rows = {s.id: s.to_dict() for s in transaction.get_all(list(src_refs.values())) if s.exists}
+    dst_ids = {loc: location_id({**row, **target}, row.get('item_id')) for loc, row in rows.items()}
+    dst_refs = {new_id: db.collection("Inventory").document(new_id) for new_id in set(dst_ids.values())}
+    dsts = {s.id: s.to_dict() for s in transaction.get_all(list(dst_refs.values())) if s.exists}
+    pending = list(transaction.get(db.collection("Requests").where("status", "==", "pending").where("location_id", "in", list(rows)))) if rows else []
+
+    moved, deltas, slots = {}, {}, {}
+    for loc, row in rows.items():
+        new_id, qty = dst_ids[loc], row.get('quantity', 0)
+        new_row = {**dsts.get(new_id, {**row, **target}), "quantity": dsts.get(new_id, {}).get('quantity', 0) + qty}
+        dsts[new_id] = new_row
+        transaction.delete(src_refs[loc])
+        transfer_id = ledger.new_transfer_id()
+        ledger.record(transaction, db, ledger.TRANSFER, row, loc, -qty, user, transfer_id=transfer_id)
+        ledger.record(transaction, db, ledger.TRANSFER, new_row, new_id, qty, user, transfer_id=transfer_id)
+        for key, d in list(rollups.delta(row, -qty).items()) + list(rollups.delta(new_row, qty).items()):
+            deltas[key] = deltas.get(key, 0) + d
+        slots = locations.merge_deltas(slots, locations.delta(row, -qty), locations.delta(new_row, qty))
+        moved[loc] = new_id
+    for new_id in set(moved.values()):
+        transaction.set(dst_refs[new_id], dsts[new_id])
+    for req in pending:
+        transaction.update(req.reference, {"location_id": moved[req.get('location_id')], **target})
+    rollups.apply(transaction, db, deltas)
+    locations.apply(transaction, db, slots)
+    return moved, {new_id: dsts[new_id] for new_id in set(moved.values())}
+
+
+def evacuate_warehouse(db, source, target, user="", progress=None):
+    # מעביר את כל שורות המלאי של source ל-target ({warehouse, site}). כל נתח הוא טרנזקציה אחת
+    # שמוחקת את השורות שטופלו, ולכן הרצה חוזרת אחרי נפילה ממשיכה מהשורות שנשארו - בלי
+    # ספירה כפולה בסיכומים וביומן. בסוף נמחקים מסמכי הסיכום ומפת המיקומים (המאופסים) של source.
+    # מחזיר ({מזהה ישן: מזהה חדש}, {מזהה חדש: שורה})
+    moved, rows = {}, {}
+    while True:
+        loc_ids = [d.id for d in db.collection("Inventory").where("warehouse", "==", source).limit(EVACUATE_CHUNK).stream()]
+        if not loc_ids:
+            break
+        part, part_rows = run_transaction(db, lambda transaction: _evacuate_chunk(db, transaction, loc_ids, target, user))
+        moved.update(part)
+        rows.update(part_rows)
+        if progress:
+            progress(len(moved))
+    rollups.drop_warehouse(db, source)
+    locations.drop_warehouse(db, source)
+    return moved, rows
+
+
+def reject_request(db, request_id, op_id=None):
+    req_ref = db.collection("Requests").document(request_id)
+
+    def apply(transaction):
+        req = req_ref.get(transaction=transaction)
+        if op_id and req.exists and req.get('status') == "rejected":
+            # דחייה היא אידמפוטנטית מטבעה - שליחה חוזרת מהתור אינה שגיאה
+            return
+        if not req.exists or req.get('status') != "pending":
+            raise RequestNotPending()
+        transaction.update(req_ref, {"status": "rejected"})
+
+    return run_transaction(db, apply)
+
+
+# ==========================================
+# אישור / דחייה מרובים
+# ==========================================
+def _bulk_chunks(requests):
+    # קיבוץ לפי מיקום, כך שהזמינות נבדקת פעם אחת לכל מיקום והמלאי נכתב פעם אחת
+    by_loc = {}
+    for req_id, r in requests:
+        by_loc.setdefault(r['location_id'], []).append(req_id)
+    budget = BULK_WRITES
+    per_loc = (budget - WRITES_PER_LOCATION) // WRITES_PER_REQUEST
+    chunks, current, size = [], [], 0
+    for loc, ids in by_loc.items():
+        for i in range(0, len(ids), per_loc):
+            part = ids[i:i + per_loc]
+            cost = WRITES_PER_LOCATION + WRITES_PER_REQUEST * len(part)
+            if current and size + cost > budget:
+                chunks.append(current)
+                current, size = [], 0
+            current.append((loc, part))
+            size += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _decide_chunk(db, transaction, chunk, approve, log_entry):
+    out = {"done": [], "skipped": [], "quantities": {}}
+    req_refs = {req_id: db.collection("Requests").document(req_id) for _, ids in chunk for req_id in ids}
+    inv_refs = {loc: db.collection("Inventory").document(loc) for loc, _ in chunk} if approve else {}
+    snaps = {snap.reference.path: snap for snap in transaction.get_all(list(req_refs.values()) + list(inv_refs.values()))}
+
+    deltas, slots = {}, {}
+    for loc, ids in chunk:
+        inv = snaps[inv_refs[loc].path] if approve else None
+        row = inv.to_dict() if inv is not None and inv.exists else {}
+        available = row.get('quantity', 0)
+        remaining = available
+        for req_id in ids:
+            req = snaps[req_refs[req_id].path]
+            if not req.exists or req.get('status') != "pending":
+                out["skipped"].append((req_id, str(RequestNotPending())))
+                continue
+            r = req.to_dict()
+            if approve:
+                if not inv.exists:
+                    out["skipped"].append((req_id, str(LocationMissing())))
+                    continue
+                if r['quantity'] > remaining:
+                    out["skipped"].append((req_id, str(InsufficientStock(remaining, r['quantity']))))
+                    continue
+                remaining -= r['quantity']
+                entry = log_entry("אישור משיכה", f"אושר ל-{r['user_email']} למשוך {r['item_name']}")
+                ledger.record(transaction, db, ledger.PULL, row, loc, -r['quantity'], entry.get('user', ""), request_id=req_id)
+            else:
+                entry = log_entry("דחיית משיכה", f"נדחה ל-{r['user_email']} עבור {r['item_name']}")
+            transaction.update(req_refs[req_id], {"status": "approved", "approved_at": firestore.SERVER_TIMESTAMP} if approve else {"status": "rejected"})
+            transaction.set(db.collection("Logs").document(), entry)
+            out["done"].append(req_id)
+        if approve and remaining != available:
+            transaction.update(inv_refs[loc], {"quantity": remaining})
+            out["quantities"][loc] = remaining
+            key = rollups.delta_key(row)
+            deltas[key] = deltas.get(key, 0) + remaining - available
+            slots = locations.merge_deltas(slots, locations.delta(row, remaining - available))
+    # סיכומים - עדכון אחד לכל מחסן×פריט, לכל פריט ולכל מפת מחסן בנתח
+    rollups.apply(transaction, db, deltas)
+    locations.apply(transaction, db, slots)
+    return out
+
+
+def decide_requests(db, requests, approve, log_entry):
+    # requests - [(request_id, נתוני הבקשה)] לפי סדר הגשה; log_entry(action, details) -> מסמך יומן
+    start = time.perf_counter()
+    result = {"done": [], "skipped": [], "quantities": {}}
+    for chunk in _bulk_chunks(requests):
+        part = run_transaction(db, lambda transaction, chunk=chunk: _decide_chunk(db, transaction, chunk, approve, log_entry))
+        result["done"] += part["done"]
+        result["skipped"] += part["skipped"]
+        result["quantities"].update(part["quantities"])
+    elapsed = time.perf_counter() - start
+    result["elapsed"] = elapsed
+    result["per_sec"] = len(requests) / elapsed if elapsed else 0
+    return result
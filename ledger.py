@@ -0,0 +1,152 @@
+import time
+import uuid
+
+from google.cloud import firestore
+
+import rollups
+
+# --- יומן תנועות מלאי ---
+# כל שינוי כמות נרשם כתנועה (Movements) באותה טרנזקציה / batch שמשנה את המלאי:
+# קליטה, משיכה, העברה (יציאה + כניסה עם transfer_id משותף) ויתרת פתיחה.
+# היתרות נשמרות מצטברות: Inventory.quantity למיקום ו-ItemBalances/{item_id} לפריט
+# (rollups.apply, בלי קריאה). יתרה היסטורית = היתרה הנוכחית פחות סכום התנועות שאחרי
+# הנקודה המבוקשת - שאילתת טווח על אינדקס (location_id/item_id + timestamp).
+
+MOVEMENTS = "Movements"
+BALANCES = rollups.BALANCES
+OPENING_JOB = "ledger_opening_v1"
+OPENING_PAGE = 200
+
+RECEIPT, PULL, TRANSFER, OPENING = "receipt", "pull", "transfer", "opening"
+
+
+def record(writer, db, kind, row, location_id, delta, user="", doc_id=None, create=False, **extra):
+    # writer - transaction או batch; row - שורת המלאי (item_id, warehouse).
+    # create - הרשומה משמשת גם כסימון idempotency: אם כבר קיימת, כל הכתיבה נדחית (AlreadyExists)
+    (writer.create if create else writer.set)(db.collection(MOVEMENTS).document(doc_id), {
+        "kind": kind, "item_id": row.get('item_id'), "location_id": location_id, "warehouse": row.get('warehouse'),
+        "delta": int(delta), "user": user, "timestamp": firestore.SERVER_TIMESTAMP, **extra
+    })
+
+
+def new_transfer_id():
+    return uuid.uuid4().hex
+
+
+# ==========================================
+# שאילתות היסטוריה
+# ==========================================
+def history(db, item_id=None, location_id=None, start=None, end=None, limit=None, newest_first=True):
+    q = db.collection(MOVEMENTS)
+    q = q.where("item_id", "==", item_id) if item_id else q.where("location_id", "==", location_id)
+    if start is not None:
+        q = q.where("timestamp", ">=", start)
+    if end is not None:
+        q = q.where("timestamp", "<=", end)
+    q = q.order_by("timestamp", direction=firestore.Query.DESCENDING if newest_first else firestore.Query.ASCENDING)
+    if limit:
+        q = q.limit(limit)
+    return [d.to_dict() for d in q.stream()]
+
+
+def balance_at(db, at, item_id=None, location_id=None):
+    # יתרה נכונה לרגע at: היתרה הנוכחית פחות כל מה שזז אחריו
+    if item_id:
+        snap = db.collection(BALANCES).document(item_id).get()
+    else:
+        snap = db.collection("Inventory").document(location_id).get()
+    current = (snap.to_dict() or {}).get('quantity', 0) if snap.exists else 0
+    q = db.collection(MOVEMENTS)
+    q = q.where("item_id", "==", item_id) if item_id else q.where("location_id", "==", location_id)
+    later = sum(d.get('delta') for d in q.where("timestamp", ">", at).stream())
+    return current - later
+
+
+# ==========================================
+# יתרות פתיחה לנתונים קיימים
+# ==========================================
+def open_ledger(db, job_id=OPENING_JOB, page_size=OPENING_PAGE, progress=None):
+    # תנועת פתיחה לכל שורת מלאי קיימת - בעמודים, עם נקודת עצירה
+    # באותו batch (Migrations/{job_id}), כך שהרצה חוזרת ממשיכה ולא סופרת פעמיים
+    job_ref = db.collection("Migrations").document(job_id)
+    job = job_ref.get()
+    state = job.to_dict() if job.exists else {}
+    opened = state.get('opened', 0)
+    if state.get('done'):
+        return {"opened": opened, "elapsed": 0.0}
+
+    start = time.perf_counter()
+    base = db.collection("Inventory")
+    last = base.document(state['last_id']).get() if state.get('last_id') else None
+    # נקודת העצירה נמחקה - מתחילים מחדש ומדלגים על שורות שכבר יש להן תנועת פתיחה
+    recheck = last is not None and not last.exists
+    if recheck:
+        last = None
+    while True:
+        page = list((base if last is None else base.start_after(last)).limit(page_size).stream())
+        rows = {d.id: d.to_dict() for d in page}
+        if recheck:
+            rows = _unopened(db, rows)
+        batch = db.batch()
+        opened += _write_openings(batch, db, rows)
+        batch.set(job_ref, {
+            "last_id": page[-1].id if page else state.get('last_id'), "opened": opened,
+            "updated_at": firestore.SERVER_TIMESTAMP
+        }, merge=True)
+        batch.commit()
+        if progress:
+            progress(opened)
+        if len(page) < page_size:
+            break
+        last = page[-1]
+
+    # מיקומים שהועברו (ונמחקו) לפני הפתיחה - קיימים רק בתנועות ההעברה שלהם
+    sources = {}
+    for d in db.collection(MOVEMENTS).where("kind", "==", TRANSFER).stream():
+        m = d.to_dict()
+        if m.get('delta', 0) < 0:
+            sources[m['location_id']] = {"item_id": m.get('item_id'), "warehouse": m.get('warehouse'), "quantity": 0}
+    ids = list(sources)
+    for i in range(0, len(ids), page_size):
+        part = ids[i:i + page_size]
+        existing = {s.id for s in db.get_all([base.document(loc) for loc in part]) if s.exists}
+        batch = db.batch()
+        opened += _write_openings(batch, db, _unopened(db, {loc: sources[loc] for loc in part if loc not in existing}))
+        batch.set(job_ref, {"opened": opened}, merge=True)
+        batch.commit()
+    job_ref.set({"done": True, "opened": opened, "updated_at": firestore.SERVER_TIMESTAMP}, merge=True)
+    return {"opened": opened, "elapsed": time.perf_counter() - start}
+
+
+def _unopened(db, rows):
+    if not rows:
+        return rows
+    seen = {s.id for s in db.get_all([db.collection(MOVEMENTS).document(f"opening_{loc}") for loc in rows]) if s.exists}
+    return {loc: row for loc, row in rows.items() if f"opening_{loc}" not in seen}
+
+
+def _write_openings(batch, db, rows):
+    # rows - {loc_id: שורה}; תנועות שנרשמו כבר (אחרי העלאת הגרסה) כלולות בכמות -
+    # הפתיחה היא מה שהיה לפניהן. מזהה קבוע, כך שתנועת פתיחה נכתבת פעם אחת למיקום.
+    # היתרות עצמן לא משתנות - הן כבר כוללות את הכמות; בנייתן לנתונים קיימים היא rollups.verify
+    prior = _recorded(db, list(rows))
+    count = 0
+    for loc, row in rows.items():
+        qty = row.get('quantity', 0) - prior.get(loc, 0)
+        if not qty:
+            continue
+        record(batch, db, OPENING, row, loc, qty, doc_id=f"opening_{loc}")
+        count += 1
+    return count
+
+
+def _recorded(db, location_ids):
+    # סכום התנועות (שאינן פתיחה) לכל מיקום - where in מוגבל ל-30 ערכים
+    totals = {}
+    for i in range(0, len(location_ids), 30):
+        for d in db.collection(MOVEMENTS).where("location_id", "in", location_ids[i:i + 30]).stream():
+            m = d.to_dict()
+            if m.get('kind') != OPENING:
+                totals[m['location_id']] = totals.get(m['location_id'], 0) + m.get('delta', 0)
+    return totals
+
@@ -0,0 +1,155 @@
+import itertools
+
+from google.cloud import firestore
+
+# --- מפת מיקומים לכל מחסן ---
+# מבנה המחסן (Warehouses.layout: rows, columns, floors) מגדיר את התאים האפשריים, ו-SlotMaps
+# מחזיק מה יש בכל תא - מסמך לכל שורה במחסן, SlotMaps/{warehouse}_{row}:
+# {"warehouse", "row", "slots": {"שורה_עמודה_קומה": {item_id: כמות}}}. המפה מתעדכנת ב-Increment
+# באותה כתיבה אטומית שמשנה כמות (apply, לצד rollups); הפיצול לשורות מונע מסמך חם אחד לכל
+# המחסן (Firestore: בערך כתיבה אחת לשנייה למסמך). תוכן תא, תאים פנויים ותמונת קומה נקראים
+# ממסמכי השורות של המחסן - בלי מעבר על שורות המלאי.
+
+SLOT_MAPS = "SlotMaps"
+BATCH_LIMIT = 500
+
+
+def slot_key(row, column, floor):
+    return f"{row}_{column}_{floor}"
+
+
+def _map_ref(db, warehouse, row):
+    return db.collection(SLOT_MAPS).document(f"{warehouse}_{row}")
+
+
+def delta(row, qty):
+    # row - שורת מלאי; שורה בלי מיקום מלא לא נכנסת למפה
+    if not row.get('warehouse') or not row.get('item_id') or row.get('row') in (None, ""):
+        return {}
+    return {(row['warehouse'], str(row['row']), slot_key(row.get('row'), row.get('column', ''), row.get('floor')), row['item_id']): qty}
+
+
+def apply(writer, db, deltas):
+    # writer - transaction או batch; deltas - {(warehouse, row, slot_key, item_id): שינוי}. כתיבה אחת לכל שורה
+    per_row = {}
+    for (wh, r, key, item_id), d in deltas.items():
+        if d:
+            items = per_row.setdefault((wh, r), {}).setdefault(key, {})
+            items[item_id] = items.get(item_id, 0) + d
+    for (wh, r), slots in per_row.items():
+        slots = {key: {i: firestore.Increment(int(q)) for i, q in items.items() if q} for key, items in slots.items()}
+        slots = {key: items for key, items in slots.items() if items}
+        if slots:
+            writer.set(_map_ref(db, wh, r), {"warehouse": wh, "row": r, "slots": slots, "updated": firestore.SERVER_TIMESTAMP}, merge=True)
+
+
+def merge_deltas(*parts):
+    out = {}
+    for part in parts:
+        for key, d in part.items():
+            out[key] = out.get(key, 0) + d
+    return out
+
+
+# ==========================================
+# מבנה מחסן וקריאות
+# ==========================================
+def parse_layout(warehouse):
+    # warehouse - מסמך מחסן; None אם לא הוגדר מבנה
+    layout = (warehouse or {}).get('layout')
+    if not layout or not layout.get('rows') or not layout.get('columns') or not layout.get('floors'):
+        return None
+    return {"rows": int(layout['rows']), "columns": [str(c) for c in layout['columns']], "floors": int(layout['floors'])}
+
+
+def layout_slots(layout):
+    # סדר הליכה: שורה, עמודה, קומה - כמו מזהה המיקום
+    for r, c, f in itertools.product(range(1, layout['rows'] + 1), layout['columns'], range(1, layout['floors'] + 1)):
+        yield str(r), c, str(f)
+
+
+def _row_maps(db, warehouse):
+    # {row: (מסמך, slots)} - מסמכי השורות של המחסן
+    return {d.get('row'): (d, d.to_dict().get('slots') or {}) for d in db.collection(SLOT_MAPS).where("warehouse", "==", warehouse).stream()}
+
+
+def _occupied(slots):
+    occupied = {}
+    for key, items in slots.items():
+        items = {i: q for i, q in items.items() if q}
+        if items:
+            occupied[key] = items
+    return occupied
+
+
+def slot_map(db, warehouse):
+    # {slot_key: {item_id: כמות}} - רק תאים תפוסים, מכל שורות המחסן
+    occupied = {}
+    for _, slots in _row_maps(db, warehouse).values():
+        occupied.update(_occupied(slots))
+    return occupied
+
+
+def contents(slots, row, column, floor):
+    return slots.get(slot_key(row, column, floor), {})
+
+
+def free_slots(slots, layout, limit=5):
+    return list(itertools.islice(((r, c, f) for r, c, f in layout_slots(layout) if slot_key(r, c, f) not in slots), limit))
+
+
+def occupancy(slots, layout):
+    # (תפוסים, סה"כ) בתוך המבנה
+    total = layout['rows'] * len(layout['columns']) * layout['floors']
+    used = sum(1 for r, c, f in layout_slots(layout) if slot_key(r, c, f) in slots)
+    return used, total
+
+
+def floor_grid(slots, layout, floor):
+    # {row: {column: {item_id: כמות}}} לקומה אחת
+    return {str(r): {c: contents(slots, str(r), c, str(floor)) for c in layout['columns']} for r in range(1, layout['rows'] + 1)}
+
+
+# ==========================================
+# מחיקת מחסן, בדיקת סטייה וחישוב מחדש
+# ==========================================
+def drop_warehouse(db, warehouse):
+    # אחרי פינוי מחסן (inventory_ops.evacuate_warehouse) השורות שלו במפה ריקות - נמחקות
+    refs = [snap.reference for snap, _ in _row_maps(db, warehouse).values()]
+    for i in range(0, len(refs), BATCH_LIMIT):
+        batch = db.batch()
+        for ref in refs[i:i + BATCH_LIMIT]:
+            batch.delete(ref)
+        batch.commit()
+
+
+def expected(inventory):
+    # {warehouse: {row: {slot_key: {item_id: כמות}}}}
+    maps = {}
+    for row in inventory.values():
+        for (wh, r, key, item_id), qty in delta(row, row.get('quantity', 0)).items():
+            if qty:
+                items = maps.setdefault(wh, {}).setdefault(r, {}).setdefault(key, {})
+                items[item_id] = items.get(item_id, 0) + qty
+    return maps
+
+
+def verify(db, inventory, warehouses=(), fix=False):
+    # warehouses - מחסנים נוספים לבדיקה (גם ריקים); מחזיר [(מחסן, תא, צפוי, בפועל)]. fix כותב מחדש את השורות שסטו
+    want = expected(inventory)
+    drift, writes = [], []
+    for wh in sorted(set(want) | set(warehouses)):
+        exp_rows, act_rows = want.get(wh, {}), _row_maps(db, wh)
+        for r in sorted(set(exp_rows) | set(act_rows), key=str):
+            exp, act = exp_rows.get(r, {}), _occupied(act_rows[r][1]) if r in act_rows else {}
+            diffs = [(wh, key, exp.get(key, {}), act.get(key, {})) for key in sorted(set(exp) | set(act)) if exp.get(key, {}) != act.get(key, {})]
+            drift += diffs
+            if diffs:
+                writes.append((_map_ref(db, wh, r), {"warehouse": wh, "row": r, "slots": exp, "updated": firestore.SERVER_TIMESTAMP}))
+    if fix:
+        for i in range(0, len(writes), BATCH_LIMIT):
+            batch = db.batch()
+            for ref, fields in writes[i:i + BATCH_LIMIT]:
+                batch.set(ref, fields)
+            batch.commit()
+    return drift
@@ -0,0 +1,300 @@
+import contextlib
+import json
+import threading
+import time
+
+from google.cloud import firestore
+
+# --- מדידת קריאות/כתיבות מול מסד הנתונים ---
+# MeteredClient עוטף לקוח Firestore (או מנוע מקומי מ-storage.py) וסופר מסמכים שנקראו,
+# מסמכים שנכתבו וסבבים לשרת - לפי החיוב של Firestore: שאילתה ריקה או count() נספרות
+# כקריאה אחת, ומאזין on_snapshot נספר לפי מספר השינויים שהגיעו.
+# הספירה נאספת גם בסך הכל וגם ב-scope של התהליכון הנוכחי, כך שאפשר לייחס קריאות לפעולה
+# (עבודה שרצה בתהליכונים אחרים - מאזינים, יומן הרקע - נספרת רק בסך הכל).
+
+COUNTERS = ("reads", "writes", "round_trips")
+
+
+def _unwrap(obj):
+    return getattr(obj, "_inner", obj)
+
+
+class Meter:
+    def __init__(self):
+        self.totals = dict.fromkeys(COUNTERS, 0)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add(self, reads=0, writes=0, round_trips=1, scoped=True):
+        with self._lock:
+            self.totals["reads"] += reads
+            self.totals["writes"] += writes
+            self.totals["round_trips"] += round_trips
+        if not scoped:
+            return
+        self._local.last = time.perf_counter()
+        for counts in getattr(self._local, "scopes", ()):
+            counts["reads"] += reads
+            counts["writes"] += writes
+            counts["round_trips"] += round_trips
+
+    def begin(self):
+        # פותח scope בתהליכון הנוכחי; מחזיר (counts, scopes) לסגירה ב-end
+        counts = dict.fromkeys(COUNTERS, 0)
+        scopes = self._local.__dict__.setdefault("scopes", [])
+        scopes.append(counts)
+        return counts, scopes
+
+    def end(self, handle):
+        counts, scopes = handle
+        if counts in scopes:
+            scopes.remove(counts)
+
+    def last_activity(self):
+        # זמן (perf_counter) של הפנייה האחרונה למסד מהתהליכון הנוכחי
+        return getattr(self._local, "last", None)
+
+    @contextlib.contextmanager
+    def scope(self):
+        # ספירה של מה שהתהליכון הנוכחי עשה בתוך ה-with (scope-ים מקוננים נספרים כולם)
+        handle = self.begin()
+        try:
+            yield handle[0]
+        finally:
+            self.end(handle)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.totals)
+
+
+class _Proxy:
+    def __init__(self, inner, meter):
+        self._inner = inner
+        self._meter = meter
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+
+class MeteredQuery(_Proxy):
+    def _wrap(self, query):
+        return MeteredQuery(query, self._meter)
+
+    def where(self, *args, **kwargs):
+        return self._wrap(self._inner.where(*args, **kwargs))
+
+    def order_by(self, *args, **kwargs):
+        return self._wrap(self._inner.order_by(*args, **kwargs))
+
+    def limit(self, count):
+        return self._wrap(self._inner.limit(count))
+
+    def start_after(self, snapshot):
+        return self._wrap(self._inner.start_after(snapshot))
+
+    def stream(self, transaction=None):
+        docs = list(self._inner.stream(transaction=_unwrap(transaction)) if transaction else self._inner.stream())
+        self._meter.add(reads=max(len(docs), 1))
+        return iter(docs)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction))
+
+    def count(self):
+        return _MeteredAggregation(self._inner.count(), self._meter)
+
+    def on_snapshot(self, callback):
+        def metered(docs, changes, read_time):
+            # עדכוני מאזין לא שייכים לפעולה של התהליכון שבמקרה מריץ אותם
+            self._meter.add(reads=len(changes), round_trips=0, scoped=False)
+            return callback(docs, changes, read_time)
+        return self._inner.on_snapshot(metered)
+
+
+class _MeteredAggregation(_Proxy):
+    def get(self, *args, **kwargs):
+        result = self._inner.get(*args, **kwargs)
+        # count() מחויב בקריאה אחת לכל 1000 רשומות אינדקס
+        self._meter.add(reads=max(1, -(-result[0][0].value // 1000)))
+        return result
+
+
+class MeteredCollection(MeteredQuery):
+    def document(self, *args, **kwargs):
+        return MeteredDocument(self._inner.document(*args, **kwargs), self._meter)
+
+    def add(self, data, *args, **kwargs):
+        result = self._inner.add(data, *args, **kwargs)
+        self._meter.add(writes=1)
+        return result
+
+
+class MeteredDocument(_Proxy):
+    def get(self, *args, transaction=None, **kwargs):
+        snap = self._inner.get(*args, transaction=_unwrap(transaction), **kwargs)
+        self._meter.add(reads=1)
+        return snap
+
+    def set(self, *args, **kwargs):
+        result = self._inner.set(*args, **kwargs)
+        self._meter.add(writes=1)
+        return result
+
+    def update(self, *args, **kwargs):
+        result = self._inner.update(*args, **kwargs)
+        self._meter.add(writes=1)
+        return result
+
+    def delete(self, *args, **kwargs):
+        result = self._inner.delete(*args, **kwargs)
+        self._meter.add(writes=1)
+        return result
+
+    def collection(self, name):
+        return MeteredCollection(self._inner.collection(name), self._meter)
+
+
+class MeteredBatch(_Proxy):
+    def __init__(self, inner, meter):
+        super().__init__(inner, meter)
+        self._writes = 0
+
+    def set(self, reference, *args, **kwargs):
+        self._writes += 1
+        return self._inner.set(_unwrap(reference), *args, **kwargs)
+
+    def create(self, reference, *args, **kwargs):
+        self._writes += 1
+        return self._inner.create(_unwrap(reference), *args, **kwargs)
+
+    def update(self, reference, *args, **kwargs):
+        self._writes += 1
+        return self._inner.update(_unwrap(reference), *args, **kwargs)
+
+    def delete(self, reference, *args, **kwargs):
+        self._writes += 1
+        return self._inner.delete(_unwrap(reference), *args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        result = self._inner.commit(*args, **kwargs)
+        self._meter.add(writes=self._writes)
+        return result
+
+
+class MeteredTransaction(MeteredBatch):
+    # הכתיבות נשלחות ב-commit של הטרנזקציה - נספרות כשהפונקציה מסתיימת בהצלחה
+    def get_all(self, references, *args, **kwargs):
+        snaps = list(self._inner.get_all([_unwrap(r) for r in references], *args, **kwargs))
+        self._meter.add(reads=len(snaps))
+        return iter(snaps)
+
+    def get(self, ref_or_query, *args, **kwargs):
+        docs = list(self._inner.get(_unwrap(ref_or_query), *args, **kwargs))
+        self._meter.add(reads=max(len(docs), 1))
+        return iter(docs)
+
+
+class MeteredClient(_Proxy):
+    def __init__(self, inner, meter=None):
+        super().__init__(inner, meter or Meter())
+
+    @property
+    def meter(self):
+        return self._meter
+
+    def collection(self, name):
+        return MeteredCollection(self._inner.collection(name), self._meter)
+
+    def batch(self):
+        return MeteredBatch(self._inner.batch(), self._meter)
+
+    def get_all(self, references, *args, **kwargs):
+        snaps = list(self._inner.get_all([_unwrap(r) for r in references], *args, **kwargs))
+        self._meter.add(reads=len(snaps))
+        return iter(snaps)
+
+    def run_transaction(self, fn):
+        # inventory_ops.run_transaction קורא לכאן; על Firestore זו טרנזקציה עם ניסיון יחיד
+        def metered(transaction):
+            wrapped = MeteredTransaction(transaction, self._meter)
+            result = fn(wrapped)
+            self._meter.add(writes=wrapped._writes)
+            return result
+
+        local = getattr(self._inner, "run_transaction", None)
+        if local:
+            return local(metered)
+        return firestore.transactional(metered)(self._inner.transaction(max_attempts=1))
+
+
+# ==========================================
+# פרופיל לכל ריצה של Streamlit
+# ==========================================
+class RerunProfile:
+    # נפתח בתחילת הסקריפט ונסגר בסופו. ריצה שנקטעה (st.rerun / st.stop) נסגרת בתחילת
+    # הריצה הבאה עם interrupted=True, והזמן שלה נמדד עד הפנייה האחרונה שלה למסד.
+    def __init__(self, meter, **labels):
+        self._meter = meter
+        self._handle = meter.begin()
+        self.labels = labels
+        self.branch = None
+        self._start = time.perf_counter()
+        self._branch_start = None
+        self._branch_counts = None
+
+    def enter_branch(self, name):
+        self.branch = name
+        self._branch_start = time.perf_counter()
+        self._branch_counts = dict(self._handle[0])
+
+    def finish(self, interrupted=False):
+        self._meter.end(self._handle)
+        end = time.perf_counter()
+        if interrupted:
+            end = max(self._branch_start or self._start, min(end, self._meter.last_activity() or self._start))
+        counts = self._handle[0]
+        record = {
+            "ts": time.time(), **self.labels, "branch": self.branch, "interrupted": interrupted,
+            "rerun_ms": round((end - self._start) * 1000, 2), **counts,
+        }
+        if self.branch is not None:
+            record["branch_ms"] = round((end - self._branch_start) * 1000, 2)
+            record.update({f"branch_{k}": counts[k] - self._branch_counts[k] for k in COUNTERS})
+        return record
+
+
+class BranchStats:
+    # סיכום לכל התהליך לפי מסך - איפה הריצות הכי יקרות
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+
+    def add(self, record):
+        key = record.get("branch") or "-"
+        with self._lock:
+            row = self._rows.setdefault(key, {"reruns": 0, "ms": 0.0, "max_ms": 0.0, **dict.fromkeys(COUNTERS, 0)})
+            row["reruns"] += 1
+            row["ms"] += record["rerun_ms"]
+            row["max_ms"] = max(row["max_ms"], record["rerun_ms"])
+            for k in COUNTERS:
+                row[k] += record[k]
+
+    def table(self):
+        with self._lock:
+            return [
+                {"branch": key, "reruns": r["reruns"], "avg_ms": round(r["ms"] / r["reruns"], 1), "max_ms": round(r["max_ms"], 1),
+                 **{f"avg_{k}": round(r[k] / r["reruns"], 1) for k in COUNTERS}}
+                for key, r in sorted(self._rows.items(), key=lambda kv: -kv[1]["reads"])
+            ]
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
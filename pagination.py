@@ -0,0 +1,47 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# --- דפדוף בשאילתות Firestore עם סמן (start_after/limit) ---
+# כל עמוד נקרא מהסמן של העמוד הקודם, והעמוד הבא נטען ברקע מיד אחרי שעמוד מוצג,
+# כך שהזמן עד לתוצאה הראשונה לא תלוי בגודל האוסף והמעבר לעמוד הבא מיידי.
+
+PAGE_SIZES = [10, 20, 50, 100]
+PAGE_SIZE = 20
+
+_prefetch = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+
+
+class QueryPager:
+    def __init__(self, query, page_size=PAGE_SIZE, prefetch=True):
+        self._query = query
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self._pages = []
+        self._lock = threading.Lock()
+
+    def _fetch(self, after):
+        query = self._query if after is None else self._query.start_after(after)
+        return list(query.limit(self.page_size).stream())
+
+    def _submit(self, after, background):
+        if background:
+            return _prefetch.submit(self._fetch, after)
+        future = Future()
+        future.set_result(self._fetch(after))
+        return future
+
+    def page(self, n):
+        with self._lock:
+            while len(self._pages) <= n:
+                prev = self._pages[-1].result() if self._pages else None
+                if prev is not None and len(prev) < self.page_size:
+                    return []
+                self._pages.append(self._submit(prev[-1] if prev else None, False))
+            docs = self._pages[n].result()
+            if self.prefetch and len(docs) == self.page_size and len(self._pages) == n + 1:
+                self._pages.append(self._submit(docs[-1], True))
+        return docs
+
+    def has_next(self, n):
+        # עמוד מלא - ייתכן שיש עוד (העמוד הבא כבר בטעינה ברקע)
+        return len(self.page(n)) == self.page_size
@@ -0,0 +1,157 @@
+import itertools
+import time
+
+# --- מסלול ליקוט לבקשות שאושרו ---
+# הבקשות מקובצות לתחנות - תא אחד (שורה/עמודה/קומה) במחסן, עם כל השורות שנלקטות ממנו -
+# ולכל מחסן מחושב סדר ביקור מנקודת היציאה וחזרה אליה.
+# מודל המחסן: כל שורה היא מעבר, העמודות לאורכו, ומעברים חוצים בשני הקצוות. מעבר בין
+# שורות עובר דרך הקצה הקרוב (קדמי או אחורי); מעבר קומה (סולם / מלגזה) עולה FLOOR_COST.
+# פתרון: נחש (serpentine) ושכן קרוב כנקודות פתיחה - הקצר מביניהם - ואחריו שיפור 2-opt
+# עד TIME_LIMIT. מעל MAX_OPTIMIZE תחנות רק הנחש (מטריצת המרחקים ריבועית).
+
+ROW_PITCH = 3.0
+COLUMN_PITCH = 1.0
+FLOOR_COST = 2.0
+TIME_LIMIT = 1.0
+MAX_OPTIMIZE = 1500
+
+
+def _natural(label):
+    # "2" < "10"; תוויות שאינן מספר אחרי המספרים, לפי סדר האלף-בית
+    label = str(label)
+    return (0, int(label), "") if label.isdigit() else (1, 0, label)
+
+
+# ==========================================
+# תחנות
+# ==========================================
+def stops(requests, inventory):
+    # requests - [(request_id, בקשה)] לפי סדר ההגשה; inventory - {loc_id: שורה}.
+    # מחזיר ({מחסן: [תחנה]} לפי סדר ההופעה בבקשות, [request_id בלי מיקום ידוע])
+    by_wh, by_slot, missing = {}, {}, []
+    for req_id, r in requests:
+        row = inventory.get(r.get('location_id'))
+        if row is None or row.get('row') in (None, ""):
+            missing.append(req_id)
+            continue
+        wh = row.get('warehouse')
+        key = (wh, str(row.get('row')), str(row.get('column', "")), str(row.get('floor') or 1))
+        if key not in by_slot:
+            by_slot[key] = {"warehouse": wh, "row": key[1], "column": key[2], "floor": key[3], "lines": []}
+            by_wh.setdefault(wh, []).append(by_slot[key])
+        by_slot[key]["lines"].append({
+            "request_id": req_id, "location_id": r.get('location_id'), "item_name": r.get('item_name'),
+            "quantity": r.get('quantity'), "user_email": r.get('user_email')
+        })
+    return by_wh, missing
+
+
+def _coordinates(slots, layout=None):
+    # (שורה, עמודה, קומה) מספריים; נקודת היציאה (0, 0, 1) - לפני השורה הראשונה, בקצה הקדמי.
+    # סדר השורות והעמודות לפי מבנה המחסן אם הוגדר (locations.parse_layout), אחרת לפי התוויות
+    rows = sorted({s['row'] for s in slots}, key=_natural)
+    columns = list(layout['columns']) if layout else []
+    columns += sorted({s['column'] for s in slots} - set(columns), key=_natural)
+    # שורות שאינן מספר - אחרי השורה המספרית הגבוהה ביותר, בלי להתנגש במספר קיים
+    last = max((int(r) for r in rows if r.isdigit()), default=0)
+    named = [r for r in rows if not r.isdigit()]
+    row_pos = {r: int(r) for r in rows if r.isdigit()}
+    row_pos.update({r: last + i + 1 for i, r in enumerate(named)})
+    col_pos = {c: i + 1 for i, c in enumerate(columns)}
+    coords = [(0, 0, 1)] + [(row_pos[s['row']], col_pos[s['column']], int(s['floor']) if s['floor'].isdigit() else 1) for s in slots]
+    return coords, len(columns) + 1
+
+
+def _distance(a, b, back):
+    # back - מיקום המעבר החוצה האחורי (מספר העמודות + 1)
+    (r1, c1, f1), (r2, c2, f2) = a, b
+    if r1 == r2:
+        walk = COLUMN_PITCH * abs(c1 - c2)
+    else:
+        walk = ROW_PITCH * abs(r1 - r2) + COLUMN_PITCH * min(c1 + c2, 2 * back - c1 - c2)
+    return walk + FLOOR_COST * abs(f1 - f2)
+
+
+def _matrix(coords, back):
+    return [[_distance(a, b, back) for b in coords] for a in coords]
+
+
+def tour_length(tour, dist):
+    # tour - אינדקסים למטריצה, מתחיל ב-0 (נקודת היציאה); כולל את החזרה אליה
+    return sum(dist[a][b] for a, b in zip(tour, tour[1:] + tour[:1]))
+
+
+# ==========================================
+# פתרונות
+# ==========================================
+def _serpentine(coords):
+    # שורה אחרי שורה; כיוון ההליכה לאורך השורה מתחלף, וכך גם סדר הקומות בכל תא
+    order = []
+    by_row = itertools.groupby(sorted(range(1, len(coords)), key=lambda i: coords[i]), key=lambda i: coords[i][0])
+    for n, (_, idx) in enumerate(by_row):
+        idx = sorted(idx, key=lambda i: (coords[i][1], coords[i][2] * (-1 if coords[i][1] % 2 else 1)))
+        order += idx if n % 2 == 0 else idx[::-1]
+    return [0] + order
+
+
+def _nearest_neighbor(dist):
+    left = set(range(1, len(dist)))
+    tour = [0]
+    while left:
+        row = dist[tour[-1]]
+        nxt = min(left, key=row.__getitem__)
+        tour.append(nxt)
+        left.remove(nxt)
+    return tour
+
+
+def _two_opt(tour, dist, deadline):
+    # היפוך קטע [i..j] כשהוא מקצר; נקודת היציאה (אינדקס 0) קבועה. first-improvement עד שאין שיפור או עד deadline
+    n = len(tour)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(1, n - 1):
+            a, b = tour[i - 1], tour[i]
+            da, dab = dist[a], dist[a][b]
+            for j in range(i + 1, n):
+                c, d = tour[j], tour[(j + 1) % n]
+                if da[c] + dist[b][d] < dab + dist[c][d] - 1e-9:
+                    tour[i:j + 1] = tour[i:j + 1][::-1]
+                    b = tour[i]
+                    dab = da[b]
+                    improved = True
+            if time.perf_counter() > deadline:
+                break
+    return tour
+
+
+def route(slots, layout=None, time_limit=TIME_LIMIT):
+    # slots - תחנות של מחסן אחד לפי סדר הבקשות. מחזיר את התחנות בסדר הביקור, אורך המסלול
+    # ואורך המסלול לפי סדר הבקשות (baseline) - באותן יחידות מרחק
+    start = time.perf_counter()
+    coords, back = _coordinates(slots, layout)
+    baseline = list(range(len(coords)))
+    if len(slots) > MAX_OPTIMIZE:
+        tour = _serpentine(coords)
+        dist = lambda a, b: _distance(coords[a], coords[b], back)
+        length = sum(dist(a, b) for a, b in zip(tour, tour[1:] + tour[:1]))
+        base_length = sum(dist(a, b) for a, b in zip(baseline, baseline[1:] + baseline[:1]))
+        method = "serpentine"
+    else:
+        dist = _matrix(coords, back)
+        tour = min((_serpentine(coords), _nearest_neighbor(dist)), key=lambda t: tour_length(t, dist))
+        tour = _two_opt(tour, dist, start + time_limit)
+        length, base_length = tour_length(tour, dist), tour_length(baseline, dist)
+        method = "2-opt"
+    return {
+        "stops": [slots[i - 1] for i in tour[1:]], "length": length, "baseline": base_length,
+        "method": method, "elapsed": time.perf_counter() - start
+    }
+
+
+def plan(requests, inventory, layouts=None, time_limit=TIME_LIMIT):
+    # layouts - {מחסן: מבנה}; מחזיר ({מחסן: route}, [בקשות בלי מיקום])
+    by_wh, missing = stops(requests, inventory)
+    layouts = layouts or {}
+    return {wh: route(slots, layouts.get(wh), time_limit) for wh, slots in by_wh.items()}, missing
@@ -0,0 +1,189 @@
+import random
+
+from google.cloud import firestore
+
+import sites
+
+# --- סיכומי מלאי מחושבים מראש ---
+# שלוש רמות שמתעדכנות ב-Increment באותה כתיבה אטומית שמשנה כמות (דרך apply):
+#   ItemBalances/{item_id}            - סה"כ לפריט בכל המחסנים
+#   WarehouseItems/{warehouse}_{item} - סה"כ לפריט במחסן (עם site של המחסן - מלאי נמוך לפי אתר)
+#   WarehouseTotals/{warehouse}_{shard} - סה"כ למחסן, מפוצל ל-SHARDS מסמכים (גם הם עם site)
+# כך לוח הבקרה נטען בקריאות בודדות - רק של האתר הפעיל. verify משווה מול המלאי ומתקן סטיות.
+# סה"כ המחסן נכתב בכל שינוי כמות במחסן - מסמך אחד היה נעשה צוואר בקבוק (Firestore: בערך
+# כתיבה אחת לשנייה למסמך), ולכן כל כתיבה בוחרת רסיס אקראי והקריאה מסכמת את הרסיסים.
+
+BALANCES = "ItemBalances"
+WAREHOUSE_ITEMS = "WarehouseItems"
+ROLLUPS = "Rollups"
+WAREHOUSE_TOTALS = "WarehouseTotals"
+SHARDS = 10
+LOW_STOCK = 5
+BATCH_LIMIT = 500
+
+
+def warehouse_item_id(warehouse, item_id):
+    return f"{warehouse}_{item_id}"
+
+
+def _shard_ref(db, warehouse, shard=None):
+    shard = random.randrange(SHARDS) if shard is None else shard
+    return db.collection(WAREHOUSE_TOTALS).document(f"{warehouse}_{shard}")
+
+
+def _add_total(writer, db, warehouse, delta, site=None, shard=None):
+    fields = {"warehouse": warehouse, "quantity": firestore.Increment(int(delta)), "updated": firestore.SERVER_TIMESTAMP}
+    if site:
+        fields["site"] = site
+    writer.set(_shard_ref(db, warehouse, shard), fields, merge=True)
+
+
+def delta_key(row):
+    # מפתח השינוי: (מחסן, פריט, אתר) - האתר נכתב למסמך המחסן×פריט
+    return row.get('warehouse'), row.get('item_id'), row.get('site')
+
+
+def apply(writer, db, deltas):
+    # writer - transaction או batch; deltas - {(warehouse, item_id, site): שינוי}
+    per_wh_item, per_item, per_wh = {}, {}, {}
+    for (wh, item_id, site), delta in deltas.items():
+        if not delta or not item_id:
+            continue
+        # שורה ישנה בלי site לא מוחקת את האתר שכבר נכתב למסמך
+        prev_site, prev = per_wh_item.get((wh, item_id), (None, 0))
+        per_wh_item[(wh, item_id)] = (site or prev_site, prev + delta)
+    for (wh, item_id), (site, delta) in per_wh_item.items():
+        if not delta:
+            continue
+        fields = {"warehouse": wh, "item_id": item_id, "quantity": firestore.Increment(int(delta)), "updated": firestore.SERVER_TIMESTAMP}
+        if site:
+            fields["site"] = site
+        writer.set(db.collection(WAREHOUSE_ITEMS).document(warehouse_item_id(wh, item_id)), fields, merge=True)
+        per_item[item_id] = per_item.get(item_id, 0) + delta
+        prev_site, prev = per_wh.get(wh, (None, 0))
+        per_wh[wh] = (site or prev_site, prev + delta)
+    for item_id, delta in per_item.items():
+        if delta:
+            writer.set(db.collection(BALANCES).document(item_id), {
+                "quantity": firestore.Increment(int(delta)), "updated": firestore.SERVER_TIMESTAMP
+            }, merge=True)
+    for wh, (site, delta) in per_wh.items():
+        if delta:
+            _add_total(writer, db, wh, delta, site)
+
+
+def delta(row, qty):
+    return {delta_key(row): qty}
+
+
+def drop_warehouse(db, warehouse):
+    # אחרי פינוי מחסן (inventory_ops.evacuate_warehouse) הסיכומים שלו מאופסים - נמחקים
+    refs = [d.reference for name in (WAREHOUSE_ITEMS, WAREHOUSE_TOTALS)
+            for d in db.collection(name).where("warehouse", "==", warehouse).stream()]
+    for i in range(0, len(refs), BATCH_LIMIT):
+        batch = db.batch()
+        for ref in refs[i:i + BATCH_LIMIT]:
+            batch.delete(ref)
+        batch.commit()
+
+
+# ==========================================
+# קריאות ללוח הבקרה
+# ==========================================
+def warehouse_totals(db, site=None):
+    # סכום הרסיסים - SHARDS מסמכים לכל מחסן של האתר (בלי אתר - כל המחסנים)
+    totals = {}
+    for d in sites.scoped(db.collection(WAREHOUSE_TOTALS), site).stream():
+        wh = d.get('warehouse')
+        totals[wh] = totals.get(wh, 0) + (d.get('quantity') or 0)
+    return totals
+
+
+def item_total(db, item_id):
+    snap = db.collection(BALANCES).document(item_id).get()
+    return snap.get('quantity') if snap.exists else 0
+
+
+def item_by_warehouse(db, item_id):
+    return {d.get('warehouse'): d.get('quantity') for d in db.collection(WAREHOUSE_ITEMS).where("item_id", "==", item_id).stream()}
+
+
+def low_stock(db, threshold=LOW_STOCK, warehouse=None, site=None, limit=50):
+    # [(item_id, מחסן, כמות)] מהנמוך לגבוה. בלי מחסן ובלי אתר - סה"כ הפריט בכל המחסנים (מחסן None);
+    # באתר - שורות המחסן×פריט של האתר (sites.scoped)
+    if warehouse:
+        q = db.collection(WAREHOUSE_ITEMS).where("warehouse", "==", warehouse)
+    elif site not in (None, sites.ALL_SITES):
+        q = sites.scoped(db.collection(WAREHOUSE_ITEMS), site)
+    else:
+        q = db.collection(BALANCES).where("quantity", "<=", threshold).order_by("quantity").limit(limit)
+        return [(d.id, None, d.get('quantity')) for d in q.stream()]
+    q = q.where("quantity", "<=", threshold).order_by("quantity").limit(limit)
+    return [(d.get('item_id'), d.get('warehouse'), d.get('quantity')) for d in q.stream()]
+
+
+def top_items(db, warehouse, limit=20):
+    q = db.collection(WAREHOUSE_ITEMS).where("warehouse", "==", warehouse).order_by("quantity", direction=firestore.Query.DESCENDING)
+    return [(d.get('item_id'), d.get('quantity')) for d in q.limit(limit).stream()]
+
+
+# ==========================================
+# בדיקת סטייה וחישוב מחדש
+# ==========================================
+def expected(inventory):
+    # inventory - {loc_id: שורה}; הערכים הנכונים לשלוש הרמות לפי המלאי עצמו
+    by_wh_item, by_item, by_wh = {}, {}, {}
+    for row in inventory.values():
+        wh, item_id, qty = row.get('warehouse'), row.get('item_id'), row.get('quantity', 0)
+        if not item_id:
+            continue
+        prev = by_wh_item.get(warehouse_item_id(wh, item_id), (0, 0, 0, None))
+        by_wh_item[warehouse_item_id(wh, item_id)] = (wh, item_id, prev[2] + qty, row.get('site') or prev[3])
+        by_item[item_id] = by_item.get(item_id, 0) + qty
+        by_wh[wh] = by_wh.get(wh, 0) + qty
+    return by_wh_item, by_item, by_wh
+
+
+def verify(db, inventory, fix=False):
+    # מחזיר {level: [(מזהה, צפוי, בפועל)]}; עם fix=True כותב ערכים מוחלטים לכל מה שסטה.
+    # קריאה מלאה של הסיכומים - עבודת תחזוקה, לא חלק מטעינת הלוח
+    by_wh_item, by_item, by_wh = expected(inventory)
+    actual_wh_item = {d.id: d.get('quantity') for d in db.collection(WAREHOUSE_ITEMS).stream()}
+    actual_item = {d.id: d.get('quantity') for d in db.collection(BALANCES).stream()}
+    actual_wh = warehouse_totals(db)
+
+    def diff(expected_map, actual):
+        return [(key, expected_map.get(key, 0), actual.get(key, 0)) for key in sorted(set(expected_map) | set(actual), key=str)
+                if expected_map.get(key, 0) != actual.get(key, 0)]
+
+    drift = {
+        "warehouse_items": diff({k: v[2] for k, v in by_wh_item.items()}, actual_wh_item),
+        "items": diff(by_item, actual_item),
+        "warehouses": diff(by_wh, actual_wh),
+    }
+    if fix:
+        writes = []
+        for key, want, _ in drift["warehouse_items"]:
+            wh, item_id, _, site = by_wh_item.get(key, (None, None, 0, None))
+            fields = {"quantity": want, "updated": firestore.SERVER_TIMESTAMP}
+            if item_id:
+                fields.update({"warehouse": wh, "item_id": item_id})
+            if site:
+                fields["site"] = site
+            writes.append((db.collection(WAREHOUSE_ITEMS).document(key), fields))
+        for key, want, _ in drift["items"]:
+            writes.append((db.collection(BALANCES).document(key), {"quantity": want, "updated": firestore.SERVER_TIMESTAMP}))
+        # מחסן שסטה: הסה"כ נכתב ברסיס 0 והשאר מתאפסים
+        wh_sites = {row.get('warehouse'): row['site'] for row in inventory.values() if row.get('site')}
+        for wh, want, _ in drift["warehouses"]:
+            for shard in range(SHARDS):
+                fields = {"warehouse": wh, "quantity": want if shard == 0 else 0, "updated": firestore.SERVER_TIMESTAMP}
+                if wh_sites.get(wh):
+                    fields["site"] = wh_sites[wh]
+                writes.append((_shard_ref(db, wh, shard), fields))
+        for i in range(0, len(writes), BATCH_LIMIT):
+            batch = db.batch()
+            for ref, fields in writes[i:i + BATCH_LIMIT]:
+                batch.set(ref, fields, merge=True)
+            batch.commit()
+    return drift
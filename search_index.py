@@ -0,0 +1,176 @@
+import heapq
+import threading
+
+# --- אינדקס חיפוש הפוך לפי טריגרמות (3 תווים) ---
+# כל שדה מנורמל (lower/strip) ומפורק לטריגרמות, לכל רצף של 1-2 תווים (הכלה בשאילתה קצרה -
+# "12" מוצא את "SL-12" בלי לסרוק את האינדקס) ולגרמות עוגן של 1-2 התווים הראשונים לחיפוש התחלה.
+# התוצאות מדורגות בשכבות: התאמה מלאה > התחלה > הכלה, ובתוך שכבה לפי אורך השדה. עם limit
+# שכבה מדורגת ונחתכת ל-N הטובות ביותר, והשכבות הבאות נסרקות רק אם עוד חסרות תוצאות; בשאילתה
+# רחבה (אות אחת) מדורגות רק MAX_SCORED ההתאמות הראשונות של השכבה - זמן התגובה לא גדל עם הקטלוג.
+# עובד גם לעברית ולמק"ט חלקי.
+
+START = "\x02"
+MAX_SCORED = 5000
+
+
+def normalize(text):
+    return str(text or "").strip().lower()
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def short_grams(text):
+    return {text[i:i + n] for n in (1, 2) for i in range(len(text) - n + 1)}
+
+
+def grams(text):
+    if not text:
+        return set()
+    return trigrams(text) | short_grams(text) | {START + text[:1], START + text[:2]}
+
+
+class TrigramIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._fields = {}
+        self._postings = {}
+        self._exact = {}
+
+    def __len__(self):
+        return len(self._fields)
+
+    def add(self, key, *fields):
+        norm = tuple(normalize(f) for f in fields)
+        with self._lock:
+            if self._fields.get(key) == norm:
+                return
+            self.remove(key)
+            self._fields[key] = norm
+            for f in norm:
+                if f:
+                    self._exact.setdefault(f, set()).add(key)
+                for g in grams(f):
+                    self._postings.setdefault(g, set()).add(key)
+
+    def remove(self, key):
+        with self._lock:
+            norm = self._fields.pop(key, None)
+            if norm is None:
+                return
+            for f in norm:
+                for table, gs in ((self._exact, (f,) if f else ()), (self._postings, grams(f))):
+                    for g in gs:
+                        post = table.get(g)
+                        if post is not None:
+                            post.discard(key)
+                            if not post:
+                                del table[g]
+
+    def _candidates(self, q, prefix):
+        # שאילתה קצרה מטריגרמה היא בעצמה גרמה באינדקס
+        gs = trigrams(q) or {q}
+        if prefix:
+            gs.add(START + q[:2])
+        # חיתוך עצל: מעבר על הרשימה הקטנה ביותר ובדיקת שייכות לשאר
+        posts = sorted((self._postings.get(g, ()) for g in gs), key=len)
+        for key in posts[0]:
+            if all(key in p for p in posts[1:]):
+                yield key
+
+    def _match_len(self, key, q, prefix):
+        lens = [len(f) for f in self._fields[key] if (f.startswith(q) if prefix else q in f)]
+        return min(lens) if lens else None
+
+    def search(self, query, limit=None):
+        q = normalize(query)
+        if not q:
+            return []
+        results, seen = [], set()
+
+        def scored(keys, score):
+            found = 0
+            for key in keys:
+                if key in seen:
+                    continue
+                s = score(key)
+                if s is None:
+                    continue
+                seen.add(key)
+                yield s, str(key), key
+                found += 1
+                if limit is not None and found >= MAX_SCORED:
+                    return
+
+        def take(keys, score):
+            # השכבה מדורגת לפני החיתוך - עם limit נשמרות הטובות ביותר (ערימה בגודל N), לא הראשונות שנמצאו
+            tier = scored(keys, score)
+            tier = sorted(tier) if limit is None else heapq.nsmallest(limit - len(results), tier)
+            results.extend(key for _, _, key in tier)
+            return limit is not None and len(results) >= limit
+
+        with self._lock:
+            if take(self._exact.get(q, ()), lambda key: 0):
+                return results
+            if take(self._candidates(q, True), lambda key: self._match_len(key, q, True)):
+                return results
+            take(self._candidates(q, False), lambda key: self._match_len(key, q, False))
+        return results
+
+
+# --- אינדקס משותף לקטלוג ולמלאי, מתעדכן משינויי המטמון ---
+class CatalogSearch:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.items = TrigramIndex()
+        self.inventory = TrigramIndex()
+        self._catalog = {}
+        self._inventory = {}
+        self._by_item = {}
+
+    def on_change(self, name, doc_id, data):
+        with self._lock:
+            if name == "Items":
+                if data is None:
+                    self._catalog.pop(doc_id, None)
+                    self.items.remove(doc_id)
+                else:
+                    self._catalog[doc_id] = data
+                    self.items.add(doc_id, data.get('description', ''), data.get('internal_sku', ''), data.get('manufacturer_sku', ''))
+                # מק"טים מצורפים לשורות המלאי של הפריט
+                for inv_id in self._by_item.get(doc_id, ()):
+                    self._index_inventory(inv_id)
+            elif name == "Inventory":
+                old = self._inventory.pop(doc_id, None)
+                if old is not None:
+                    self._by_item.get(old.get('item_id'), set()).discard(doc_id)
+                if data is None:
+                    self.inventory.remove(doc_id)
+                else:
+                    self._inventory[doc_id] = data
+                    self._by_item.setdefault(data.get('item_id'), set()).add(doc_id)
+                    self._index_inventory(doc_id)
+
+    def _index_inventory(self, inv_id):
+        # המק"טים משוכפלים בשורה (catalog_sync); שורה שעוד לא הושלמה נשענת על הקטלוג
+        data = self._inventory[inv_id]
+        catalog_data = self._catalog.get(data.get('item_id'), {})
+        self.inventory.add(inv_id, data.get('item_name', ''), data.get('internal_sku', catalog_data.get('internal_sku', '')),
+                           data.get('manufacturer_sku', catalog_data.get('manufacturer_sku', '')))
+
+    def search_items(self, query, limit=None):
+        return self.items.search(query, limit)
+
+    def search_inventory(self, query, limit=None):
+        return self.inventory.search(query, limit)
+
+    def search_catalog_only(self, query, limit=None):
+        # פריטי קטלוג שעוד לא שויכו לאף מיקום במלאי; מגדילים את החלון עד שיש מספיק
+        window = limit
+        while True:
+            ids = self.items.search(query, window)
+            found = [i for i in ids if not self._by_item.get(i)]
+            if limit is None or len(found) >= limit or len(ids) < window:
+                return found[:limit]
+            window *= 2
@@ -0,0 +1,127 @@
+from google.cloud import firestore
+
+import bulk_ops
+
+# --- חלוקה לאתרים (חצרות) ---
+# כל מחסן שייך לאתר (Warehouses.site), וכל מסמך ב-Inventory / Requests / Logs ובסיכומי המחסן (rollups) נושא את שדה site.
+# השאילתות של משתמש מסוננות לאתר הפעיל (scoped: site ==) עם אינדקסים מורכבים שמתחילים ב-site,
+# והמטמון המשותף (SnapshotCache) מאזין רק לשורות המלאי של האתר - כל חצר קוראת רק את הנתונים שלה.
+# תצוגה חוצת אתרים (ALL_SITES - למשתמש עם הרשאה לכולם) היא אותה שאילתה בלי הסינון.
+# Users.sites - האתרים של המשתמש; משתמש בלי השדה שייך ל-DEFAULT_SITE.
+# migrate מוסיף site למסמכים קיימים בעמודים עם נקודת עצירה (Migrations/{job_id}), ו-rehome
+# מעביר מחסן לאתר אחר עם המלאי והבקשות שלו. היומן נשאר באתר שבו הפעולה נעשתה.
+
+DEFAULT_SITE = "ראשי"
+ALL_SITES = "*"
+PARTITIONED = ("Inventory", "Requests", "Logs", "WarehouseItems", "WarehouseTotals")
+# v2 - גם סיכומי המחסן (rollups) נושאים site; הסבה חוזרת כותבת רק את מה שחסר
+MIGRATION_JOB = "sites_v2"
+MIGRATION_PAGE = 400
+BATCH_LIMIT = 500
+
+
+def warehouse_sites(warehouses):
+    # warehouses - {id: מסמך מחסן}; מחזיר {שם מחסן: אתר}
+    return {w['name']: w.get('site') or DEFAULT_SITE for w in warehouses.values() if w.get('name')}
+
+
+def user_sites(user):
+    return list(user.get('sites') or [DEFAULT_SITE])
+
+
+def known_sites(warehouses, extra=()):
+    return sorted(set(warehouse_sites(warehouses).values()) | {s for s in extra if s != ALL_SITES} | {DEFAULT_SITE})
+
+
+def viewable(sites, known):
+    # known - known_sites; האתרים שהמשתמש יכול לבחור, ALL_SITES ראשון - תצוגה חוצת אתרים
+    if ALL_SITES in sites:
+        return [ALL_SITES] + list(known)
+    return list(sites)
+
+
+def home(sites):
+    # האתר שנרשם על פעולות של משתמש בתצוגה חוצת אתרים
+    return next((s for s in sites if s != ALL_SITES), DEFAULT_SITE)
+
+
+def scoped(query, site):
+    return query if site in (None, ALL_SITES) else query.where("site", "==", site)
+
+
+# ==========================================
+# הסבת נתונים קיימים
+# ==========================================
+def _site_for(name, doc, wh_sites, log_sites):
+    if name == "Logs":
+        return log_sites.get(doc.get('user'), DEFAULT_SITE)
+    return wh_sites.get(doc.get('warehouse'), DEFAULT_SITE)
+
+
+def migrate(db, job_id=MIGRATION_JOB, page_size=MIGRATION_PAGE, progress=None):
+    # מוסיף / מתקן site בכל מסמכי PARTITIONED לפי המחסן (ביומן - לפי האתר היחיד של המשתמש).
+    # נקודת העצירה נכתבת באותו batch של העמוד, ולכן הרצה חוזרת ממשיכה מאותו מקום;
+    # נכתבים רק מסמכים שהאתר שלהם שונה - גם הרצה כפולה לא משנה דבר
+    job_ref = db.collection("Migrations").document(job_id)
+    job = job_ref.get()
+    state = job.to_dict() if job.exists else {}
+    if state.get('done'):
+        return {"updated": state.get('updated', 0)}
+
+    warehouses = {d.id: d.to_dict() for d in db.collection("Warehouses").stream()}
+    missing = [w_id for w_id, w in warehouses.items() if not w.get('site')]
+    for i in range(0, len(missing), BATCH_LIMIT):
+        batch = db.batch()
+        for w_id in missing[i:i + BATCH_LIMIT]:
+            batch.update(db.collection("Warehouses").document(w_id), {"site": DEFAULT_SITE})
+        batch.commit()
+    wh_sites = warehouse_sites(warehouses)
+    log_sites = {}
+    for u in db.collection("Users").stream():
+        own = [s for s in u.to_dict().get('sites') or [] if s != ALL_SITES]
+        if len(own) == 1:
+            log_sites[u.id] = own[0]
+
+    updated = state.get('updated', 0)
+    start = PARTITIONED.index(state['collection']) if state.get('collection') in PARTITIONED else 0
+    for name in PARTITIONED[start:]:
+        base = db.collection(name)
+        last = None
+        if state.get('collection') == name and state.get('last_id'):
+            last = base.document(state['last_id']).get()
+            # נקודת העצירה נמחקה - האוסף נסרק מההתחלה (בטוח, רק מסמכים שונים נכתבים)
+            last = last if last.exists else None
+        while True:
+            page = list((base if last is None else base.start_after(last)).limit(page_size).stream())
+            batch = db.batch()
+            for d in page:
+                site = _site_for(name, d.to_dict(), wh_sites, log_sites)
+                if d.to_dict().get('site') != site:
+                    batch.update(d.reference, {"site": site})
+                    updated += 1
+            batch.set(job_ref, {
+                "collection": name, "last_id": page[-1].id if page else None, "updated": updated,
+                "updated_at": firestore.SERVER_TIMESTAMP
+            }, merge=True)
+            batch.commit()
+            if progress:
+                progress(name, updated)
+            if len(page) < page_size:
+                break
+            last = page[-1]
+    job_ref.set({"done": True, "updated": updated, "updated_at": firestore.SERVER_TIMESTAMP}, merge=True)
+    return {"updated": updated}
+
+
+def rehome(db, warehouse_id, warehouse, site, progress=None):
+    # מעביר מחסן לאתר אחר: המחסן, שורות המלאי, הבקשות והסיכומים שלו (ב-bulk_ops - נתחים מקבילים, ניתן להמשך).
+    # מחזיר {collection: {doc_id: {"site": site}}} לעדכון המטמון
+    moved = {}
+    for name in ("Inventory", "Requests", "WarehouseItems", "WarehouseTotals"):
+        updates = {d.id: {"site": site} for d in db.collection(name).where("warehouse", "==", warehouse).stream()
+                   if d.to_dict().get('site') != site}
+        if updates:
+            bulk_ops.apply_updates(db, name, updates, bulk_ops.job_key(f"rehome_{warehouse_id}_{site}_{name}", updates), progress)
+        moved[name] = updates
+    db.collection("Warehouses").document(warehouse_id).update({"site": site})
+    return moved
@@ -0,0 +1,102 @@
+import threading
+
+# --- מטמון תמונת מצב משותף לכל התהליך ---
+# מאזיני on_snapshot של Firestore מחילים רק את השינויים (deltas) על עותק בזיכרון,
+# כך שכל ריצה מחדש של Streamlit קוראת מהזיכרון במקום להזרים את כל האוסף.
+# המילונים המוחזרים הם לקריאה בלבד - כל עדכון מחליף את המילון כולו (copy-on-write).
+# site - מטמון של אתר אחד (sites.py): אוספי SITE_COLLECTIONS נטענים רק עם site == האתר.
+
+CACHED_COLLECTIONS = ("Items", "Inventory", "Warehouses")
+SITE_COLLECTIONS = ("Inventory",)
+
+
+class SnapshotCache:
+    def __init__(self, db, collections=CACHED_COLLECTIONS, ready_timeout=10, site=None):
+        self._db = db
+        self.site = site
+        self._lock = threading.RLock()
+        self._docs = {name: {} for name in collections}
+        self._ready = {name: threading.Event() for name in collections}
+        self._subscribers = []
+        self.ready_timeout = ready_timeout
+        self.stats = {"reads": 0, "deltas": 0, "hits": 0, "misses": 0}
+        self._watches = [self._source(name).on_snapshot(self._listener(name)) for name in collections]
+
+    def _source(self, name):
+        if self.site is not None and name in SITE_COLLECTIONS:
+            return self._db.collection(name).where("site", "==", self.site)
+        return self._db.collection(name)
+
+    def _listener(self, name):
+        def on_snapshot(docs, changes, read_time):
+            with self._lock:
+                updated = dict(self._docs[name])
+                for change in changes:
+                    doc = change.document
+                    if change.type.name == "REMOVED":
+                        updated.pop(doc.id, None)
+                        data = None
+                    else:
+                        data = doc.to_dict()
+                        updated[doc.id] = data
+                    self.stats["reads"] += 1
+                    self.stats["deltas"] += 1
+                    self._notify(name, doc.id, data)
+                self._docs[name] = updated
+            self._ready[name].set()
+        return on_snapshot
+
+    def _notify(self, name, doc_id, data):
+        for fn in self._subscribers:
+            fn(name, doc_id, data)
+
+    def subscribe(self, fn):
+        # מנוי חדש מקבל קודם את כל המצב הקיים ואחר כך כל שינוי - fn(collection, doc_id, data|None)
+        with self._lock:
+            self._subscribers.append(fn)
+            for name, docs in self._docs.items():
+                for doc_id, data in docs.items():
+                    fn(name, doc_id, data)
+
+    def get(self, name):
+        if self._ready[name].is_set() or self._ready[name].wait(self.ready_timeout):
+            self.stats["hits"] += 1
+            return self._docs[name]
+        # המאזין עוד לא סיים טעינה ראשונית - קריאה ישירה (ללא שמירה, המאזין ימלא בהמשך)
+        self.stats["misses"] += 1
+        docs = {d.id: d.to_dict() for d in self._source(name).stream()}
+        self.stats["reads"] += len(docs)
+        return docs
+
+    # --- כתיבה-דרך: עדכון מקומי מיידי אחרי כתיבה שלנו, המאזין יאשר בהמשך ---
+    def put(self, name, doc_id, data):
+        self.put_many(name, [(doc_id, data)])
+
+    def put_many(self, name, docs):
+        with self._lock:
+            updated = dict(self._docs[name])
+            for doc_id, data in docs:
+                updated[doc_id] = data
+                self._notify(name, doc_id, data)
+            self._docs[name] = updated
+
+    def merge(self, name, doc_id, fields):
+        self.merge_many(name, {doc_id: fields})
+
+    def merge_many(self, name, updates):
+        # updates - {doc_id: שדות}; עותק אחד של האוסף לכל הקבוצה
+        with self._lock:
+            docs = self._docs[name]
+            self.put_many(name, [(doc_id, {**docs[doc_id], **fields}) for doc_id, fields in updates.items() if doc_id in docs])
+
+    def drop(self, name, doc_id):
+        with self._lock:
+            if doc_id in self._docs[name]:
+                updated = dict(self._docs[name])
+                del updated[doc_id]
+                self._docs[name] = updated
+                self._notify(name, doc_id, None)
+
+    def close(self):
+        for watch in self._watches:
+            watch.unsubscribe()
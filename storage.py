@@ -0,0 +1,541 @@
+import copy
+import datetime
+import functools
+import json
+import sqlite3
+import threading
+import uuid
+from types import SimpleNamespace
+
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.watch import ChangeType
+
+# --- מנועי אחסון מקומיים ---
+# מממשים את אותו חלק מממשק הלקוח של Firestore שהאפליקציה משתמשת בו (collection,
+# document, where/order_by/limit/start_after, batch, count, on_snapshot, get_all),
+# כך שאותו קוד רץ בלי רשת - בזיכרון או מעל SQLite עם אינדקסים - לצורך פיתוח,
+# בדיקות עומס והשוואת זמני פעולות בין מנועים.
+# טרנזקציות: הלקוח המקומי מספק run_transaction (נעילה גלובלית), ו-inventory_ops
+# משתמש בו במקום firestore.transactional.
+
+BACKENDS = ("firestore", "memory", "sqlite")
+
+# שדות שמקבלים אינדקס ב-SQLite - כל השדות שעליהם יש where/order_by באפליקציה
+SQLITE_INDEXED_FIELDS = ("status", "warehouse", "item_id", "quantity", "timestamp", "user", "action", "internal_sku", "location_id", "site")
+
+_TYPE_RANK = {type(None): 0, bool: 1, int: 2, float: 2, datetime.datetime: 3, str: 4, bytes: 5, list: 6, dict: 7}
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _norm(value):
+    # כמו Firestore: datetime בלי אזור זמן נשמר כ-UTC
+    if isinstance(value, datetime.datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    if isinstance(value, dict):
+        return {k: _norm(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_norm(v) for v in value]
+    return value
+
+
+def _get_path(data, path):
+    for part in path.split("."):
+        if not isinstance(data, dict) or part not in data:
+            raise KeyError(path)
+        data = data[part]
+    return data
+
+
+def _resolve(value, old):
+    if isinstance(value, transforms.Increment):
+        return (old if isinstance(old, (int, float)) and not isinstance(old, bool) else 0) + value.value
+    if isinstance(value, transforms.ArrayUnion):
+        arr = list(old) if isinstance(old, list) else []
+        return arr + [v for v in value.values if v not in arr]
+    if isinstance(value, transforms.ArrayRemove):
+        return [v for v in (old if isinstance(old, list) else []) if v not in value.values]
+    if value is transforms.SERVER_TIMESTAMP:
+        return _now()
+    return _norm(copy.deepcopy(value))
+
+
+def _assign(target, key, value):
+    if value is transforms.DELETE_FIELD:
+        target.pop(key, None)
+    else:
+        target[key] = _resolve(value, target.get(key))
+
+
+def _merge_into(target, data):
+    for key, value in data.items():
+        if isinstance(value, dict):
+            # מפה מקוננת נבנית שדה-שדה, כך ש-Increment בתוכה מתפרש גם כשהמפה עוד לא קיימת
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            _merge_into(target[key], value)
+        else:
+            _assign(target, key, value)
+
+
+def _apply_write(current, op, data, merge):
+    if op == "delete":
+        return None
+    if op == "update":
+        new = copy.deepcopy(current)
+        for path, value in data.items():
+            *parents, last = path.split(".")
+            node = new
+            for part in parents:
+                node = node.setdefault(part, {})
+            _assign(node, last, value)
+        return new
+    new = copy.deepcopy(current) if merge and current is not None else {}
+    _merge_into(new, data)
+    return new
+
+
+def _compare(a, b):
+    ra, rb = _TYPE_RANK.get(type(a), 8), _TYPE_RANK.get(type(b), 8)
+    if ra != rb:
+        return -1 if ra < rb else 1
+    try:
+        return -1 if a < b else (1 if a > b else 0)
+    except TypeError:
+        return 0
+
+
+_OPS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "in": lambda a, b: a in b,
+    "not-in": lambda a, b: a not in b,
+    "array_contains": lambda a, b: isinstance(a, list) and b in a,
+}
+
+
+def _matches(data, filters):
+    for field, op, value in filters:
+        try:
+            if not _OPS[op](_get_path(data, field), value):
+                return False
+        except (KeyError, TypeError):
+            return False
+    return True
+
+
+def _order_docs(docs, orders, after=None):
+    # docs - [(id, data)]; כמו Firestore: מסמך בלי שדה המיון לא מוחזר, ושובר שוויון לפי מזהה
+    def key(doc):
+        return [_get_path(doc[1], f) for f, _ in orders] + [doc[0]]
+
+    def cmp(a, b):
+        last_dir = orders[-1][1] if orders else "ASCENDING"
+        for (va, vb), direction in zip(zip(a, b), [d for _, d in orders] + [last_dir]):
+            c = _compare(va, vb)
+            if c:
+                return -c if direction == "DESCENDING" else c
+        return 0
+
+    keyed = []
+    for doc in docs:
+        try:
+            keyed.append((key(doc), doc))
+        except KeyError:
+            continue
+    keyed.sort(key=functools.cmp_to_key(lambda x, y: cmp(x[0], y[0])))
+    if after is not None:
+        after_key = key((after.id, after._data))
+        keyed = [k for k in keyed if cmp(k[0], after_key) > 0]
+    return [doc for _, doc in keyed]
+
+
+# ==========================================
+# אובייקטים בממשק של Firestore
+# ==========================================
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self.exists else None
+
+    def get(self, field):
+        return copy.deepcopy(_get_path(self._data, field))
+
+
+class DocumentReference:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self._collection = collection
+        self.id = doc_id
+        self.path = f"{collection}/{doc_id}"
+
+    def get(self, transaction=None):
+        return self._client._get(self)
+
+    def _write(self, op, data=None, merge=False):
+        batch = self._client.batch()
+        batch._writes.append((op, self, data, merge))
+        return batch.commit()[0]
+
+    def set(self, data, merge=False):
+        return self._write("set", data, merge)
+
+    def update(self, data):
+        return self._write("update", data)
+
+    def delete(self):
+        return self._write("delete").update_time
+
+
+class Query:
+    def __init__(self, client, collection, filters=(), orders=(), limit=None, after=None):
+        self._client = client
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._after = after
+
+    def _copy(self, **changes):
+        args = dict(filters=self._filters, orders=self._orders, limit=self._limit, after=self._after)
+        args.update(changes)
+        return Query(self._client, self._collection, **args)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + ((field, op, _norm(value)),))
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        return self._copy(after=snapshot)
+
+    def stream(self, transaction=None):
+        return iter(self._client._run_query(self))
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        # מאזין לשאילתה - רק where; מסמך שיוצא מהסינון מגיע כ-REMOVED ומסמך שנכנס כ-ADDED
+        return self._client._watch(self, callback)
+
+    def count(self):
+        query = self
+
+        class _Count:
+            def get(self):
+                return [[SimpleNamespace(alias="count", value=query._client._count(query))]]
+        return _Count()
+
+
+class CollectionReference(Query):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+        self.id = name
+
+    def document(self, doc_id=None):
+        return DocumentReference(self._client, self._collection, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        ref = self.document()
+        result = ref.set(data)
+        return result.update_time, ref
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(("set", reference, data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(("update", reference, data, False))
+
+    def create(self, reference, data):
+        # כמו ב-Firestore: נכשל (וכל ה-batch איתו) אם המסמך כבר קיים
+        self._writes.append(("create", reference, data, False))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference, None, False))
+
+    def commit(self):
+        return self._client._commit(self._writes)
+
+
+class Transaction(WriteBatch):
+    def get_all(self, references):
+        return iter(self._client.get_all(references))
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, DocumentReference):
+            return iter([self._client._get(ref_or_query)])
+        return ref_or_query.stream()
+
+
+class _Watch:
+    def __init__(self, client, entry):
+        self._client = client
+        self._entry = entry
+
+    def unsubscribe(self):
+        with self._client._lock:
+            if self._entry in self._client._watchers:
+                self._client._watchers.remove(self._entry)
+
+
+# ==========================================
+# בסיס משותף למנועים המקומיים
+# ==========================================
+class _LocalClient:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._watchers = []
+
+    # --- ממשק הלקוח ---
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def get_all(self, references):
+        with self._lock:
+            return [self._get(ref) for ref in references]
+
+    def run_transaction(self, fn):
+        # נעילה גלובלית - טרנזקציות רצות בזו אחר זו ולכן אין התנגשויות
+        with self._lock:
+            transaction = Transaction(self)
+            result = fn(transaction)
+            transaction.commit()
+            return result
+
+    def close(self):
+        pass
+
+    # --- מימוש ---
+    def _get(self, ref):
+        with self._lock:
+            return DocumentSnapshot(ref, self._load(ref._collection, ref.id))
+
+    def _snapshots(self, collection, docs):
+        return [DocumentSnapshot(DocumentReference(self, collection, doc_id), data) for doc_id, data in docs]
+
+    def _commit(self, writes):
+        update_time = _now()
+        changes = []
+        with self._lock:
+            staged = {}
+            for op, ref, data, merge in writes:
+                key = (ref._collection, ref.id)
+                current = staged[key][1] if key in staged else self._load(*key)
+                if op == "update" and current is None:
+                    raise exceptions.NotFound(f"No document to update: {ref.path}")
+                if op == "create" and current is not None:
+                    raise exceptions.AlreadyExists(f"Document already exists: {ref.path}")
+                before = staged[key][0] if key in staged else current
+                staged[key] = (before, _apply_write(current, op, data, merge))
+            self._store_many([(key, new) for key, (_, new) in staged.items()])
+            for (collection, doc_id), (before, new) in staged.items():
+                if before is not None or new is not None:
+                    changes.append((collection, doc_id, before, new))
+            watchers = list(self._watchers)
+        for query, callback in watchers:
+            relevant = []
+            for collection, doc_id, before, new in changes:
+                if collection != query._collection:
+                    continue
+                was = before is not None and _matches(before, query._filters)
+                now = new is not None and _matches(new, query._filters)
+                if was or now:
+                    kind = ChangeType.MODIFIED if was and now else (ChangeType.ADDED if now else ChangeType.REMOVED)
+                    relevant.append(SimpleNamespace(type=kind, document=DocumentSnapshot(DocumentReference(self, collection, doc_id), new if now else before)))
+            if relevant:
+                callback([], relevant, update_time)
+        return [SimpleNamespace(update_time=update_time) for _ in writes]
+
+    def _watch(self, query, callback):
+        with self._lock:
+            entry = (query, callback)
+            self._watchers.append(entry)
+            snaps = self._run_query(query._copy(orders=(), limit=None, after=None))
+        callback(snaps, [SimpleNamespace(type=ChangeType.ADDED, document=s) for s in snaps], _now())
+        return _Watch(self, entry)
+
+    def _count(self, query):
+        return len(self._run_query(query._copy(limit=None, after=None)))
+
+
+class MemoryClient(_LocalClient):
+    def __init__(self):
+        super().__init__()
+        self._data = {}
+
+    def _load(self, collection, doc_id):
+        return self._data.get(collection, {}).get(doc_id)
+
+    def _store_many(self, docs):
+        for (collection, doc_id), data in docs:
+            if data is None:
+                self._data.get(collection, {}).pop(doc_id, None)
+            else:
+                self._data.setdefault(collection, {})[doc_id] = data
+
+    def _run_query(self, query):
+        with self._lock:
+            docs = [(i, d) for i, d in self._data.get(query._collection, {}).items() if _matches(d, query._filters)]
+            docs = _order_docs(docs, query._orders, query._after)
+            if query._limit is not None:
+                docs = docs[:query._limit]
+            # עותק עמוק - כמו קריאה מהשרת, שינוי בתוצאה לא משנה את המאגר
+            return self._snapshots(query._collection, [(i, copy.deepcopy(d)) for i, d in docs])
+
+    def _count(self, query):
+        with self._lock:
+            docs = self._data.get(query._collection, {}).values()
+            if not query._orders:
+                return sum(1 for d in docs if _matches(d, query._filters))
+        return super()._count(query)
+
+
+# ==========================================
+# SQLite - מסמכים כ-JSON עם אינדקסים על ביטויי json_extract
+# ==========================================
+_TS_TAG = "\x01ts:"
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return _TS_TAG + _norm(value).astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, str) and value.startswith(_TS_TAG):
+        return datetime.datetime.strptime(value[len(_TS_TAG):], "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=datetime.timezone.utc)
+    if isinstance(value, dict):
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def _sql_param(value):
+    value = _encode(value)
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def _field_expr(field):
+    return f"json_extract(data, '$.{field}')"
+
+
+class SQLiteClient(_LocalClient):
+    _SQL_OPS = {"==": "=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+
+    def __init__(self, path=":memory:"):
+        super().__init__()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS docs (collection TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (collection, id))")
+        for field in SQLITE_INDEXED_FIELDS:
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{field} ON docs (collection, {_field_expr(field)})")
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def _load(self, collection, doc_id):
+        row = self._conn.execute("SELECT data FROM docs WHERE collection = ? AND id = ?", (collection, doc_id)).fetchone()
+        return _decode(json.loads(row[0])) if row else None
+
+    def _store_many(self, docs):
+        with self._conn:
+            for (collection, doc_id), data in docs:
+                if data is None:
+                    self._conn.execute("DELETE FROM docs WHERE collection = ? AND id = ?", (collection, doc_id))
+                else:
+                    self._conn.execute("INSERT OR REPLACE INTO docs (collection, id, data) VALUES (?, ?, ?)",
+                                       (collection, doc_id, json.dumps(_encode(data), ensure_ascii=False)))
+
+    def _where_sql(self, query):
+        # מסננים שניתנים לתרגום רצים ב-SQL (עם האינדקסים), השאר נבדקים בפייתון
+        clauses, params, rest = ["collection = ?"], [query._collection], []
+        for field, op, value in query._filters:
+            if op in self._SQL_OPS and value is not None and not isinstance(value, (list, dict)):
+                clauses.append(f"{_field_expr(field)} {self._SQL_OPS[op]} ?")
+                params.append(_sql_param(value))
+            elif op == "in" and value and all(not isinstance(v, (list, dict)) for v in value):
+                clauses.append(f"{_field_expr(field)} IN ({', '.join('?' * len(value))})")
+                params.extend(_sql_param(v) for v in value)
+            else:
+                rest.append((field, op, value))
+        return clauses, params, rest
+
+    def _run_query(self, query):
+        with self._lock:
+            clauses, params, rest = self._where_sql(query)
+            sql_order = len(query._orders) <= 1 and not rest
+            sql = f"SELECT id, data FROM docs WHERE {' AND '.join(clauses)}"
+            if sql_order:
+                field, direction = query._orders[0] if query._orders else (None, "ASCENDING")
+                desc = " DESC" if direction == "DESCENDING" else ""
+                if field:
+                    sql += f" AND {_field_expr(field)} IS NOT NULL"
+                if query._after is not None:
+                    cmp = "<" if desc else ">"
+                    if field:
+                        value = _sql_param(_get_path(query._after._data, field))
+                        sql += f" AND ({_field_expr(field)} {cmp} ? OR ({_field_expr(field)} = ? AND id {cmp} ?))"
+                        params += [value, value, query._after.id]
+                    else:
+                        sql += f" AND id {cmp} ?"
+                        params.append(query._after.id)
+                sql += f" ORDER BY {_field_expr(field) + desc + ', ' if field else ''}id{desc}"
+                if query._limit is not None:
+                    sql += " LIMIT ?"
+                    params.append(query._limit)
+            docs = [(doc_id, _decode(json.loads(data))) for doc_id, data in self._conn.execute(sql, params)]
+            if not sql_order:
+                docs = _order_docs([d for d in docs if _matches(d[1], rest)], query._orders, query._after)
+                if query._limit is not None:
+                    docs = docs[:query._limit]
+            return self._snapshots(query._collection, docs)
+
+    def _count(self, query):
+        with self._lock:
+            clauses, params, rest = self._where_sql(query)
+            if rest:
+                return super()._count(query)
+            return self._conn.execute(f"SELECT COUNT(*) FROM docs WHERE {' AND '.join(clauses)}", params).fetchone()[0]
+
+
+def open_backend(name, sqlite_path="warehouse.db"):
+    if name == "memory":
+        return MemoryClient()
+    if name == "sqlite":
+        return SQLiteClient(sqlite_path)
+    raise ValueError(f"unknown storage backend: {name}")
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# המודולים יושבים בשורש המאגר, לא בחבילה
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage
+
+
+@pytest.fixture
+def db():
+    client = storage.MemoryClient()
+    yield client
+    client.close()
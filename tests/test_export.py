@@ -0,0 +1,52 @@
+import os
+import time
+
+import export
+
+
+def _age(path, seconds):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_exports_are_written_to_the_private_directory():
+    path, stats = export.write_csv(iter([{"a": 1}, {"a": 2}]), ["a"])
+    assert os.path.dirname(path) == export.export_dir()
+    assert stats["rows"] == 2
+    os.remove(path)
+
+
+def test_cleanup_removes_only_old_files():
+    old, _ = export.write_csv(iter([]), ["a"])
+    fresh, _ = export.write_csv(iter([]), ["a"])
+    _age(old, export.EXPORT_TTL + 60)
+    assert export.cleanup() == 1
+    assert not os.path.exists(old) and os.path.exists(fresh)
+    os.remove(fresh)
+
+
+def test_cleanup_skips_an_export_in_progress():
+    seen = {}
+
+    def rows():
+        yield {"a": 1}
+        (path,) = [os.path.join(export.export_dir(), name) for name in os.listdir(export.export_dir())]
+        _age(path, export.EXPORT_TTL + 60)
+        seen["removed"] = export.cleanup()
+        yield {"a": 2}
+
+    path, _ = export.write_csv(rows(), ["a"])
+    assert seen["removed"] == 0 and os.path.exists(path)
+    os.remove(path)
+
+
+def test_failed_export_leaves_no_file():
+    def rows():
+        yield {"a": 1}
+        raise RuntimeError("query failed")
+
+    try:
+        export.write_csv(rows(), ["a"])
+    except RuntimeError:
+        pass
+    assert os.listdir(export.export_dir()) == []
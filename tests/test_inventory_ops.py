@@ -0,0 +1,83 @@
+import inventory_ops
+import ledger
+import locations
+import rollups
+
+
+def _row(i, warehouse="A"):
+    return {"item_id": f"i{i}", "warehouse": warehouse, "row": str(i % 7 + 1), "column": "c", "floor": "1",
+            "site": "north", "item_name": f"item {i}"}
+
+
+def _loc(row):
+    return inventory_ops.location_id(row, row['item_id'])
+
+
+def _inventory(db):
+    return {d.id: d.to_dict() for d in db.collection("Inventory").stream()}
+
+
+def _no_drift(db):
+    inv = _inventory(db)
+    assert rollups.verify(db, inv) == {"warehouse_items": [], "items": [], "warehouses": []}
+    assert locations.verify(db, inv) == []
+
+
+def _request(db, req_id, row, qty):
+    db.collection("Requests").document(req_id).set({
+        "location_id": _loc(row), "item_id": row['item_id'], "warehouse": row['warehouse'], "site": row['site'],
+        "quantity": qty, "status": "pending", "user_email": "u@x", "item_name": row['item_name']
+    })
+
+
+def test_add_stock_replay_with_op_id_counts_once(db):
+    row = _row(1)
+    inventory_ops.add_stock(db, _loc(row), 4, new_row=row, op_id="op1")
+    inventory_ops.add_stock(db, _loc(row), 4, new_row=row, op_id="op1")
+    assert db.collection("Inventory").document(_loc(row)).get().get('quantity') == 4
+    assert len(list(db.collection(ledger.MOVEMENTS).stream())) == 1
+    _no_drift(db)
+
+
+def test_approve_replay_with_op_id_returns_quantity_without_pulling_again(db):
+    row = _row(1)
+    inventory_ops.add_stock(db, _loc(row), 10, new_row=row)
+    _request(db, "r1", row, 3)
+    assert inventory_ops.approve_request(db, "r1", _loc(row), op_id="op1") == 7
+    assert inventory_ops.approve_request(db, "r1", _loc(row), op_id="op1") == 7
+    assert db.collection("Inventory").document(_loc(row)).get().get('quantity') == 7
+    _no_drift(db)
+
+
+def test_bulk_chunks_stay_within_the_write_budget():
+    requests = [(f"r{i}", {"location_id": f"L{i % 40}"}) for i in range(1000)]
+    chunks = inventory_ops._bulk_chunks(requests)
+    assert sorted(req_id for chunk in chunks for _, ids in chunk for req_id in ids) == sorted(r for r, _ in requests)
+    for chunk in chunks:
+        cost = sum(inventory_ops.WRITES_PER_LOCATION + inventory_ops.WRITES_PER_REQUEST * len(ids) for _, ids in chunk)
+        assert cost <= inventory_ops.BULK_WRITES
+
+
+def test_decide_requests_across_many_locations_keeps_rollups_in_step(db):
+    requests = []
+    for i in range(300):
+        row = _row(i, warehouse=f"W{i % 50}")
+        inventory_ops.add_stock(db, _loc(row), 5, new_row=row)
+        _request(db, f"r{i}", row, 1)
+        requests.append((f"r{i}", db.collection("Requests").document(f"r{i}").get().to_dict()))
+    out = inventory_ops.decide_requests(db, requests, True, lambda action, details: {"action": action, "details": details})
+    assert len(out["done"]) == 300 and not out["skipped"]
+    assert all(q == 4 for q in out["quantities"].values())
+    _no_drift(db)
+
+
+def test_decide_requests_skips_what_the_location_cannot_cover(db):
+    row = _row(1)
+    inventory_ops.add_stock(db, _loc(row), 5, new_row=row)
+    for i, qty in enumerate((3, 3, 2)):
+        _request(db, f"r{i}", row, qty)
+    requests = [(f"r{i}", db.collection("Requests").document(f"r{i}").get().to_dict()) for i in range(3)]
+    out = inventory_ops.decide_requests(db, requests, True, lambda action, details: {"action": action})
+    assert out["done"] == ["r0", "r2"]
+    assert [req_id for req_id, _ in out["skipped"]] == ["r1"]
+    assert out["quantities"] == {_loc(row): 0}
@@ -0,0 +1,21 @@
+import pick_route
+
+
+def _slots(*rows):
+    return [{"row": r, "column": "A", "floor": "1"} for r in rows]
+
+
+def test_non_numeric_rows_go_after_the_highest_numeric_row():
+    coords, _ = pick_route._coordinates(_slots("1", "50", "A", "B"))
+    assert [c[0] for c in coords[1:]] == [1, 50, 51, 52]
+
+
+def test_non_numeric_rows_only():
+    coords, _ = pick_route._coordinates(_slots("B", "A"))
+    assert [c[0] for c in coords[1:]] == [2, 1]
+
+
+def test_numeric_rows_keep_their_number():
+    coords, back = pick_route._coordinates(_slots("3", "10"))
+    assert [c[0] for c in coords[1:]] == [3, 10]
+    assert back == 2
@@ -0,0 +1,42 @@
+from search_index import MAX_SCORED, TrigramIndex
+
+
+def _index(**docs):
+    index = TrigramIndex()
+    for key, fields in docs.items():
+        index.add(key, *fields)
+    return index
+
+
+def test_tiers_rank_exact_then_prefix_then_contains():
+    index = _index(contains=("big sleeve",), prefix=("sleeve 10",), exact=("sleeve",))
+    assert index.search("Sleeve") == ["exact", "prefix", "contains"]
+
+
+def test_shorter_field_ranks_first_within_a_tier():
+    index = _index(long=("pipe sleeve long",), short=("pipe sl",))
+    assert index.search("pipe") == ["short", "long"]
+
+
+def test_limit_keeps_the_best_matches_not_the_first_found():
+    index = _index(**{f"k{i}": (f"sleeve model number {i}",) for i in range(500)}, best=("sleeve",))
+    index.add("second", "sleeve 1")
+    assert index.search("sleeve", limit=2) == ["best", "second"]
+
+
+def test_short_query_matches_substrings():
+    index = _index(sku=("SL-12",), other=("SL-34",))
+    assert index.search("12") == ["sku"]
+    assert index.search("l-") == ["other", "sku"]
+
+
+def test_limit_bounds_scoring_of_broad_queries():
+    index = _index(**{f"k{i}": (f"e{i}",) for i in range(MAX_SCORED * 2)})
+    assert len(index.search("e", limit=5)) == 5
+
+
+def test_removed_keys_are_not_found():
+    index = _index(a=("sleeve",), b=("sleeves",))
+    index.remove("a")
+    assert index.search("sle") == ["b"]
+    assert index.search("ee") == ["b"]
@@ -0,0 +1,178 @@
+import atexit
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from google.api_core import exceptions
+
+import inventory_ops
+
+# --- תור כתיבות מקומי לעבודה בלי רשת (outbox) ---
+# פעולה שנכשלה בגלל תקשורת נשמרת בקובץ SQLite מקומי עם מפתח idempotency, ותהליכון רקע
+# שולח את הפעולות מחדש לפי סדר ההכנסה כשהרשת חוזרת. המפתח נכתב בשרת כמזהה התנועה /
+# הבקשה ונבדק בשרת (inventory_ops, op_id - בטרנזקציה, ובקליטה ב-create של רשומת התנועה), כך ששליחה חוזרת של פעולה שכבר נכתבה
+# (האישור מהשרת אבד בדרך) לא מכפילה אותה. כל עוד יש פעולות ממתינות, פעולה חדשה נכנסת
+# אחריהן - הסדר נשמר. שגיאה עסקית (אין מספיק מלאי) בשליחה חוזרת מסמנת את הפעולה ככושלת
+# ומוצגת למשתמש; היא לא חוסמת את שאר התור.
+
+QUEUE_PATH = "outbox.db"
+RETRY_INTERVAL = 5.0
+MAX_BACKOFF = 60.0
+
+# רק שגיאות תקשורת מכניסות לתור; כל שגיאה אחרת עולה למשתמש כמו קודם
+NETWORK_ERRORS = (
+    exceptions.ServiceUnavailable, exceptions.DeadlineExceeded, exceptions.GatewayTimeout,
+    exceptions.InternalServerError, exceptions.RetryError, ConnectionError, TimeoutError
+)
+# עומס זמני על אותם מסמכים - הפעולה נשארת בתור ונשלחת שוב בסבב הבא, לא מסומנת ככושלת
+RETRYABLE_ERRORS = (inventory_ops.ContentionError, exceptions.Aborted)
+
+
+# ==========================================
+# הפעולות - fn(db, key, created, payload); payload הוא JSON
+# ==========================================
+def _request(db, key, created, p):
+    # זמן הבקשה הוא זמן הלחיצה, לא זמן השליחה - הסדר בתור האישורים נשמר
+    inventory_ops.create_request(db, {**p, "timestamp": datetime.fromtimestamp(created)}, request_id=key)
+
+
+def _cart(db, key, created, p):
+    # key הוא מזהה העגלה - ממנו נגזרים מזהי הבקשות
+    return inventory_ops.submit_cart(db, p['lines'], {**p['request'], "timestamp": datetime.fromtimestamp(created)}, cart_id=key)
+
+
+def _add_stock(db, key, created, p):
+    inventory_ops.add_stock(db, p['loc_id'], p['qty'], p.get('new_row'), p.get('row'), p.get('user', ""), op_id=key)
+
+
+def _move(db, key, created, p):
+    return inventory_ops.move_stock(db, p['loc_id'], p['target'], p.get('user', ""), op_id=key)
+
+
+def _approve(db, key, created, p):
+    return inventory_ops.approve_request(db, p['request_id'], p['location_id'], p.get('user', ""), op_id=key)
+
+
+def _reject(db, key, created, p):
+    inventory_ops.reject_request(db, p['request_id'], op_id=key)
+
+
+ACTIONS = {"request": _request, "cart": _cart, "add_stock": _add_stock, "move": _move, "approve": _approve, "reject": _reject}
+
+
+class WriteQueue:
+    def __init__(self, db, path=QUEUE_PATH, retry_interval=RETRY_INTERVAL, actions=ACTIONS):
+        self._db = db
+        self._actions = actions
+        self.retry_interval = retry_interval
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS outbox (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL UNIQUE, action TEXT NOT NULL,
+            payload TEXT NOT NULL, created REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT, failed INTEGER NOT NULL DEFAULT 0)""")
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.metrics = {"queued": 0, "replayed": 0, "failed": 0, "online": True, "last_error": None}
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _sql(self, sql, args=()):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def pending(self):
+        return self._sql("SELECT COUNT(*) FROM outbox WHERE failed = 0")[0][0]
+
+    def failed(self):
+        # [(seq, action, payload, created, error)]
+        return [(seq, action, json.loads(payload), created, error) for seq, action, payload, created, error in
+                self._sql("SELECT seq, action, payload, created, error FROM outbox WHERE failed = 1 ORDER BY seq")]
+
+    def dismiss(self, seq):
+        self._sql("DELETE FROM outbox WHERE seq = ?", (seq,))
+
+    # metrics משותף לתהליכון הרקע ולריצות Streamlit - כל שינוי וקריאה תחת המנעול
+    def _count(self, key, n=1):
+        with self._lock:
+            self.metrics[key] += n
+
+    def _set(self, **values):
+        with self._lock:
+            self.metrics.update(values)
+
+    def _online(self):
+        with self._lock:
+            return self.metrics["online"]
+
+    def _offline(self, error):
+        self._set(online=False, last_error=str(error))
+
+    def submit(self, action, payload, key=None):
+        # מחזיר (True, תוצאה) אם נכתב עכשיו, (False, None) אם נשמר בתור
+        key = key or uuid.uuid4().hex
+        created = time.time()
+        if not self.pending():
+            try:
+                result = self._actions[action](self._db, key, created, payload)
+                self._set(online=True)
+                return True, result
+            except NETWORK_ERRORS as e:
+                self._offline(e)
+        self._sql("INSERT OR IGNORE INTO outbox (key, action, payload, created) VALUES (?, ?, ?, ?)",
+                  (key, action, json.dumps(payload, ensure_ascii=False, default=str), created))
+        self._count("queued")
+        self._wake.set()
+        return False, None
+
+    def flush(self):
+        # שולח לפי הסדר עד שגיאת התקשורת הראשונה; מחזיר כמה פעולות נשלחו
+        sent = 0
+        with self._flush_lock:
+            while True:
+                rows = self._sql("SELECT seq, key, action, payload, created FROM outbox WHERE failed = 0 ORDER BY seq LIMIT 1")
+                if not rows:
+                    self._set(online=True)
+                    return sent
+                seq, key, action, payload, created = rows[0]
+                try:
+                    self._actions[action](self._db, key, created, json.loads(payload))
+                except NETWORK_ERRORS as e:
+                    self._sql("UPDATE outbox SET attempts = attempts + 1, error = ? WHERE seq = ?", (str(e), seq))
+                    self._offline(e)
+                    return sent
+                except RETRYABLE_ERRORS as e:
+                    # הרשת תקינה - עוצרים כדי לשמור על הסדר, וממשיכים אחרי RETRY_INTERVAL
+                    self._sql("UPDATE outbox SET attempts = attempts + 1, error = ? WHERE seq = ?", (str(e), seq))
+                    self._set(last_error=str(e))
+                    return sent
+                except Exception as e:
+                    self._sql("UPDATE outbox SET attempts = attempts + 1, error = ?, failed = 1 WHERE seq = ?", (str(e), seq))
+                    self._count("failed")
+                    continue
+                self._sql("DELETE FROM outbox WHERE seq = ?", (seq,))
+                self._count("replayed")
+                sent += 1
+
+    def _run(self):
+        delay = self.retry_interval
+        while not self._closed:
+            self._wake.wait(delay)
+            self._wake.clear()
+            if self._closed or not self.pending():
+                continue
+            self.flush()
+            # רשת לא זמינה - מרווח הולך וגדל עד MAX_BACKOFF; הצלחה מחזירה למרווח הרגיל
+            delay = self.retry_interval if self._online() else min(MAX_BACKOFF, delay * 2)
+
+    def close(self, timeout=5.0):
+        if self._thread.is_alive():
+            self._closed = True
+            self._wake.set()
+            self._thread.join(timeout)